@@ -0,0 +1,222 @@
+"""
+Offline benchmark of the advanced RAG pipeline.
+
+Runs PDF chunking, ingestion, vector queries and the full HyDE and multi-query
+expansion flows against the local OpenAI-compatible stub server (``tools/``), so it
+needs neither network access nor an api key. Every run starts from empty storage and
+caches in a temporary directory. The results (chunks per second, query latency
+percentiles, peak RSS) are printed and saved as JSON, and a run can be compared with
+the JSON of an earlier one to catch regressions.
+
+Usage:
+    python benchmark.py --output bench/baseline.json
+    python benchmark.py --baseline bench/baseline.json  # exits with 1 on regressions
+    python benchmark.py --backend numpy --latency-ms 200 --token-latency-ms 5
+"""
+
+from rag_common.benchmarking import (
+    compare_reports,
+    latency_stats,
+    make_report,
+    peak_rss_mb,
+    quiet_stdout,
+    save_report,
+    stub_server,
+    time_calls,
+)
+from typing import Any
+import argparse
+import json
+import os
+import tempfile
+import time
+
+
+# questions about the annual report, numbered so no stage is answered from a cache
+QUESTIONS = [
+    "What details can you provide about the factors that led to revenue growth?",
+    "How did Azure and other cloud services perform?",
+    "What were the main operating expenses?",
+    "How much did Microsoft return to shareholders?",
+    "What risks does the company see in artificial intelligence?",
+]
+
+
+def benchmark_questions(n: int, offset: int = 0) -> list[str]:
+    """
+    Generate distinct benchmark questions.
+
+    Args:
+        n (int): Number of questions.
+        offset (int): Run number to start from. Stages pass disjoint ranges so the
+                      query and completion caches filled by one stage miss in the next.
+
+    Returns:
+        list[str]: The questions, cycling through ``QUESTIONS`` with a run number.
+    """
+    return [
+        f"{QUESTIONS[i % len(QUESTIONS)]} (#{i + 1})" for i in range(offset, offset + n)
+    ]
+
+
+def run_benchmark(args: argparse.Namespace, storage: str) -> dict[str, Any]:
+    """
+    Run every stage of the benchmark against the stub server.
+
+    Args:
+        args (argparse.Namespace): The command line settings.
+        storage (str): Empty directory for the vector store and caches.
+
+    Returns:
+        dict[str, Any]: The metrics of every stage.
+    """
+    # the openai clients and caches are created at import time, after the stub started
+    from chroma import ChromaDb
+    from main import run_expanded_multiple_queries, run_expanded_single_query
+    from numpy_db import NumpyDb
+    from pdf_processor import PDFChunkGenerator
+
+    stages: dict[str, Any] = {}
+    collection_name = "benchmark"
+
+    print(f"📄 Chunking {args.pdf}...")
+    started = time.perf_counter()
+    with quiet_stdout():
+        generator = PDFChunkGenerator(
+            args.pdf, workers=args.pdf_workers, use_cache=False
+        )
+        chunks = generator.get_chunks()
+        chunk_ids = generator.get_chunk_ids()
+    elapsed = time.perf_counter() - started
+    stages["pdf_chunking"] = {
+        "chunks": len(chunks),
+        "total_seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(chunks) / elapsed, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"📥 Ingesting {len(chunks)} chunks into {args.backend}...")
+    db = (
+        NumpyDb(
+            storage_path=os.path.join(storage, "numpy_db"),
+            quantization=args.quantization,
+        )
+        if args.backend == "numpy"
+        else ChromaDb(storage_path=os.path.join(storage, "chroma"))
+    )
+    db.create_collection(collection_name)
+    started = time.perf_counter()
+    with quiet_stdout():
+        db.add_chunks(chunk_ids, chunks, collection_name)
+    elapsed = time.perf_counter() - started
+    stages["ingestion"] = {
+        "chunks": len(chunks),
+        "total_seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(chunks) / elapsed, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"🔍 Running {args.queries} queries...")
+    timings = time_calls(
+        lambda question: db.query_documents(
+            question, collection_name, n_results=args.n_results, hybrid=args.hybrid
+        ),
+        benchmark_questions(args.queries),
+    )
+    stages["query"] = {"latency": latency_stats(timings), "peak_rss_mb": peak_rss_mb()}
+
+    flows = {
+        "single_query_flow": run_expanded_single_query,
+        "multi_query_flow": run_expanded_multiple_queries,
+    }
+    for i, (stage, flow) in enumerate(flows.items()):
+        print(f"🧠 Running {args.flow_queries} {stage.replace('_', ' ')}s...")
+        timings = time_calls(
+            lambda question: flow(
+                db,
+                question,
+                collection_name,
+                n_results=args.n_results,
+                hybrid=args.hybrid,
+            ),
+            benchmark_questions(
+                args.flow_queries, offset=args.queries + i * args.flow_queries
+            ),
+        )
+        stages[stage] = {
+            "latency": latency_stats(timings),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    return stages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the advanced RAG pipeline offline"
+    )
+    parser.add_argument("--pdf", default="data/microsoft-annual-report.pdf")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="chroma")
+    parser.add_argument(
+        "--quantization", choices=["float32", "float16", "int8"], default="float32"
+    )
+    parser.add_argument("--pdf-workers", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=50, help="vector queries")
+    parser.add_argument(
+        "--flow-queries", type=int, default=10, help="questions per expansion flow"
+    )
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--hybrid", action="store_true")
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="stub delay per request, the time to first token of answers",
+    )
+    parser.add_argument(
+        "--token-latency-ms", type=float, default=0, help="stub delay per answer token"
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="report of an earlier run to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative change of a metric counted as a regression (default: 0.2)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="rag-benchmark-") as storage:
+        # fresh caches, so every run embeds and generates everything
+        os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(storage, "embeddings.sqlite")
+        os.environ["COMPLETION_CACHE_PATH"] = os.path.join(
+            storage, "completions.sqlite"
+        )
+        with stub_server(args.latency_ms, args.token_latency_ms):
+            stages = run_benchmark(args, storage)
+
+    config = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("output", "baseline", "tolerance")
+    }
+    report = make_report("advanced_rag", config, stages)
+    save_report(report, args.output)
+    print(json.dumps(report["stages"], indent=2))
+    print(f"💾 Peak RSS {report['peak_rss_mb']} MiB, results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print("⚠️ The baseline was run with other settings, compare with care")
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"✅ No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
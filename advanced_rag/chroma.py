@@ -1,9 +1,107 @@
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
 import chromadb
 from chromadb.api.types import EmbeddingFunction, Embeddable
 from chromadb.api.models.Collection import Collection, QueryResult
-from typing import cast
+from chromadb.errors import NotFoundError
+from typing import TypedDict, cast
 from util import load_and_get_key
+from rag_common.embedding_cache import CachedOpenAIEmbeddingFunction
+from rag_common.embedding_engine import MODEL_DIMENSIONS, EmbeddingEngine
+from rag_common.lexical_index import LexicalIndex
+from rag_common.query_cache import QueryCache
+from rag_common.tracing import tracer
+import os
+import threading
+
+
+# damping constant of reciprocal rank fusion, 60 is the value from the original paper
+RRF_K = 60
+
+# collection metadata entry recording the dimensionality of the stored embeddings
+DIMENSIONS_KEY = "embedding_dimensions"
+
+
+class RankedChunk(TypedDict):
+    chunk_id: str
+    document: str
+
+
+class FusedResult(TypedDict):
+    chunk_id: str
+    document: str
+    score: float
+
+
+def fuse_rankings(
+    rankings: list[list[RankedChunk]], n_results: int, rrf_k: int = RRF_K
+) -> list[FusedResult]:
+    """
+    Merge several rankings of chunks into one with reciprocal rank fusion.
+
+    A chunk ranked ``r`` (1-based) in a ranking gains ``1 / (rrf_k + r)``, so chunks found
+    by several rankings, or near the top of one, rise to the top. Ties keep the order in
+    which the chunks were first seen.
+
+    Args:
+        rankings (list[list[RankedChunk]]): The rankings to merge, each best first.
+        n_results (int): Number of fused results to return.
+        rrf_k (int, optional): Rank damping constant. Defaults to 60.
+
+    Returns:
+        list[FusedResult]: The global top ``n_results`` chunks, best first, with their
+                           fusion scores.
+
+    Example:
+        >>> raw = [{"chunk_id": "a", "document": "..."}, {"chunk_id": "b", "document": "..."}]
+        >>> expanded = [{"chunk_id": "b", "document": "..."}]
+        >>> [result["chunk_id"] for result in fuse_rankings([raw, expanded], 2)]
+        ['b', 'a']
+    """
+    scores: dict[str, float] = {}
+    documents: dict[str, str] = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            chunk_id = chunk["chunk_id"]
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (rrf_k + rank)
+            documents[chunk_id] = chunk["document"]
+
+    ranked = sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)
+    return [
+        {
+            "chunk_id": chunk_id,
+            "document": documents[chunk_id],
+            "score": scores[chunk_id],
+        }
+        for chunk_id in ranked[:n_results]
+    ]
+
+
+def check_dimensions(
+    collection_name: str, metadata: dict | None, dimensions: int | None
+) -> bool:
+    """
+    Check that a collection stores embeddings of the configured dimensionality.
+
+    Collections created before the dimensionality was recorded are accepted.
+
+    Args:
+        collection_name (str): The name of the collection.
+        metadata (dict | None): The collection metadata.
+        dimensions (int | None): The dimensionality of the configured embeddings, None
+                                 if it is not known.
+
+    Returns:
+        bool: False (after printing an error) if the collection records another
+              dimensionality, True otherwise.
+    """
+    stored = (metadata or {}).get(DIMENSIONS_KEY)
+    if stored is None or dimensions is None or int(stored) == dimensions:
+        return True
+
+    print(
+        f'Error: Collection "{collection_name}" stores {stored}-dimensional embeddings, '
+        f"but {dimensions}-dimensional embeddings are configured"
+    )
+    return False
 
 
 class ChromaDb:
@@ -19,6 +117,8 @@ class ChromaDb:
     Singleton Behavior:
         - Only one instance of ChromaDb can exist per application
         - All calls to ChromaDb() return the same instance
+        - Later calls must ask for the storage path and dimensions of the first one, as
+          the instance cannot switch to others
         - Database connection and embedding function are shared across the application
         - Thread-safe initialization ensures proper setup in multi-threaded environments
 
@@ -27,8 +127,24 @@ class ChromaDb:
         _initialized (bool): Flag to track whether the singleton has been initialized.
 
     Instance Attributes:
+        storage_path (str): Directory where ChromaDB persists its data, next to the lexical
+            indexes of the collections ("<collection>.lexical.npz" and ".json").
         client (chromadb.PersistentClient): ChromaDB persistent client for database operations.
-        ef (OpenAIEmbeddingFunction): OpenAI embedding function for generating text embeddings.
+        engine (EmbeddingEngine): Concurrent, rate limit aware client for the embeddings api.
+        ef (CachedOpenAIEmbeddingFunction): OpenAI embedding function for generating text
+            embeddings, backed by the persistent on-disk embedding cache and the engine.
+        query_cache (QueryCache): In-process cache of query embeddings and query results.
+            Writes through ``add_chunks`` and ``delete_stale_chunks`` invalidate the
+            results of the collection they change.
+        dimensions (int | None): Dimensionality of the embeddings. It is recorded in the
+            metadata of new collections, and collections recording another one are
+            rejected, as their vectors cannot be compared with the queries.
+
+    Every collection also has a BM25 lexical index (see ``LexicalIndex``), kept in sync by
+    ``add_chunks`` and ``delete_stale_chunks``. Queries can fuse it with the vector search
+    (``hybrid=True``), which finds chunks naming the entities and figures of a question
+    that the embeddings miss, or use it to restrict the vector search to the chunks
+    sharing terms with the question (``prefilter``).
 
     Example:
         >>> db1 = ChromaDb()
@@ -49,24 +165,59 @@ class ChromaDb:
 
         return cls._instance
 
-    def __init__(self, storage_path: str = "./chroma") -> None:
+    def __init__(
+        self, storage_path: str = "./chroma", dimensions: int | None = None
+    ) -> None:
         """
         Initialize the ChromaDB client with persistent storage and OpenAI embeddings.
 
         Args:
             storage_path (str, optional): Path to the directory where ChromaDB will store
                                         persistent data. Defaults to "./chroma".
+            dimensions (int | None, optional): Number of dimensions the embeddings are
+                                             shortened to by the api (text-embedding-3
+                                             models only). Defaults to None (1536).
+
+        Raises:
+            ValueError: If the instance was already initialized with another storage path
+                        or dimensionality.
         """
-        # skip if an instance has been already initialized
+        # skip if an instance has been already initialized, unless it was set up for
+        # another store, which the caller would otherwise silently not get
         if self._initialized:
+            requested = dimensions or MODEL_DIMENSIONS["text-embedding-3-small"]
+            if (
+                os.path.abspath(storage_path) != os.path.abspath(self.storage_path)
+                or requested != self.dimensions
+            ):
+                raise ValueError(
+                    f"ChromaDb is already initialized with storage_path="
+                    f'"{self.storage_path}" and dimensions={self.dimensions}, got '
+                    f'storage_path="{storage_path}" and dimensions={requested}'
+                )
             return
 
         # initialize the chroma client with persistent storage
+        self.storage_path = storage_path
         self.client = chromadb.PersistentClient(storage_path)
         # use openai's embedding llm instead of the default embedding llm provided by chromadb
-        self.ef = OpenAIEmbeddingFunction(
-            api_key=load_and_get_key(), model_name="text-embedding-3-small"
+        api_key = load_and_get_key()
+        self.engine = EmbeddingEngine(
+            model="text-embedding-3-small", dimensions=dimensions, api_key=api_key
+        )
+        self.ef = CachedOpenAIEmbeddingFunction(
+            api_key=api_key,
+            model_name="text-embedding-3-small",
+            dimensions=dimensions,
+            fetch=self.engine.embed,
         )
+        self.dimensions = self.engine.output_dimensions
+        self.query_cache = QueryCache()
+        # collection handles reused by queries, so hot queries skip the lookup
+        self._collections: dict[str, Collection] = {}
+        # lexical indexes opened so far, guarded by the lock as queries may run in threads
+        self._lexical: dict[str, LexicalIndex] = {}
+        self._lexical_lock = threading.Lock()
         self._initialized = True
 
     def create_collection(
@@ -86,36 +237,111 @@ class ChromaDb:
 
         Returns:
             Collection: The ChromaDB collection object for storing and querying documents.
+
+        Raises:
+            ValueError: If an existing collection stores embeddings of another
+                        dimensionality.
         """
-        return self.client.get_or_create_collection(
+        collection = self.client.get_or_create_collection(
             name=collection_name,
             # ? the cast is to fix a type checker bug. Alternative is to comment the line with "# type: ignore"
             embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
-            metadata=metadata,
+            metadata={DIMENSIONS_KEY: self.dimensions, **(metadata or {})}
+            if self.dimensions
+            else metadata,
         )
+        if not check_dimensions(collection_name, collection.metadata, self.dimensions):
+            raise ValueError(
+                f'Collection "{collection_name}" stores embeddings of another '
+                "dimensionality, use another collection or storage path"
+            )
+        self._collections[collection_name] = collection
+        return collection
+
+    def get_collection_metadata(self, collection_name: str) -> dict | None:
+        """
+        Get the metadata stored with a collection.
 
-    def add_chunks(
-        self, chunk_ids: list[str], chunks: list[str], collection_name: str, **kwargs
+        Args:
+            collection_name (str): The name of the collection.
+
+        Returns:
+            dict | None: The collection metadata (empty if none was set), or None if
+                         the collection was not found.
+        """
+        try:
+            collection: Collection = self.client.get_collection(
+                name=collection_name,
+                embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
+            )
+        except NotFoundError:
+            print(f'Error: Collection "{collection_name}" not found')
+            return None
+
+        return dict(collection.metadata or {})
+
+    def update_collection_metadata(
+        self, collection_name: str, metadata: dict[str, str]
     ) -> None:
+        """
+        Merge entries into the metadata stored with a collection.
+
+        Chroma replaces the whole metadata on modification, so the existing entries are
+        carried over and only the given keys are added or overwritten.
+
+        Args:
+            collection_name (str): The name of the collection.
+            metadata (dict[str, str]): The entries to add or overwrite.
+
+        Example:
+            >>> db.update_collection_metadata("docs", {"report:fingerprint": "9195cf6a..."})
+        """
+        try:
+            collection: Collection = self.client.get_collection(
+                name=collection_name,
+                embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
+            )
+        except NotFoundError:
+            print(f'Error: Collection "{collection_name}" not found')
+            return
+
+        collection.modify(metadata={**(collection.metadata or {}), **metadata})
+
+    def add_chunks(
+        self,
+        chunk_ids: list[str],
+        chunks: list[str],
+        collection_name: str,
+        skip_existing: bool = False,
+        **kwargs,
+    ) -> int:
         """
         Add document chunks to a ChromaDB collection.
 
         This method takes lists of chunk IDs and document content and stores them in the specified
-        collection. The embeddings are automatically generated using the configured OpenAI embedding function.
+        collection. The embeddings are automatically generated using the configured OpenAI embedding function,
+        so chunks whose text was embedded before are served from the embedding cache. The
+        chunks are also added to the collection's lexical index.
+
+        With content-derived chunk IDs (see ``PDFChunkGenerator``), an ID already present in the
+        collection implies the same content is stored under it. ``skip_existing`` uses this to
+        embed and upsert only the chunks the collection does not have yet, so re-ingesting a
+        revised document only costs its changed chunks.
 
         Args:
             chunk_ids (list[str]): List of unique identifiers for each document chunk.
             chunks (list[str]): List of document content strings to store.
             collection_name (str): The name of the collection where chunks will be stored.
+            skip_existing (bool, optional): Whether to skip chunks whose ID is already in the
+                                            collection. Defaults to False (upsert every chunk).
             **kwargs: Additional parameters passed to ChromaDB's upsert method:
                 - embeddings (list[list[float]], optional): Pre-computed embeddings if not using embedding function
                 - metadatas (list[dict], optional): Metadata dictionaries for each document
 
         Returns:
-            None: Stores the chunks in the database or prints an error if collection not found.
-
-        Raises:
-            ValueError: If the specified collection does not exist in the database.
+            int: The number of chunks upserted, 0 if there were none to upsert, the
+                 collection was not found or it stores embeddings of another
+                 dimensionality.
 
         Example:
             >>> db = ChromaDb()
@@ -129,18 +355,105 @@ class ChromaDb:
 
         # retrieve the collection
         try:
-            collection: Collection = self.client.get_collection(name=collection_name)
-            collection.upsert(ids=chunk_ids, documents=chunks, **kwargs)
-
-        except ValueError:
+            collection: Collection = self.client.get_collection(
+                name=collection_name,
+                embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
+            )
+            if not check_dimensions(
+                collection_name, collection.metadata, self.dimensions
+            ):
+                return 0
+
+            if skip_existing and chunk_ids:
+                existing = set(collection.get(ids=chunk_ids, include=[])["ids"])
+                keep = [
+                    i
+                    for i, chunk_id in enumerate(chunk_ids)
+                    if chunk_id not in existing
+                ]
+
+                # per-chunk arguments have to be filtered along with the chunks
+                chunk_ids = [chunk_ids[i] for i in keep]
+                chunks = [chunks[i] for i in keep]
+                for name in ("embeddings", "metadatas"):
+                    if kwargs.get(name) is not None:
+                        kwargs[name] = [kwargs[name][i] for i in keep]
+            # chroma rejects an upsert of empty lists
+            if not chunk_ids:
+                return 0
+
+            # opened before the upsert, so an index in need of a rebuild misses nothing
+            lexical = self.__lexical_index(collection_name)
+            with tracer.span(
+                "db.upsert",
+                backend="chroma",
+                collection=collection_name,
+                chunks=len(chunk_ids),
+            ):
+                collection.upsert(ids=chunk_ids, documents=chunks, **kwargs)
+                lexical.add(chunk_ids, chunks)
+                lexical.save()
+            self.query_cache.invalidate(collection_name)
+            return len(chunk_ids)
+
+        except NotFoundError:
             print(f'Error: Collection "{collection_name}" not found')
+            return 0
+
+    def delete_stale_chunks(
+        self, doc_id: str, chunk_ids: list[str], collection_name: str
+    ) -> int:
+        """
+        Delete the chunks of a document that are no longer part of its current version.
+
+        Relies on the "<doc_id>:" prefix of the chunk IDs produced by ``PDFChunkGenerator``.
+
+        Args:
+            doc_id (str): Identity of the document.
+            chunk_ids (list[str]): IDs of the chunks in the current version of the document.
+            collection_name (str): The name of the collection holding the chunks.
+
+        Returns:
+            int: The number of deleted chunks, 0 if the collection was not found.
 
+        Example:
+            >>> pdf = PDFChunkGenerator("data/report.pdf")
+            >>> db.add_chunks(pdf.get_chunk_ids(), pdf.get_chunks(), "docs", skip_existing=True)
+            >>> db.delete_stale_chunks(pdf.doc_id, pdf.get_chunk_ids(), "docs")
+        """
+        try:
+            collection: Collection = self.client.get_collection(
+                name=collection_name,
+                embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
+            )
+        except NotFoundError:
+            print(f'Error: Collection "{collection_name}" not found')
+            return 0
+
+        current = set(chunk_ids)
+        stale = [
+            chunk_id
+            for chunk_id in collection.get(include=[])["ids"]
+            if chunk_id.startswith(f"{doc_id}:") and chunk_id not in current
+        ]
+        if stale:
+            lexical = self.__lexical_index(collection_name)
+            collection.delete(ids=stale)
+            lexical.delete(stale)
+            lexical.save()
+            self.query_cache.invalidate(collection_name)
+        return len(stale)
+
+    @tracer.traced("db.query")
     def query_documents(
         self,
         question: str | list[str],
         collection_name: str,
         n_results=2,
         deduplicate=True,
+        fuse=False,
+        hybrid=False,
+        prefilter: int | None = None,
         **kwargs,
     ) -> QueryResult | list[str] | None:
         """
@@ -158,6 +471,16 @@ class ChromaDb:
                                      Defaults to 2.
             deduplicate (bool, optional): Whether to remove duplicate documents when using
                                         multiple queries. Defaults to True.
+            fuse (bool, optional): Whether to merge the results of multiple queries with
+                                 reciprocal rank fusion (see ``query_fused``) and return
+                                 the global top ``n_results`` documents, best first, instead
+                                 of ``n_results`` per query. Defaults to False.
+            hybrid (bool, optional): Whether to fuse the vector search with a BM25 search
+                                   of the collection's lexical index (see
+                                   ``query_rankings``). Implies ``fuse``. Defaults to False.
+            prefilter (int | None, optional): Restrict the vector search to the top
+                                              ``prefilter`` BM25 matches of every query.
+                                              Defaults to None (search every chunk).
             **kwargs: Additional parameters passed to ChromaDB's query method:
                 - where (dict, optional): Metadata filtering conditions
                 - where_document (dict, optional): Document content filtering conditions
@@ -169,10 +492,8 @@ class ChromaDb:
             QueryResult | list[str] | None:
                 - If 'include' is specified in kwargs: Returns the full QueryResult object
                 - If 'include' not specified (default): Returns list[str] of document chunks
-                - Returns None if collection is not found
-
-        Raises:
-            ValueError: If the specified collection does not exist in the database.
+                - Returns None if collection is not found or stores embeddings of
+                  another dimensionality
 
         Examples:
             >>> db = ChromaDb()
@@ -185,6 +506,12 @@ class ChromaDb:
             >>> docs = db.query_documents(["What is revenue?", "What is profit?"], "docs")
             >>> print(docs)  # Deduplicated results
 
+            # Multiple queries fused into one ranking of 5 documents
+            >>> docs = db.query_documents(["What is revenue?", "What is profit?"], "docs", n_results=5, fuse=True)
+
+            # Vector and BM25 rankings fused, for questions naming entities or figures
+            >>> docs = db.query_documents("What was Slack's FY23 revenue?", "docs", n_results=3, hybrid=True)
+
             # Multiple queries without deduplication
             >>> docs = db.query_documents(["What is revenue?", "What is profit?"], "docs", deduplicate=False)
             >>> print(docs)  # May contain duplicates
@@ -197,8 +524,23 @@ class ChromaDb:
             >>> print(results['documents'])  # Document content
             >>> print(results['distances'])  # Similarity scores
         """
+        if (fuse or hybrid) and not kwargs.get("include"):
+            fused = self.query_fused(
+                question,
+                collection_name,
+                n_results,
+                hybrid=hybrid,
+                prefilter=prefilter,
+                **kwargs,
+            )
+            return None if fused is None else [result["document"] for result in fused]
+
+        queries = [question] if isinstance(question, str) else list(question)
+
         try:
-            collection: Collection = self.client.get_collection(name=collection_name)
+            candidates = self.__prefilter(collection_name, queries, prefilter)
+            if candidates is not None:
+                kwargs["ids"] = candidates
 
             # check if user specified custom 'include' parameter
             include_param = kwargs.get("include")
@@ -206,9 +548,9 @@ class ChromaDb:
             # if no custom include specified, default to documents only for backward compatibility
             if not include_param:
                 kwargs["include"] = ["documents"]
-                results: QueryResult = collection.query(
-                    query_texts=question, n_results=n_results, **kwargs
-                )
+                results = self.__search(collection_name, queries, n_results, **kwargs)
+                if results is None:
+                    return None
 
                 # extract and flatten documents for backward compatibility
                 documents = results.get("documents", [])
@@ -232,11 +574,290 @@ class ChromaDb:
                 return relevant_chunks
             else:
                 # user specified custom include, return full QueryResult
-                results: QueryResult = collection.query(
-                    query_texts=question, n_results=n_results, **kwargs
+                return self.__search(collection_name, queries, n_results, **kwargs)
+
+        except NotFoundError:
+            print(f'Error: Collection "{collection_name}" not found')
+            return None
+
+    def query_rankings(
+        self,
+        questions: str | list[str],
+        collection_name: str,
+        n_results: int = 5,
+        hybrid: bool = False,
+        prefilter: int | None = None,
+        **kwargs,
+    ) -> list[list[RankedChunk]] | None:
+        """
+        Retrieve the ranking of chunks of every query, embedding all queries at once.
+
+        All queries are embedded with a single (cached) embedding call and searched with a
+        single ChromaDB query over the matrix of query embeddings, unless the same search
+        was answered before (see ``query_cache``).
+
+        With ``hybrid``, every query is also ranked by BM25 over the collection's lexical
+        index, so fusing the rankings (``fuse_rankings``) combines both retrievers: chunks
+        naming the exact entities and figures of a question ("Slack", "FY23") rise even
+        when their embeddings are not the closest, and fewer results are needed for the
+        same answer. With ``prefilter``, the vector search only scores the chunks among
+        the top ``prefilter`` BM25 matches of the queries; queries sharing no term with
+        the collection search every chunk.
+
+        Args:
+            questions (str | list[str]): The question(s) to search for.
+            collection_name (str): The name of the collection to search within.
+            n_results (int, optional): Number of chunks retrieved per query. Defaults to 5.
+            hybrid (bool, optional): Whether to add a BM25 ranking per query. Defaults to
+                                   False.
+            prefilter (int | None, optional): Number of BM25 matches per query the vector
+                                              search is restricted to. Defaults to None
+                                              (search every chunk).
+            **kwargs: Additional filters passed to ChromaDB's query method (``where``,
+                      ``where_document``). They also apply to the BM25 rankings.
+
+        Returns:
+            list[list[RankedChunk]] | None: One vector search ranking per query, in query
+                                            order and best first, followed with ``hybrid``
+                                            by one BM25 ranking per query, or None if the
+                                            collection is not found.
+
+        Example:
+            >>> rankings = db.query_rankings(["What is revenue?", "What is profit?"], "docs")
+            >>> fused = fuse_rankings(rankings, n_results=5)
+            >>> rankings = db.query_rankings("Slack FY23 revenue", "docs", hybrid=True)
+            >>> fused = fuse_rankings(rankings, n_results=3)
+        """
+        queries = [questions] if isinstance(questions, str) else list(questions)
+        if not queries:
+            return []
+
+        kwargs["include"] = ["documents"]
+        try:
+            candidates = self.__prefilter(collection_name, queries, prefilter)
+            if candidates is not None:
+                kwargs["ids"] = candidates
+            results = self.__search(collection_name, queries, n_results, **kwargs)
+            if results is None:
+                return None
+
+            rankings: list[list[RankedChunk]] = [
+                [
+                    {"chunk_id": chunk_id, "document": document}
+                    for chunk_id, document in zip(ids, docs)
+                    if document is not None
+                ]
+                for ids, docs in zip(results["ids"], results.get("documents") or [])
+            ]
+            if hybrid:
+                rankings.extend(
+                    self.__lexical_rankings(
+                        collection_name,
+                        queries,
+                        n_results,
+                        where=kwargs.get("where"),
+                        where_document=kwargs.get("where_document"),
+                    )
                 )
-                return results
+            return rankings
 
-        except ValueError:
+        except NotFoundError:
             print(f'Error: Collection "{collection_name}" not found')
             return None
+
+    def query_fused(
+        self,
+        questions: str | list[str],
+        collection_name: str,
+        n_results: int = 5,
+        n_candidates: int | None = None,
+        rrf_k: int = RRF_K,
+        hybrid: bool = False,
+        prefilter: int | None = None,
+        **kwargs,
+    ) -> list[FusedResult] | None:
+        """
+        Retrieve one ranking for several queries with reciprocal rank fusion.
+
+        All queries are embedded with a single (cached) embedding call and searched with a
+        single ChromaDB query over the matrix of query embeddings. The per-query rankings
+        are then fused on chunk ID: a chunk ranked ``r`` (1-based) by a query gains
+        ``1 / (rrf_k + r)``, so chunks found by several queries, or near the top of one,
+        rise to the top. Only the global top ``n_results`` are returned, however many
+        queries there are.
+
+        Args:
+            questions (str | list[str]): The question(s), e.g. the original question
+                                         followed by LLM-generated subqueries.
+            collection_name (str): The name of the collection to search within.
+            n_results (int, optional): Number of fused results to return. Defaults to 5.
+            n_candidates (int | None, optional): Number of results retrieved per query
+                                                 before fusion. Defaults to None (n_results).
+            rrf_k (int, optional): Rank damping constant. Defaults to 60.
+            hybrid (bool, optional): Whether to fuse a BM25 ranking per query as well (see
+                                   ``query_rankings``). Defaults to False.
+            prefilter (int | None, optional): Number of BM25 matches per query the vector
+                                              search is restricted to. Defaults to None
+                                              (search every chunk).
+            **kwargs: Additional filters passed to ChromaDB's query method (``where``,
+                      ``where_document``).
+
+        Returns:
+            list[FusedResult] | None: The fused results, best first, each with its chunk ID,
+                                      document and fusion score, or None if the collection
+                                      is not found.
+
+        Example:
+            >>> results = db.query_fused(["What is revenue?", "How did sales grow?"], "docs")
+            >>> for result in results:
+            ...     print(f"{result['score']:.4f} {result['chunk_id']}")
+        """
+        rankings = self.query_rankings(
+            questions,
+            collection_name,
+            n_candidates or n_results,
+            hybrid=hybrid,
+            prefilter=prefilter,
+            **kwargs,
+        )
+        if rankings is None:
+            return None
+
+        return fuse_rankings(rankings, n_results, rrf_k)
+
+    def __get_collection(self, collection_name: str) -> Collection:
+        """
+        Get a collection handle, looking it up only the first time.
+
+        Raises:
+            NotFoundError: If the specified collection does not exist in the database.
+        """
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            collection = self.client.get_collection(
+                name=collection_name,
+                embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
+            )
+            self._collections[collection_name] = collection
+        return collection
+
+    def __lexical_index(self, collection_name: str) -> LexicalIndex:
+        """
+        Get the lexical index of a collection, opening it only the first time.
+
+        An index not covering the collection, e.g. of a collection ingested before lexical
+        indexes existed, is rebuilt from the stored documents.
+
+        Raises:
+            NotFoundError: If the specified collection does not exist in the database.
+        """
+        with self._lexical_lock:
+            lexical = self._lexical.get(collection_name)
+            if lexical is None:
+                collection = self.__get_collection(collection_name)
+                lexical = LexicalIndex(
+                    os.path.join(self.storage_path, f"{collection_name}.lexical")
+                )
+                if len(lexical) != collection.count():
+                    stored = collection.get(include=["documents"])
+                    lexical.clear()
+                    lexical.add(
+                        stored["ids"],
+                        [document or "" for document in stored["documents"] or []],
+                    )
+                    lexical.save()
+                self._lexical[collection_name] = lexical
+            return lexical
+
+    def __prefilter(
+        self, collection_name: str, queries: list[str], prefilter: int | None
+    ) -> list[str] | None:
+        """
+        Get the IDs a vector search is restricted to, None to search every chunk.
+
+        Raises:
+            NotFoundError: If the specified collection does not exist in the database.
+        """
+        if not prefilter:
+            return None
+        candidates = self.__lexical_index(collection_name).candidates(
+            queries, prefilter
+        )
+        return candidates or None
+
+    def __lexical_rankings(
+        self, collection_name: str, queries: list[str], n_results: int, **filters
+    ) -> list[list[RankedChunk]]:
+        """
+        Rank the chunks of a collection by BM25 for every query.
+
+        The documents of the ranked chunks are fetched with one ChromaDB call, which also
+        applies the metadata and document filters.
+
+        Raises:
+            NotFoundError: If the specified collection does not exist in the database.
+        """
+        lexical = self.__lexical_index(collection_name)
+        hits = [
+            [chunk_id for chunk_id, _ in lexical.search(query, n_results)]
+            for query in queries
+        ]
+        wanted = list(
+            dict.fromkeys(chunk_id for ranking in hits for chunk_id in ranking)
+        )
+        if not wanted:
+            return [[] for _ in queries]
+
+        found = self.__get_collection(collection_name).get(
+            ids=wanted, include=["documents"], **filters
+        )
+        documents = {
+            chunk_id: document
+            for chunk_id, document in zip(found["ids"], found["documents"] or [])
+            if document is not None
+        }
+        return [
+            [
+                {"chunk_id": chunk_id, "document": documents[chunk_id]}
+                for chunk_id in ranking
+                if chunk_id in documents
+            ]
+            for ranking in hits
+        ]
+
+    def __search(
+        self, collection_name: str, queries: list[str], n_results: int, **kwargs
+    ) -> QueryResult | None:
+        """
+        Search a collection, reusing cached query embeddings and query results.
+
+        The queries are embedded through the query cache, and the results of a search are
+        cached under the collection's current version. A repeated search makes neither
+        an embedding call nor a vector search. Queries against a collection storing
+        embeddings of another dimensionality are rejected with None.
+
+        Raises:
+            NotFoundError: If the specified collection does not exist in the database.
+        """
+        collection = self.__get_collection(collection_name)
+        if not check_dimensions(collection_name, collection.metadata, self.dimensions):
+            return None
+        embeddings = self.query_cache.embed(queries, self.ef)
+        key = self.query_cache.result_key(
+            collection_name, embeddings, n_results, **kwargs
+        )
+
+        results = self.query_cache.get_result(key)
+        if results is None:
+            with tracer.span(
+                "db.search",
+                backend="chroma",
+                collection=collection_name,
+                queries=len(queries),
+                n_results=n_results,
+            ):
+                results = collection.query(
+                    query_embeddings=embeddings, n_results=n_results, **kwargs
+                )
+            self.query_cache.put_result(key, results)
+        return results
@@ -0,0 +1,397 @@
+from openai import AsyncOpenAI, OpenAI
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice, ChoiceDelta
+from rag_common.streaming import CompletionStream
+from rag_common.tracing import estimate_cost, tracer
+from typing import Any, AsyncIterator
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_CACHE_PATH = "./completion_cache.sqlite"
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# request parameters that change how a response is delivered, not what it is
+TRANSPORT_PARAMS = ("stream", "stream_options", "timeout", "extra_headers")
+
+
+class CompletionCache:
+    """
+    A persistent cache of chat completions backed by SQLite.
+
+    Every response is keyed by a canonical hash of the request: the model, the messages
+    and every sampling parameter, serialized as JSON with sorted keys, so equal requests
+    map to the same entry however their dictionaries were built. Parameters that only
+    change how the response is delivered (streaming, timeouts) are not part of the key,
+    so a streamed and a blocking request share their entry.
+
+    Entries expire ``ttl`` seconds after they were stored. When the summed size of the
+    stored responses exceeds the configured limit, the least recently used entries are
+    evicted. Every call can opt out of the cache with ``use_cache=False``.
+
+    The cache file location can be set through the ``COMPLETION_CACHE_PATH`` environment
+    variable.
+
+    Attributes:
+        path (str): Location of the SQLite database file.
+        ttl (float | None): Lifetime of an entry in seconds, None for no expiry.
+        max_bytes (int): Upper bound on the summed size of stored responses.
+        hits (int): Number of requests answered from the cache.
+        misses (int): Number of requests sent to the API.
+        saved_prompt_tokens (int): Prompt tokens of the requests answered from the cache.
+        saved_completion_tokens (int): Completion tokens of the requests answered from
+                                       the cache.
+
+    Example:
+        >>> cache = CompletionCache()
+        >>> response = cache.create(client, model="gpt-4.1-nano", messages=messages)
+        >>> response = cache.create(client, model="gpt-4.1-nano", messages=messages)
+        >>> print(cache.stats())  # {"hits": 1, "misses": 1, ...}
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        ttl: float | None = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path (str | None, optional): Path to the SQLite file. Defaults to the
+                                         ``COMPLETION_CACHE_PATH`` environment variable
+                                         or "./completion_cache.sqlite".
+            ttl (float | None, optional): Lifetime of an entry in seconds, None for no
+                                          expiry. Defaults to 7 days.
+            max_bytes (int, optional): Maximum summed response size before LRU eviction
+                                       kicks in. Defaults to 256 MiB.
+        """
+        self.path = path or os.getenv("COMPLETION_CACHE_PATH") or DEFAULT_CACHE_PATH
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+
+        # the connection is shared between threads, so serialize access to it
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                nbytes INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(params: dict[str, Any]) -> str:
+        """
+        Compute the canonical hash of a chat completion request.
+
+        Args:
+            params (dict[str, Any]): The keyword arguments of
+                                     ``client.chat.completions.create``.
+
+        Returns:
+            str: A hex sha256 digest of the model, messages and sampling parameters.
+                 Parameters set to None count as not set.
+        """
+        canonical = {
+            name: value
+            for name, value in params.items()
+            if value is not None and name not in TRANSPORT_PARAMS
+        }
+        return hashlib.sha256(
+            json.dumps(
+                canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, params: dict[str, Any]) -> ChatCompletion | None:
+        """
+        Look up the cached response of a request.
+
+        Args:
+            params (dict[str, Any]): The keyword arguments of the request.
+
+        Returns:
+            ChatCompletion | None: The cached response, or None if it is not cached or
+                                   expired.
+        """
+        key = self.key(params)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl is not None and row[1] + self.ttl < now:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                row = None
+            elif row is not None:
+                # refresh the recency of the hit so eviction keeps hot responses around
+                self._conn.execute(
+                    "UPDATE completions SET last_used = ? WHERE key = ?", (now, key)
+                )
+            self._conn.commit()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            completion = ChatCompletion.model_validate_json(row[0])
+            self.hits += 1
+            if completion.usage is not None:
+                self.saved_prompt_tokens += completion.usage.prompt_tokens
+                self.saved_completion_tokens += completion.usage.completion_tokens
+            return completion
+
+    def put(self, params: dict[str, Any], completion: ChatCompletion) -> None:
+        """
+        Store the response of a request, evicting old entries if over the size limit.
+
+        Args:
+            params (dict[str, Any]): The keyword arguments of the request.
+            completion (ChatCompletion): Its response.
+        """
+        response = completion.model_dump_json(exclude_unset=True)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions "
+                "(key, response, nbytes, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (self.key(params), response, len(response), now, now),
+            )
+            self.__evict()
+            self._conn.commit()
+
+    def create(
+        self, client: OpenAI, use_cache: bool = True, **params: Any
+    ) -> ChatCompletion:
+        """
+        Return the response of a request, sending it only if it is not cached.
+
+        Args:
+            client (OpenAI): The client sending uncached requests.
+            use_cache (bool, optional): Whether to read and write the cache. Defaults to True.
+            **params: The keyword arguments of ``client.chat.completions.create``.
+
+        Returns:
+            ChatCompletion: The cached or freshly generated response.
+        """
+        with tracer.span("llm.completion", model=params.get("model")) as span:
+            if use_cache:
+                cached = self.get(params)
+                if cached is not None:
+                    span.set(cached=True, cost_usd=0.0)
+                    return cached
+
+            completion = client.chat.completions.create(**params)
+            if completion.usage is not None:
+                span.set(
+                    cached=False,
+                    prompt_tokens=completion.usage.prompt_tokens,
+                    completion_tokens=completion.usage.completion_tokens,
+                    cost_usd=estimate_cost(
+                        completion.model,
+                        completion.usage.prompt_tokens,
+                        completion.usage.completion_tokens,
+                    ),
+                )
+            if use_cache:
+                self.put(params, completion)
+            return completion
+
+    def stream(
+        self, client: OpenAI, use_cache: bool = True, **params: Any
+    ) -> CompletionStream:
+        """
+        Stream the response of a request, replaying it if it is cached.
+
+        The cache is looked up when the iteration starts. A cached response is replayed
+        as a single delta, a fresh one is stored once it was streamed to the end.
+
+        Args:
+            client (OpenAI): The client sending uncached requests.
+            use_cache (bool, optional): Whether to read and write the cache. Defaults to True.
+            **params: The keyword arguments of ``client.chat.completions.create``,
+                      without ``stream``.
+
+        Returns:
+            CompletionStream: A stream to iterate with ``for``.
+        """
+
+        def create():
+            cached = self.get(params) if use_cache else None
+            if cached is not None:
+                stream.attributes["cached"] = True
+                return _replay_chunks(cached)
+            return client.chat.completions.create(
+                **params, stream=True, stream_options={"include_usage": True}
+            )
+
+        def on_complete(stream: CompletionStream) -> None:
+            if use_cache and not stream.attributes.get("cached"):
+                self.put(params, _stream_completion(params, stream))
+
+        stream = CompletionStream(create, on_complete)
+        return stream
+
+    def astream(
+        self, client: AsyncOpenAI, use_cache: bool = True, **params: Any
+    ) -> CompletionStream:
+        """
+        Stream the response of a request asynchronously, replaying it if it is cached.
+
+        The asynchronous counterpart of ``stream``.
+
+        Args:
+            client (AsyncOpenAI): The client sending uncached requests.
+            use_cache (bool, optional): Whether to read and write the cache. Defaults to True.
+            **params: The keyword arguments of ``client.chat.completions.create``,
+                      without ``stream``.
+
+        Returns:
+            CompletionStream: A stream to iterate with ``async for``.
+        """
+
+        async def create():
+            cached = self.get(params) if use_cache else None
+            if cached is not None:
+                stream.attributes["cached"] = True
+                return _areplay_chunks(cached)
+            return await client.chat.completions.create(
+                **params, stream=True, stream_options={"include_usage": True}
+            )
+
+        def on_complete(stream: CompletionStream) -> None:
+            if use_cache and not stream.attributes.get("cached"):
+                self.put(params, _stream_completion(params, stream))
+
+        stream = CompletionStream(create, on_complete)
+        return stream
+
+    def stats(self) -> dict[str, int]:
+        """
+        Report cache effectiveness and size.
+
+        Returns:
+            dict[str, int]: Hit and miss counters, the prompt and completion tokens saved
+                            by hits, plus the number of stored entries and their summed
+                            size in bytes.
+        """
+        with self._lock:
+            entries, nbytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM completions"
+            ).fetchone()
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved_prompt_tokens": self.saved_prompt_tokens,
+            "saved_completion_tokens": self.saved_completion_tokens,
+            "entries": entries,
+            "bytes": nbytes,
+        }
+
+    def __evict(self) -> None:
+        """
+        Delete least recently used entries until the cache fits within max_bytes.
+
+        Must be called with the lock held.
+        """
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(nbytes), 0) FROM completions"
+        ).fetchone()
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+
+        stale: list[tuple[str]] = []
+        for key, nbytes in self._conn.execute(
+            "SELECT key, nbytes FROM completions ORDER BY last_used ASC"
+        ):
+            stale.append((key,))
+            excess -= nbytes
+            if excess <= 0:
+                break
+
+        self._conn.executemany("DELETE FROM completions WHERE key = ?", stale)
+
+
+def _replay_chunks(completion: ChatCompletion) -> list[ChatCompletionChunk]:
+    # a cached response streams as one delta followed by its usage
+    base = {
+        "id": completion.id,
+        "created": completion.created,
+        "model": completion.model,
+        "object": "chat.completion.chunk",
+    }
+    return [
+        ChatCompletionChunk(
+            **base,
+            choices=[
+                ChunkChoice(
+                    index=0,
+                    delta=ChoiceDelta(
+                        role="assistant", content=completion.choices[0].message.content
+                    ),
+                    finish_reason=completion.choices[0].finish_reason,
+                )
+            ],
+        ),
+        ChatCompletionChunk(**base, choices=[], usage=completion.usage),
+    ]
+
+
+async def _areplay_chunks(
+    completion: ChatCompletion,
+) -> AsyncIterator[ChatCompletionChunk]:
+    for chunk in _replay_chunks(completion):
+        yield chunk
+
+
+def _stream_completion(
+    params: dict[str, Any], stream: CompletionStream
+) -> ChatCompletion:
+    # rebuild the response a blocking request would have returned
+    return ChatCompletion(
+        id=f"stream-{CompletionCache.key(params)[:24]}",
+        object="chat.completion",
+        created=int(time.time()),
+        model=params["model"],
+        choices=[
+            Choice(
+                index=0,
+                finish_reason=stream.finish_reason or "stop",
+                message=ChatCompletionMessage(role="assistant", content=stream.text),
+            )
+        ],
+        usage=stream.usage
+        or CompletionUsage(
+            prompt_tokens=0,
+            completion_tokens=stream.stats["completion_tokens"] if stream.stats else 0,
+            total_tokens=stream.stats["completion_tokens"] if stream.stats else 0,
+        ),
+    )
@@ -0,0 +1,126 @@
+from typing import Any, TypedDict
+import gzip
+import hashlib
+import json
+import os
+
+
+DEFAULT_CACHE_DIR = "./extraction_cache"
+
+
+class ExtractionResult(TypedDict):
+    texts: list[str]
+    chunks: list[str]
+    offsets: list[list[int]]
+
+
+class ExtractionCache:
+    """
+    A persistent cache of the text extracted from documents and the chunks split from it.
+
+    Entries are addressed by the sha256 of the source file combined with the version of
+    the extractor and the splitter settings, so any change to the document or to the way
+    it is processed results in a fresh extraction. Every entry is a gzip-compressed JSON
+    file holding the per-page texts, the chunks and their offsets.
+
+    Attributes:
+        cache_dir (str): Directory holding one file per cached document version.
+
+    Example:
+        >>> cache = ExtractionCache()
+        >>> key = cache.key("data/report.pdf", "pypdf-5.8.0/1", {"chunk_size": 256})
+        >>> result = cache.load(key)  # None on the first run
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR) -> None:
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir (str, optional): Directory for the cache files. It is created on the
+                                       first write. Defaults to "./extraction_cache".
+        """
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """
+        Compute the sha256 digest of a file's content.
+
+        Args:
+            file_path (str): Path to the file.
+
+        Returns:
+            str: The hex digest of the file content.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(file_path: str, extractor_version: str, settings: dict[str, Any]) -> str:
+        """
+        Compute the cache key of a document processed with given settings.
+
+        Args:
+            file_path (str): Path to the source document.
+            extractor_version (str): Identifies the extraction code; bump it whenever the
+                                     extraction or chunking logic changes.
+            settings (dict[str, Any]): JSON-serialisable splitter settings.
+
+        Returns:
+            str: A hex sha256 digest identifying the (document, extractor, settings) triple.
+        """
+        fingerprint = json.dumps(
+            {
+                "document": ExtractionCache.hash_file(file_path),
+                "extractor": extractor_version,
+                "settings": settings,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+    def load(self, key: str) -> ExtractionResult | None:
+        """
+        Load a cached extraction.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            ExtractionResult | None: The cached texts and chunks, or None if the key is
+                                     not cached or the entry is unreadable.
+        """
+        path = self.__path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable extraction cache entry {path}: {e}")
+            return None
+
+    def save(self, key: str, result: ExtractionResult) -> None:
+        """
+        Store an extraction atomically.
+
+        Args:
+            key (str): The cache key.
+            result (ExtractionResult): The texts and chunks to store.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.__path(key)
+
+        # write to a temporary file first so a crash never leaves a truncated entry
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(result, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json.gz")
@@ -1,14 +1,237 @@
-from chroma import ChromaDb
-from pdf_processor import PDFChunkGenerator
+from chroma import ChromaDb, RankedChunk, fuse_rankings
+from numpy_db import NumpyDb
+from pdf_processor import PDFChunkGenerator, document_fingerprint
+from rag_common.context_packer import ContextPacker
+from rag_common.streaming import CompletionStream
+from rag_common.tracing import tracer
 from response import (
+    completion_cache,
     generate_single_query_response,
     generate_multi_query_response,
-    generate_response_with_context,
+    stream_response_with_context,
+    astream_response_with_context,
 )
-from util import word_wrap
+from typing import TypedDict
+from util import WordWrapBuffer, word_wrap
+import argparse
+import asyncio
+import os
+import time
 
 
-def run_expanded_single_query(db: ChromaDb, question: str) -> None:
+PDF_PATH = "data/microsoft-annual-report.pdf"
+COLLECTION_NAME = "microsoft-collection"
+
+
+class IngestResult(TypedDict):
+    # True when the stored version matched the file and nothing was processed
+    unchanged: bool
+    # chunks of the document, 0 when unchanged
+    chunks: int
+    added: int
+    deleted: int
+    # why the document could not be ingested, None on success
+    error: str | None
+
+
+@tracer.traced("rag.ingest")
+def ingest_document(
+    db: ChromaDb | NumpyDb, pdf_path: str, collection_name: str, pdf_workers: int = 1
+) -> IngestResult:
+    """
+    Ingest a PDF document into a collection once per document version.
+
+    The fingerprint of the ingested version (see ``document_fingerprint``) is recorded in
+    the collection metadata under "<doc_id>:fingerprint". When the fingerprint of the
+    file on disk matches it, the document is already stored as is and the step returns
+    after hashing the file, without processing the PDF or touching the collection.
+    Otherwise only the chunks the collection is missing are embedded and upserted, and
+    chunks of the previous version that disappeared are deleted. A version that could not
+    be extracted completely leaves the collection and the recorded fingerprint as they
+    are, so the stored chunks are kept and the document is processed again next time.
+
+    Args:
+        db (ChromaDb | NumpyDb): Initialized vector store for vector operations
+        pdf_path (str): Path to the PDF document to ingest
+        collection_name (str): The collection shared by all retrieval techniques
+        pdf_workers (int, optional): Number of processes extracting PDF page text. Defaults to 1
+
+    Returns:
+        IngestResult: Whether the document was unchanged and how many chunks it has,
+                      were added and were deleted, or the error that stopped the
+                      ingest. The progress is printed
+
+    Example:
+        >>> db = ChromaDb()
+        >>> ingest_document(db, "data/microsoft-annual-report.pdf", "microsoft-collection")
+        >>> ingest_document(db, "data/microsoft-annual-report.pdf", "microsoft-collection")
+        # the second call finds a matching fingerprint and skips ingestion
+    """
+    print("\n📥 Ingesting document...")
+    db.create_collection(collection_name)
+
+    # the default document identity of PDFChunkGenerator
+    doc_id = os.path.splitext(os.path.basename(pdf_path))[0]
+    fingerprint_key = f"{doc_id}:fingerprint"
+    fingerprint = document_fingerprint(pdf_path)
+
+    metadata = db.get_collection_metadata(collection_name) or {}
+    if metadata.get(fingerprint_key) == fingerprint:
+        print("✅ Document unchanged since the last ingest, skipping")
+        return {
+            "unchanged": True,
+            "chunks": 0,
+            "added": 0,
+            "deleted": 0,
+            "error": None,
+        }
+
+    pdf_processor = PDFChunkGenerator(pdf_path, workers=pdf_workers, doc_id=doc_id)
+    # the chunks of pages that failed would be deleted as stale, and the fingerprint
+    # would mark the incomplete version as current
+    error = None
+    if pdf_processor.texts is None:
+        error = f"Could not read {pdf_path}"
+    elif pdf_processor.page_errors:
+        error = (
+            f"{len(pdf_processor.page_errors)} pages of {pdf_path} failed to extract"
+        )
+    elif not pdf_processor.get_chunks():
+        error = f"No text extracted from {pdf_path}"
+    if error is not None:
+        print(f"❌ {error}, keeping the stored version")
+        return {
+            "unchanged": False,
+            "chunks": 0,
+            "added": 0,
+            "deleted": 0,
+            "error": error,
+        }
+    print(f"✅ PDF processed into {len(pdf_processor.get_chunks())} chunks")
+
+    # only chunks whose content is not stored yet are embedded and upserted
+    n_added = db.add_chunks(
+        pdf_processor.get_chunk_ids(),
+        pdf_processor.get_chunks(),
+        collection_name,
+        skip_existing=True,
+    )
+    n_deleted = db.delete_stale_chunks(
+        doc_id, pdf_processor.get_chunk_ids(), collection_name
+    )
+    print(f"✅ Stored {n_added} new chunks, removed {n_deleted} stale chunks")
+
+    # record the version last, so an interrupted ingest is retried on the next run
+    db.update_collection_metadata(
+        collection_name, {fingerprint_key: pdf_processor.fingerprint}
+    )
+    return {
+        "unchanged": False,
+        "chunks": len(pdf_processor.get_chunks()),
+        "added": n_added,
+        "deleted": n_deleted,
+        "error": None,
+    }
+
+
+def print_stream(stream: CompletionStream, line_width: int = 90) -> None:
+    """
+    Print a streamed response as its tokens arrive, then its timings.
+
+    The text is wrapped through a ``WordWrapBuffer``, so the output is the same as
+    printing ``word_wrap`` of the full response, but each line appears as soon as it is
+    complete instead of after the whole generation.
+
+    Args:
+        stream (CompletionStream): A synchronous response stream, not consumed yet
+        line_width (int, optional): Number of characters per line. Defaults to 90
+
+    Returns:
+        None: Prints the response and a line with the time to first token and token count
+    """
+    buffer = WordWrapBuffer(line_width)
+    for delta in stream:
+        print(buffer.feed(delta), end="", flush=True)
+    print(buffer.flush())
+    print_stream_stats(stream)
+
+
+async def aprint_stream(stream: CompletionStream, line_width: int = 90) -> None:
+    """
+    Print an asynchronous streamed response as its tokens arrive, then its timings.
+
+    See ``print_stream``.
+
+    Args:
+        stream (CompletionStream): An asynchronous response stream, not consumed yet
+        line_width (int, optional): Number of characters per line. Defaults to 90
+
+    Returns:
+        None: Prints the response and a line with the time to first token and token count
+    """
+    buffer = WordWrapBuffer(line_width)
+    async for delta in stream:
+        print(buffer.feed(delta), end="", flush=True)
+    print(buffer.flush())
+    print_stream_stats(stream)
+
+
+def pack_context(
+    packer: ContextPacker | None, question: str, chunks: list[str]
+) -> list[str]:
+    """
+    Select the chunks handed to the LLM within the packer's token budget.
+
+    Args:
+        packer (ContextPacker | None): The packer, None to hand over every chunk
+        question (str): The user's question
+        chunks (list[str]): The retrieved chunks, best first
+
+    Returns:
+        list[str]: The packed chunks, printing how many chunks and tokens were kept
+    """
+    if packer is None:
+        return chunks
+
+    packed = packer.pack(question, chunks)
+    print(
+        f"📦 Packed {len(packed['chunks'])} of {packed['candidates']} chunks, "
+        f"{packed['tokens']} of {packed['candidate_tokens']} tokens "
+        f"(budget {packer.budget})"
+    )
+    return packed["chunks"]
+
+
+def print_stream_stats(stream: CompletionStream) -> None:
+    """
+    Print the time to first token, token count and duration of a consumed stream.
+
+    Args:
+        stream (CompletionStream): A response stream that was iterated
+
+    Returns:
+        None: Prints one line, or nothing if the stream was not iterated
+    """
+    if stream.stats is None:
+        return
+    ttft = stream.stats["ttft"]
+    first_token = f"first token after {ttft:.2f}s" if ttft is not None else "no tokens"
+    print(
+        f"⏱️  {first_token}, {stream.stats['completion_tokens']} tokens "
+        f"in {stream.stats['total_time']:.2f}s"
+    )
+
+
+@tracer.traced("rag.hyde")
+def run_expanded_single_query(
+    db: ChromaDb | NumpyDb,
+    question: str,
+    collection_name: str = COLLECTION_NAME,
+    n_results: int = 5,
+    hybrid: bool = False,
+    prefilter: int | None = None,
+    packer: ContextPacker | None = None,
+) -> None:
     """
     Execute a RAG pipeline using the HyDE (Hypothetical Document Embeddings) technique.
 
@@ -19,14 +242,11 @@ def run_expanded_single_query(db: ChromaDb, question: str) -> None:
     accurate document retrieval and better final responses.
 
     RAG Pipeline Steps:
-        1. Create/retrieve a ChromaDB collection for document storage
-        2. Process and chunk the PDF document using PDFChunkGenerator
-        3. Store document chunks in the vector database with embeddings
-        4. Generate a hypothetical answer using the question (HyDE technique)
-        5. Combine original question + hypothetical answer for expanded retrieval
-        6. Query the vector database with the expanded query
-        7. Generate a comprehensive response using retrieved context
-        8. Display the formatted final response
+        1. Generate a hypothetical answer using the question (HyDE technique)
+        2. Combine original question + hypothetical answer for expanded retrieval
+        3. Query the vector database with the expanded query
+        4. Generate a comprehensive response using retrieved context
+        5. Display the formatted final response
 
     HyDE Benefits:
         - Bridges semantic gaps between question and document terminology
@@ -35,23 +255,34 @@ def run_expanded_single_query(db: ChromaDb, question: str) -> None:
         - Enhances performance when question and answer vocabulary differ
 
     Args:
-        db (ChromaDb): Initialized ChromaDB instance for vector operations
+        db (ChromaDb | NumpyDb): Initialized vector store for vector operations
         question (str): The user's question to be answered using RAG
+        collection_name (str, optional): Collection holding the ingested document.
+                                         Defaults to 'microsoft-collection'
+        n_results (int, optional): Number of chunks handed to the LLM. Defaults to 5
+        hybrid (bool, optional): Fuse the vector search with a BM25 search of the
+                                 collection (see ``ChromaDb.query_rankings``).
+                                 Defaults to False
+        prefilter (int | None, optional): Restrict the vector search to this many BM25
+                                          matches. Defaults to None (search every chunk)
+        packer (ContextPacker | None, optional): Packs the retrieved chunks into a token
+                                                 budget before answering. Defaults to
+                                                 None (hand over every chunk)
 
     Returns:
         None: Prints the AI-generated response and handles display formatting
 
     Example:
         >>> db = ChromaDb()
+        >>> ingest_document(db, PDF_PATH, COLLECTION_NAME)
         >>> question = "What was Microsoft's profit margin in 2023?"
         >>> run_expanded_single_query(db, question)
-        # Creates collection, processes PDF, generates hypothetical answer,
-        # retrieves relevant chunks, and displays comprehensive response
+        # Generates hypothetical answer, retrieves relevant chunks,
+        # and displays comprehensive response
 
     Note:
-        - Uses a dedicated collection name 'microsoft-collection-single'
-        - Processes 'data/microsoft-annual-report.pdf' as the document source
-        - Retrieves top 5 most relevant document chunks
+        - Expects the document to be ingested with ``ingest_document`` beforehand
+        - Retrieves the top ``n_results`` (5) most relevant document chunks
         - Handles cases where no relevant documents are found
     """
     print("\n" + "🔍" + "=" * 118 + "🔍")
@@ -60,44 +291,34 @@ def run_expanded_single_query(db: ChromaDb, question: str) -> None:
     print(f"📝 QUESTION: {word_wrap(question, line_width=100)}")
     print("=" * 120)
 
-    collection_name = "microsoft-collection-single"
-    print("📂 Step 1/6: Setting up ChromaDB collection...")
-    db.create_collection(collection_name)
-    print("✅ Collection created/retrieved successfully")
-
-    print("\n📄 Step 2/6: Processing PDF document...")
-    pdf_processor = PDFChunkGenerator("data/microsoft-annual-report.pdf")
-    print("✅ PDF processed and chunked")
-
-    print("\n💾 Step 3/6: Storing document chunks in vector database...")
-    db.add_chunks(
-        pdf_processor.get_chunk_ids(), pdf_processor.get_chunks(), collection_name
-    )
-    print("✅ Document chunks stored with embeddings")
-
-    print("\n🤖 Step 4/6: Generating hypothetical answer (HyDE)...")
+    print("🤖 Step 1/3: Generating hypothetical answer (HyDE)...")
     hypothetical_answer = generate_single_query_response(question)
     print("✅ Hypothetical answer generated")
 
-    print("\n🔗 Step 5/6: Combining query with hypothetical answer...")
+    print("\n🔗 Step 2/3: Combining query with hypothetical answer...")
     concat_query = f"{question}\n{hypothetical_answer}"
     print("✅ Expanded query prepared")
 
-    print("\n🔎 Step 6/6: Searching vector database...")
+    print("\n🔎 Step 3/3: Searching vector database...")
     results = db.query_documents(
-        question=concat_query, collection_name=collection_name, n_results=5
+        question=concat_query,
+        collection_name=collection_name,
+        n_results=n_results,
+        hybrid=hybrid,
+        prefilter=prefilter,
     )
     print("✅ Relevant documents retrieved")
 
     # generate an llm response with the extra context
     if results and isinstance(results, list):
+        context = pack_context(packer, question, results)
         print("\n🧠 Generating AI response with retrieved context...")
-        response = generate_response_with_context(question, results)
+        stream = stream_response_with_context(question, context)
 
         print("\n" + "🎯" + "=" * 116 + "🎯")
         print("🤖 AI RESPONSE (HyDE Technique)")
         print("=" * 120)
-        print(word_wrap(response, line_width=120))
+        print_stream(stream, line_width=120)
         print("=" * 120)
         print("🎉 RAG Pipeline Complete! ✨")
         print("=" * 120)
@@ -105,26 +326,34 @@ def run_expanded_single_query(db: ChromaDb, question: str) -> None:
         print("❌ No results retrieved from the database.")
 
 
-def run_expanded_multiple_queries(db: ChromaDb, question: str) -> None:
+@tracer.traced("rag.multi_query")
+def run_expanded_multiple_queries(
+    db: ChromaDb | NumpyDb,
+    question: str,
+    collection_name: str = COLLECTION_NAME,
+    n_results: int = 5,
+    hybrid: bool = False,
+    prefilter: int | None = None,
+    packer: ContextPacker | None = None,
+) -> None:
     """
     Execute a RAG pipeline using the Multi-Query Expansion technique.
 
     This function implements a comprehensive retrieval approach where an LLM generates
-    multiple related subqueries from the original question. All queries are processed
-    simultaneously by ChromaDB for batch retrieval, capturing different aspects and
-    perspectives of the user's question. This technique provides more robust and
+    multiple related subqueries from the original question. All queries are embedded in
+    one call and searched with a single ChromaDB query, capturing different aspects and
+    perspectives of the user's question. The per-query rankings are merged with
+    reciprocal rank fusion into one ranking, so the LLM receives a small, ordered context
+    instead of every query's results. This technique provides more robust and
     comprehensive document retrieval compared to single-query approaches.
 
     RAG Pipeline Steps:
-        1. Create/retrieve a ChromaDB collection for document storage
-        2. Process and chunk the PDF document using PDFChunkGenerator
-        3. Store document chunks in the vector database with embeddings
-        4. Generate multiple related subqueries from the original question
-        5. Combine original question + subqueries into a query list
-        6. Perform batch retrieval using all queries simultaneously
-        7. Apply deduplication to remove duplicate document chunks
-        8. Generate a comprehensive response using retrieved context
-        9. Display the formatted final response
+        1. Generate multiple related subqueries from the original question
+        2. Combine original question + subqueries into a query list
+        3. Perform batch retrieval using all queries simultaneously
+        4. Fuse the per-query rankings into a global top 5 by chunk ID
+        5. Generate a comprehensive response using retrieved context
+        6. Display the formatted final response
 
     Multi-Query Benefits:
         - Captures different aspects and perspectives of the original question
@@ -135,24 +364,33 @@ def run_expanded_multiple_queries(db: ChromaDb, question: str) -> None:
         - Provides more comprehensive context for response generation
 
     Args:
-        db (ChromaDb): Initialized ChromaDB instance for vector operations
+        db (ChromaDb | NumpyDb): Initialized vector store for vector operations
         question (str): The user's question to be answered using RAG
+        collection_name (str, optional): Collection holding the ingested document.
+                                         Defaults to 'microsoft-collection'
+        n_results (int, optional): Number of fused chunks handed to the LLM. Defaults to 5
+        hybrid (bool, optional): Fuse a BM25 ranking of every query as well.
+                                 Defaults to False
+        prefilter (int | None, optional): Restrict the vector search to this many BM25
+                                          matches per query. Defaults to None
+        packer (ContextPacker | None, optional): Packs the retrieved chunks into a token
+                                                 budget before answering. Defaults to None
 
     Returns:
         None: Prints the AI-generated response and handles display formatting
 
     Example:
         >>> db = ChromaDb()
+        >>> ingest_document(db, PDF_PATH, COLLECTION_NAME)
         >>> question = "What factors contributed to Microsoft's revenue growth?"
         >>> run_expanded_multiple_queries(db, question)
-        # Creates collection, processes PDF, generates multiple subqueries,
-        # performs batch retrieval with deduplication, displays comprehensive response
+        # Generates multiple subqueries, performs fused batch retrieval,
+        # displays comprehensive response
 
     Note:
-        - Uses a dedicated collection name 'microsoft-collection-multiple'
-        - Processes 'data/microsoft-annual-report.pdf' as the document source
-        - Retrieves top 5 most relevant document chunks per query
-        - Automatically deduplicates results to avoid redundant context
+        - Expects the document to be ingested with ``ingest_document`` beforehand
+        - Retrieves the top ``n_results`` (5) document chunks across all queries
+        - Chunks found by several queries are counted once, ranked by their fused score
         - Handles cases where no relevant documents are found
     """
     print("\n\n" + "🔍" + "=" * 118 + "🔍")
@@ -161,44 +399,39 @@ def run_expanded_multiple_queries(db: ChromaDb, question: str) -> None:
     print(f"📝 QUESTION: {word_wrap(question, line_width=100)}")
     print("=" * 120)
 
-    collection_name = "microsoft-collection-multiple"
-    print("📂 Step 1/7: Setting up ChromaDB collection...")
-    db.create_collection(collection_name)
-    print("✅ Collection created/retrieved successfully")
-
-    print("\n📄 Step 2/7: Processing PDF document...")
-    pdf_processor = PDFChunkGenerator("data/microsoft-annual-report.pdf")
-    print("✅ PDF processed and chunked")
-
-    print("\n💾 Step 3/7: Storing document chunks in vector database...")
-    db.add_chunks(
-        pdf_processor.get_chunk_ids(), pdf_processor.get_chunks(), collection_name
-    )
-    print("✅ Document chunks stored with embeddings")
-
-    print("\n🤖 Step 4/7: Generating multiple related subqueries...")
+    print("🤖 Step 1/4: Generating multiple related subqueries...")
     augmented_queries: list[str] = generate_multi_query_response(question)
     print(f"✅ Generated {len(augmented_queries)} related queries")
 
-    print("\n🔗 Step 5/7: Combining all queries for batch processing...")
+    print("\n🔗 Step 2/4: Combining all queries for batch processing...")
     concat_queries: list[str] = [question] + augmented_queries
     print(f"✅ Prepared {len(concat_queries)} total queries for search")
 
-    print("\n🔎 Step 6/7: Performing batch search with deduplication...")
-    results = db.query_documents(
-        question=concat_queries, collection_name=collection_name, n_results=5
+    print("\n🔎 Step 3/4: Performing batch search with rank fusion...")
+    fused = db.query_fused(
+        concat_queries,
+        collection_name,
+        n_results=n_results,
+        hybrid=hybrid,
+        prefilter=prefilter,
     )
-    print("✅ Relevant documents retrieved and deduplicated")
+    if fused:
+        print(f"✅ Retrieved the top {len(fused)} documents across all queries")
+        for result in fused:
+            print(f"   {result['score']:.4f}  {result['chunk_id']}")
 
-    print("\n🧠 Step 7/7: Generating AI response with comprehensive context...")
+    print("\n🧠 Step 4/4: Generating AI response with comprehensive context...")
     # generate an llm response with the extra context
-    if results and isinstance(results, list):
-        response = generate_response_with_context(question, results)
+    if fused:
+        context = pack_context(
+            packer, question, [result["document"] for result in fused]
+        )
+        stream = stream_response_with_context(question, context)
 
         print("\n" + "🎯" + "=" * 116 + "🎯")
         print("🤖 AI RESPONSE (Multi-Query Technique)")
         print("=" * 120)
-        print(word_wrap(response, line_width=120))
+        print_stream(stream, line_width=120)
         print("=" * 120)
         print("🎉 RAG Pipeline Complete! ✨")
         print("=" * 120)
@@ -206,7 +439,278 @@ def run_expanded_multiple_queries(db: ChromaDb, question: str) -> None:
         print("❌ No results retrieved from the database.")
 
 
+@tracer.traced("rag.concurrent")
+async def run_concurrent_expansion(
+    db: ChromaDb | NumpyDb,
+    question: str,
+    collection_name: str = COLLECTION_NAME,
+    n_results: int = 5,
+    hybrid: bool = False,
+    prefilter: int | None = None,
+    packer: ContextPacker | None = None,
+) -> None:
+    """
+    Execute HyDE and Multi-Query Expansion concurrently and answer from their merged results.
+
+    The sequential pipelines wait for each stage before starting the next, so their latency
+    is the sum of every LLM call, embedding call and search. Here the stages that do not
+    depend on each other overlap:
+
+        - retrieval on the raw question starts right away, speculatively, so there is
+          context to answer from even if an expansion fails
+        - the HyDE answer and the subqueries are generated in parallel
+        - each expansion starts its own retrieval as soon as it arrives, and its rankings
+          are merged with the ones already retrieved
+
+    Once every stage settled, the rankings are fused with reciprocal rank fusion (raw
+    question first, then HyDE, then the subqueries) and a single answer is generated from
+    the global top ``n_results`` chunks. The latency before the answer call becomes the
+    slowest expansion plus one search instead of the sum of all stages.
+
+    The blocking OpenAI and ChromaDB calls run in worker threads, which the shared clients
+    and the embedding cache are safe for.
+
+    Args:
+        db (ChromaDb | NumpyDb): Initialized vector store for vector operations
+        question (str): The user's question to be answered using RAG
+        collection_name (str, optional): Collection holding the ingested document.
+                                         Defaults to 'microsoft-collection'
+        n_results (int, optional): Number of chunks retrieved per query and handed to
+                                   the LLM. Defaults to 5
+        hybrid (bool, optional): Fuse a BM25 ranking of every query as well.
+                                 Defaults to False
+        prefilter (int | None, optional): Restrict the vector search to this many BM25
+                                          matches per query. Defaults to None
+        packer (ContextPacker | None, optional): Packs the retrieved chunks into a token
+                                                 budget before answering. Defaults to None
+
+    Returns:
+        None: Prints the stages as they complete and the AI-generated response
+
+    Example:
+        >>> db = ChromaDb()
+        >>> ingest_document(db, PDF_PATH, COLLECTION_NAME)
+        >>> question = "What factors contributed to Microsoft's revenue growth?"
+        >>> asyncio.run(run_concurrent_expansion(db, question))
+        # Prints each stage as it completes, then one response from the merged context
+    """
+    print("\n" + "🔍" + "=" * 118 + "🔍")
+    print("🚀 ADVANCED RAG DEMO - Concurrent HyDE + Multi-Query Expansion")
+    print("=" * 120)
+    print(f"📝 QUESTION: {word_wrap(question, line_width=100)}")
+    print("=" * 120)
+
+    started = time.perf_counter()
+    # rankings per stage, fused in a fixed stage order so ties do not depend on timing
+    stages = ("raw", "hyde", "multi")
+    rankings: dict[str, list[list[RankedChunk]]] = {}
+
+    async def retrieve(stage: str, queries: list[str]) -> None:
+        ranking = await asyncio.to_thread(
+            db.query_rankings,
+            queries,
+            collection_name,
+            n_results,
+            hybrid=hybrid,
+            prefilter=prefilter,
+        )
+        rankings[stage] = ranking or []
+        merged = fuse_rankings(
+            [r for s in stages for r in rankings.get(s, [])], n_results
+        )
+        print(
+            f"✅ [{time.perf_counter() - started:5.2f}s] {stage}: retrieved "
+            f"{len(rankings[stage])} ranking(s), {len(merged)} chunks in the merged context"
+        )
+
+    async def expand_hyde() -> None:
+        try:
+            hypothetical_answer = await asyncio.to_thread(
+                generate_single_query_response, question
+            )
+        except Exception as e:
+            print(f"⚠️  HyDE expansion failed, continuing without it: {e}")
+            return
+        print(f"🤖 [{time.perf_counter() - started:5.2f}s] hyde: answer generated")
+        await retrieve("hyde", [f"{question}\n{hypothetical_answer}"])
+
+    async def expand_multi() -> None:
+        try:
+            subqueries = await asyncio.to_thread(
+                generate_multi_query_response, question
+            )
+        except Exception as e:
+            print(f"⚠️  Multi-query expansion failed, continuing without it: {e}")
+            return
+        print(
+            f"🤖 [{time.perf_counter() - started:5.2f}s] multi: "
+            f"{len(subqueries)} subqueries generated"
+        )
+        if subqueries:
+            await retrieve("multi", subqueries)
+
+    print("🔎 Retrieving on the raw question while expanding it...")
+    await asyncio.gather(retrieve("raw", [question]), expand_hyde(), expand_multi())
+
+    fused = fuse_rankings([r for s in stages for r in rankings.get(s, [])], n_results)
+    if not fused:
+        print("❌ No results retrieved from the database.")
+        return
+
+    # packing embeds the chunks, served from the embedding cache but still blocking
+    context = await asyncio.to_thread(
+        pack_context, packer, question, [result["document"] for result in fused]
+    )
+    print(f"\n🧠 [{time.perf_counter() - started:5.2f}s] Generating AI response...")
+    stream = astream_response_with_context(question, context)
+
+    print("\n" + "🎯" + "=" * 116 + "🎯")
+    print("🤖 AI RESPONSE (Concurrent HyDE + Multi-Query)")
+    print("=" * 120)
+    await aprint_stream(stream, line_width=120)
+    print("=" * 120)
+    print(f"🎉 RAG Pipeline Complete in {time.perf_counter() - started:.2f}s! ✨")
+    print("=" * 120)
+
+
+def add_pipeline_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the vector store, retrieval and tracing options shared by the demo and the service.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to extend
+
+    Returns:
+        None: The options are read back with ``create_db`` and ``create_packer``
+    """
+    parser.add_argument(
+        "--backend",
+        choices=["chroma", "numpy"],
+        default=os.getenv("VECTOR_BACKEND", "chroma"),
+        help="vector store backend (default: $VECTOR_BACKEND or chroma)",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=["float32", "float16", "int8"],
+        default=os.getenv("VECTOR_QUANTIZATION", "float32"),
+        help="precision the numpy backend searches at; quantized searches rescore "
+        "their candidates at full precision (default: $VECTOR_QUANTIZATION or float32)",
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None,
+        help="shorten the embeddings to this many dimensions; a collection only accepts "
+        "the dimensionality it was created with (default: $EMBEDDING_DIMENSIONS or 1536)",
+    )
+    parser.add_argument(
+        "--prefix-dimensions",
+        type=int,
+        default=int(os.getenv("VECTOR_PREFIX_DIMENSIONS", 0)) or None,
+        help="numpy backend: scan this many leading dimensions first and rerank the best "
+        "candidates with the full vectors (default: $VECTOR_PREFIX_DIMENSIONS or off)",
+    )
+    parser.add_argument(
+        "--n-results",
+        type=int,
+        default=5,
+        help="number of chunks handed to the LLM as context (default: 5)",
+    )
+    parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        help="fuse the vector search with a BM25 search of the collection's lexical index",
+    )
+    parser.add_argument(
+        "--prefilter",
+        type=int,
+        help="restrict the vector search to this many BM25 matches per query",
+    )
+    parser.add_argument(
+        "--context-budget",
+        type=int,
+        default=int(os.getenv("CONTEXT_TOKEN_BUDGET", 0)) or None,
+        help="pack the retrieved chunks into this many tokens, picking relevant and "
+        "diverse chunks first (default: $CONTEXT_TOKEN_BUDGET or no limit)",
+    )
+    parser.add_argument(
+        "--sentence-threshold",
+        type=float,
+        help="with --context-budget, drop the sentences of a chunk sharing fewer "
+        "question terms than this fraction of its best sentence, e.g. 0.5",
+    )
+    parser.add_argument(
+        "--trace-file",
+        help="append a JSON line per traced stage (pdf load and chunking, embedding, "
+        "upserts, queries, llm calls with tokens and cost) to this file "
+        "(default: $RAG_TRACE_FILE or off)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve the stage timings, tokens and cost in the Prometheus text format "
+        "on this port (default: $RAG_METRICS_PORT or off)",
+    )
+
+
+def create_db(args: argparse.Namespace) -> ChromaDb | NumpyDb:
+    """
+    Open the vector store selected by the ``add_pipeline_arguments`` options.
+
+    Args:
+        args (argparse.Namespace): The parsed options
+
+    Returns:
+        ChromaDb | NumpyDb: The vector store
+    """
+    if args.backend == "numpy":
+        return NumpyDb(
+            quantization=args.quantization,
+            dimensions=args.dimensions,
+            prefix_dimensions=args.prefix_dimensions,
+        )
+    return ChromaDb(dimensions=args.dimensions)
+
+
+def create_packer(
+    args: argparse.Namespace, db: ChromaDb | NumpyDb
+) -> ContextPacker | None:
+    """
+    Create the context packer selected by the ``add_pipeline_arguments`` options.
+
+    Args:
+        args (argparse.Namespace): The parsed options
+        db (ChromaDb | NumpyDb): The vector store, whose embedding function is reused
+
+    Returns:
+        ContextPacker | None: The packer, None without a context budget
+    """
+    if not args.context_budget:
+        return None
+    return ContextPacker(
+        db.ef, budget=args.context_budget, sentence_threshold=args.sentence_threshold
+    )
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Advanced RAG techniques demo")
+    parser.add_argument(
+        "--pdf-workers",
+        type=int,
+        default=1,
+        help="number of processes extracting PDF page text (default: 1)",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="run HyDE and multi-query expansion concurrently and answer once",
+    )
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+    tracer.configure_from_env(
+        trace_file=args.trace_file, metrics_port=args.metrics_port
+    )
+
     print("🌟" + "=" * 118 + "🌟")
     print("                    🎯 ADVANCED RAG TECHNIQUES COMPARISON DEMO 🎯")
     print("                         Powered by ChromaDB + OpenAI")
@@ -215,26 +719,64 @@ def main() -> None:
     print("🧩 Techniques: HyDE vs Multi-Query Expansion")
     print("=" * 120)
 
-    db = ChromaDb()
+    db = create_db(args)
     question = (
         "What details can you provide about the factors that led to revenue growth?"
     )
 
-    # Run HyDE technique
-    run_expanded_single_query(db, question)
-
-    # Add separation between techniques
-    print("\n" + "⚡" + "=" * 118 + "⚡")
-    print("                          🔄 SWITCHING TO NEXT TECHNIQUE 🔄")
-    print("=" * 120)
+    # ingest the report once into the collection both techniques query
+    ingest_document(db, PDF_PATH, COLLECTION_NAME, pdf_workers=args.pdf_workers)
+
+    # retrieval settings shared by every technique
+    n_results, hybrid, prefilter = args.n_results, args.hybrid, args.prefilter
+    packer = create_packer(args, db)
+    if args.concurrent:
+        asyncio.run(
+            run_concurrent_expansion(
+                db,
+                question,
+                n_results=n_results,
+                hybrid=hybrid,
+                prefilter=prefilter,
+                packer=packer,
+            )
+        )
+    else:
+        # Run HyDE technique
+        run_expanded_single_query(
+            db,
+            question,
+            n_results=n_results,
+            hybrid=hybrid,
+            prefilter=prefilter,
+            packer=packer,
+        )
+
+        # Add separation between techniques
+        print("\n" + "⚡" + "=" * 118 + "⚡")
+        print("                          🔄 SWITCHING TO NEXT TECHNIQUE 🔄")
+        print("=" * 120)
 
-    # Run Multi-Query technique
-    run_expanded_multiple_queries(db, question)
+        # Run Multi-Query technique
+        run_expanded_multiple_queries(
+            db,
+            question,
+            n_results=n_results,
+            hybrid=hybrid,
+            prefilter=prefilter,
+            packer=packer,
+        )
 
     # Final summary
+    cache_stats = completion_cache.stats()
     print("\n" + "🏆" + "=" * 118 + "🏆")
     print("                            ✨ DEMO COMPLETE ✨")
     print("                     Both RAG techniques successfully demonstrated!")
+    print(
+        f"💾 Completion cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+        f"{cache_stats['saved_prompt_tokens'] + cache_stats['saved_completion_tokens']} "
+        "tokens saved"
+    )
     print("=" * 120)
 
 
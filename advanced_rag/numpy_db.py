@@ -0,0 +1,639 @@
+from chroma import (
+    DIMENSIONS_KEY,
+    RRF_K,
+    FusedResult,
+    RankedChunk,
+    check_dimensions,
+    fuse_rankings,
+)
+from typing import Any
+from util import load_and_get_key
+from rag_common.embedding_cache import CachedOpenAIEmbeddingFunction
+from rag_common.embedding_engine import EmbeddingEngine
+from rag_common.lexical_index import LexicalIndex
+from rag_common.query_cache import QueryCache
+from rag_common.tracing import tracer
+from rag_common.vector_index import Quantization, VectorIndex
+import numpy as np
+import os
+import threading
+
+
+class NumpyDb:
+    """
+    An exact, NumPy-backed vector store exposing the same interface as ``ChromaDb``.
+
+    Every collection is a ``VectorIndex``: the normalized embeddings of its chunks are the
+    rows of one contiguous float32 matrix, and a batch of queries is answered with a single
+    matrix product plus ``np.argpartition``. The search is exact, so its results are the
+    true nearest neighbours that ChromaDB's HNSW index approximates. A collection persists
+    to ``<storage_path>/<name>.npy`` and a JSON sidecar with the chunk IDs, documents and
+    metadata, and the matrix is memory-mapped when the collection is opened. Its BM25
+    lexical index, used by hybrid and prefiltered queries like in ``ChromaDb``, persists
+    to ``<storage_path>/<name>.lexical.npz`` and ``.json``.
+
+    The store needs no database server or client, which keeps the pipeline runnable where
+    ChromaDB is not available as a database, e.g. in tests. Embeddings are generated with the
+    same cached OpenAI embedding function as ``ChromaDb``, and query embeddings and results
+    are cached the same way.
+
+    Distances are reported like ChromaDB's default "l2" space, as squared euclidean
+    distances between unit vectors (``2 - 2 * cosine similarity``), so results of both
+    backends can be compared.
+
+    Attributes:
+        storage_path (str): Directory holding the collection files.
+        quantization (Quantization): Precision the collections are searched at. With
+            "float16" or "int8" the search scans compact codes in memory and rescores
+            its best candidates from the memory-mapped float32 matrix.
+        dimensions (int | None): Dimensionality of the embeddings, recorded in the
+            metadata of new collections. Collections recording another one are rejected.
+        prefix_dimensions (int | None): Number of leading dimensions the coarse search
+            stage scans before the best candidates are reranked with the full vectors,
+            None for a single-stage search.
+        engine (EmbeddingEngine): Concurrent, rate limit aware client for the embeddings api.
+        ef (CachedOpenAIEmbeddingFunction): OpenAI embedding function for generating text
+            embeddings, backed by the persistent on-disk embedding cache and the engine.
+        query_cache (QueryCache): In-process cache of query embeddings and query results.
+
+    Example:
+        >>> db = NumpyDb()
+        >>> db.create_collection("my-collection")
+        >>> db.add_chunks(chunk_ids, chunks, "my-collection")
+        >>> docs = db.query_documents("What is revenue?", "my-collection", n_results=5)
+    """
+
+    def __init__(
+        self,
+        storage_path: str = "./numpy_db",
+        quantization: Quantization = "float32",
+        dimensions: int | None = None,
+        prefix_dimensions: int | None = None,
+    ) -> None:
+        """
+        Initialize the store and the OpenAI embedding function.
+
+        Args:
+            storage_path (str, optional): Path to the directory where the collections are
+                                        stored. Defaults to "./numpy_db".
+            quantization (Quantization, optional): Precision the collections are searched
+                                                   at, "float32", "float16" or "int8" (see
+                                                   ``VectorIndex``). Defaults to "float32".
+            dimensions (int | None, optional): Number of dimensions the embeddings are
+                                             shortened to by the api (text-embedding-3
+                                             models only). Defaults to None (1536).
+            prefix_dimensions (int | None, optional): Number of leading dimensions the
+                                                    coarse search stage scans, e.g. 256.
+                                                    Defaults to None (no coarse stage).
+        """
+        self.storage_path = storage_path
+        self.quantization: Quantization = quantization
+        self.prefix_dimensions = prefix_dimensions
+        api_key = load_and_get_key()
+        self.engine = EmbeddingEngine(
+            model="text-embedding-3-small", dimensions=dimensions, api_key=api_key
+        )
+        self.ef = CachedOpenAIEmbeddingFunction(
+            api_key=api_key,
+            model_name="text-embedding-3-small",
+            dimensions=dimensions,
+            fetch=self.engine.embed,
+        )
+        self.dimensions = self.engine.output_dimensions
+        self.query_cache = QueryCache()
+        # indexes opened so far, guarded by the lock as queries may run in threads
+        self._indexes: dict[str, VectorIndex] = {}
+        self._lexical: dict[str, LexicalIndex] = {}
+        self._lock = threading.Lock()
+
+    def create_collection(
+        self, collection_name: str, metadata: dict[str, str] | None = None
+    ) -> VectorIndex:
+        """
+        Create or retrieve a collection.
+
+        Args:
+            collection_name (str): The name of the collection to create or retrieve.
+            metadata (dict[str, str] | None, optional): Optional metadata to associate
+                                                       with a new collection. Defaults to None.
+
+        Returns:
+            VectorIndex: The index holding the collection.
+
+        Raises:
+            ValueError: If an existing collection stores embeddings of another
+                        dimensionality.
+        """
+        with self._lock:
+            index = self._indexes.get(collection_name)
+            if index is None:
+                index = self.__open(collection_name)
+                self._indexes[collection_name] = index
+            if not os.path.exists(f"{index.path}.json"):
+                index.metadata = dict(metadata or {})
+                if self.dimensions:
+                    index.metadata[DIMENSIONS_KEY] = self.dimensions
+                index.save()
+
+        if not check_dimensions(collection_name, index.metadata, self.dimensions):
+            raise ValueError(
+                f'Collection "{collection_name}" stores embeddings of another '
+                "dimensionality, use another collection or storage path"
+            )
+        return index
+
+    def get_collection_metadata(self, collection_name: str) -> dict | None:
+        """
+        Get the metadata stored with a collection.
+
+        Args:
+            collection_name (str): The name of the collection.
+
+        Returns:
+            dict | None: The collection metadata (empty if none was set), or None if
+                         the collection was not found.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return None
+
+        return dict(index.metadata)
+
+    def update_collection_metadata(
+        self, collection_name: str, metadata: dict[str, str]
+    ) -> None:
+        """
+        Merge entries into the metadata stored with a collection.
+
+        Args:
+            collection_name (str): The name of the collection.
+            metadata (dict[str, str]): The entries to add or overwrite.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return
+
+        with self._lock:
+            index.metadata = {**index.metadata, **metadata}
+            index.save()
+
+    def add_chunks(
+        self,
+        chunk_ids: list[str],
+        chunks: list[str],
+        collection_name: str,
+        skip_existing: bool = False,
+        **kwargs,
+    ) -> int:
+        """
+        Add document chunks to a collection, see ``ChromaDb.add_chunks``.
+
+        Args:
+            chunk_ids (list[str]): List of unique identifiers for each document chunk.
+            chunks (list[str]): List of document content strings to store.
+            collection_name (str): The name of the collection where chunks will be stored.
+            skip_existing (bool, optional): Whether to skip chunks whose ID is already in the
+                                            collection. Defaults to False (upsert every chunk).
+            **kwargs: Additional per-chunk data:
+                - embeddings (list[list[float]], optional): Pre-computed embeddings if not using embedding function
+                - metadatas (list[dict], optional): Metadata dictionaries for each document
+
+        Returns:
+            int: The number of chunks upserted, 0 if the collection was not found or
+                 stores embeddings of another dimensionality.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return 0
+        if not check_dimensions(collection_name, index.metadata, self.dimensions):
+            return 0
+
+        embeddings = kwargs.get("embeddings")
+        metadatas = kwargs.get("metadatas")
+        if skip_existing and chunk_ids:
+            existing = set(index.contains(chunk_ids))
+            keep = [
+                i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in existing
+            ]
+            chunk_ids = [chunk_ids[i] for i in keep]
+            chunks = [chunks[i] for i in keep]
+            if embeddings is not None:
+                embeddings = [embeddings[i] for i in keep]
+            if metadatas is not None:
+                metadatas = [metadatas[i] for i in keep]
+        if not chunk_ids:
+            return 0
+
+        if embeddings is None:
+            embeddings = self.ef(chunks)
+        records = [
+            {"document": chunk, "metadata": metadatas[i] if metadatas else None}
+            for i, chunk in enumerate(chunks)
+        ]
+
+        lexical = self.__lexical_index(collection_name, index)
+        with tracer.span(
+            "db.upsert",
+            backend="numpy",
+            collection=collection_name,
+            chunks=len(chunk_ids),
+        ):
+            with self._lock:
+                index.upsert(chunk_ids, embeddings, records)
+                index.save()
+            lexical.add(chunk_ids, chunks)
+            lexical.save()
+        self.query_cache.invalidate(collection_name)
+        return len(chunk_ids)
+
+    def delete_stale_chunks(
+        self, doc_id: str, chunk_ids: list[str], collection_name: str
+    ) -> int:
+        """
+        Delete the chunks of a document that are no longer part of its current version.
+
+        Relies on the "<doc_id>:" prefix of the chunk IDs produced by ``PDFChunkGenerator``.
+
+        Args:
+            doc_id (str): Identity of the document.
+            chunk_ids (list[str]): IDs of the chunks in the current version of the document.
+            collection_name (str): The name of the collection holding the chunks.
+
+        Returns:
+            int: The number of deleted chunks, 0 if the collection was not found.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return 0
+
+        current = set(chunk_ids)
+        stale = [
+            chunk_id
+            for chunk_id in index.ids
+            if chunk_id.startswith(f"{doc_id}:") and chunk_id not in current
+        ]
+        if stale:
+            lexical = self.__lexical_index(collection_name, index)
+            with self._lock:
+                index.delete(stale)
+                index.save()
+            lexical.delete(stale)
+            lexical.save()
+            self.query_cache.invalidate(collection_name)
+        return len(stale)
+
+    @tracer.traced("db.query")
+    def query_documents(
+        self,
+        question: str | list[str],
+        collection_name: str,
+        n_results=2,
+        deduplicate=True,
+        fuse=False,
+        hybrid=False,
+        prefilter: int | None = None,
+        **kwargs,
+    ) -> dict[str, Any] | list[str] | None:
+        """
+        Query a collection for the documents most relevant to a given question.
+
+        Behaves like ``ChromaDb.query_documents``.
+
+        Args:
+            question (str | list[str]): The question or query text(s) to search for relevant documents.
+            collection_name (str): The name of the collection to search within.
+            n_results (int, optional): The maximum number of relevant chunks to return.
+                                     Defaults to 2.
+            deduplicate (bool, optional): Whether to remove duplicate documents when using
+                                        multiple queries. Defaults to True.
+            fuse (bool, optional): Whether to merge the results of multiple queries with
+                                 reciprocal rank fusion. Defaults to False.
+            hybrid (bool, optional): Whether to fuse the vector search with a BM25 search
+                                   of the collection's lexical index. Implies ``fuse``.
+                                   Defaults to False.
+            prefilter (int | None, optional): Restrict the vector search to the top
+                                              ``prefilter`` BM25 matches of every query.
+                                              Defaults to None (search every chunk).
+            **kwargs: Additional query parameters:
+                - where (dict, optional): Metadata filtering conditions
+                - where_document (dict, optional): Document content filtering conditions
+                - include (list[str], optional): What to include in results
+                  ("documents", "metadatas", "distances", "embeddings")
+                  If not specified, defaults to ["documents"] and returns list[str]
+
+        Returns:
+            dict[str, Any] | list[str] | None:
+                - If 'include' is specified in kwargs: Returns a ChromaDB-style QueryResult dict
+                - If 'include' not specified (default): Returns list[str] of document chunks
+                - Returns None if collection is not found or stores embeddings of
+                  another dimensionality
+        """
+        if (fuse or hybrid) and not kwargs.get("include"):
+            fused = self.query_fused(
+                question,
+                collection_name,
+                n_results,
+                hybrid=hybrid,
+                prefilter=prefilter,
+                **kwargs,
+            )
+            return None if fused is None else [result["document"] for result in fused]
+
+        queries = [question] if isinstance(question, str) else list(question)
+        candidates = self.__prefilter(collection_name, queries, prefilter)
+        if candidates is not None:
+            kwargs["ids"] = candidates
+
+        if kwargs.get("include"):
+            return self.__search(collection_name, queries, n_results, **kwargs)
+
+        kwargs["include"] = ["documents"]
+        results = self.__search(collection_name, queries, n_results, **kwargs)
+        if results is None:
+            return None
+
+        relevant_chunks: list[str] = [
+            doc for sublist in results["documents"] for doc in sublist
+        ]
+        # remove duplicate document chunks if flagged
+        if deduplicate:
+            relevant_chunks = list(dict.fromkeys(relevant_chunks))
+        return relevant_chunks
+
+    def query_rankings(
+        self,
+        questions: str | list[str],
+        collection_name: str,
+        n_results: int = 5,
+        hybrid: bool = False,
+        prefilter: int | None = None,
+        **kwargs,
+    ) -> list[list[RankedChunk]] | None:
+        """
+        Retrieve the ranking of chunks of every query, see ``ChromaDb.query_rankings``.
+
+        Args:
+            questions (str | list[str]): The question(s) to search for.
+            collection_name (str): The name of the collection to search within.
+            n_results (int, optional): Number of chunks retrieved per query. Defaults to 5.
+            hybrid (bool, optional): Whether to add a BM25 ranking per query. Defaults to
+                                   False.
+            prefilter (int | None, optional): Number of BM25 matches per query the vector
+                                              search is restricted to. Defaults to None
+                                              (search every chunk).
+            **kwargs: Additional filters (``where``, ``where_document``).
+
+        Returns:
+            list[list[RankedChunk]] | None: One vector search ranking per query, in query
+                                            order and best first, followed with ``hybrid``
+                                            by one BM25 ranking per query, or None if the
+                                            collection is not found.
+        """
+        queries = [questions] if isinstance(questions, str) else list(questions)
+        if not queries:
+            return []
+
+        kwargs["include"] = ["documents"]
+        candidates = self.__prefilter(collection_name, queries, prefilter)
+        if candidates is not None:
+            kwargs["ids"] = candidates
+        results = self.__search(collection_name, queries, n_results, **kwargs)
+        if results is None:
+            return None
+
+        rankings: list[list[RankedChunk]] = [
+            [
+                {"chunk_id": chunk_id, "document": document}
+                for chunk_id, document in zip(ids, docs)
+                if document is not None
+            ]
+            for ids, docs in zip(results["ids"], results["documents"])
+        ]
+        if hybrid:
+            rankings.extend(
+                self.__lexical_rankings(
+                    collection_name,
+                    queries,
+                    n_results,
+                    kwargs.get("where"),
+                    kwargs.get("where_document"),
+                )
+            )
+        return rankings
+
+    def query_fused(
+        self,
+        questions: str | list[str],
+        collection_name: str,
+        n_results: int = 5,
+        n_candidates: int | None = None,
+        rrf_k: int = RRF_K,
+        hybrid: bool = False,
+        prefilter: int | None = None,
+        **kwargs,
+    ) -> list[FusedResult] | None:
+        """
+        Retrieve one ranking for several queries with reciprocal rank fusion, see
+        ``ChromaDb.query_fused``.
+
+        Args:
+            questions (str | list[str]): The question(s), e.g. the original question
+                                         followed by LLM-generated subqueries.
+            collection_name (str): The name of the collection to search within.
+            n_results (int, optional): Number of fused results to return. Defaults to 5.
+            n_candidates (int | None, optional): Number of results retrieved per query
+                                                 before fusion. Defaults to None (n_results).
+            rrf_k (int, optional): Rank damping constant. Defaults to 60.
+            hybrid (bool, optional): Whether to fuse a BM25 ranking per query as well.
+                                   Defaults to False.
+            prefilter (int | None, optional): Number of BM25 matches per query the vector
+                                              search is restricted to. Defaults to None
+                                              (search every chunk).
+            **kwargs: Additional filters (``where``, ``where_document``).
+
+        Returns:
+            list[FusedResult] | None: The fused results, best first, or None if the
+                                      collection is not found.
+        """
+        rankings = self.query_rankings(
+            questions,
+            collection_name,
+            n_candidates or n_results,
+            hybrid=hybrid,
+            prefilter=prefilter,
+            **kwargs,
+        )
+        if rankings is None:
+            return None
+
+        return fuse_rankings(rankings, n_results, rrf_k)
+
+    def __path(self, collection_name: str) -> str:
+        return os.path.join(self.storage_path, collection_name)
+
+    def __open(self, collection_name: str) -> VectorIndex:
+        return VectorIndex(
+            self.__path(collection_name),
+            quantization=self.quantization,
+            prefix=self.prefix_dimensions,
+        )
+
+    def __get_index(self, collection_name: str) -> VectorIndex | None:
+        """
+        Get the index of a collection, opening it only the first time.
+
+        Returns:
+            VectorIndex | None: The index, or None if the collection does not exist.
+        """
+        with self._lock:
+            index = self._indexes.get(collection_name)
+            if index is None:
+                path = self.__path(collection_name)
+                if not os.path.exists(f"{path}.json"):
+                    return None
+                index = self.__open(collection_name)
+                self._indexes[collection_name] = index
+            return index
+
+    def __lexical_index(self, collection_name: str, index: VectorIndex) -> LexicalIndex:
+        """
+        Get the lexical index of a collection, opening it only the first time.
+
+        An index not covering the collection, e.g. of a collection ingested before lexical
+        indexes existed, is rebuilt from the stored documents.
+        """
+        with self._lock:
+            lexical = self._lexical.get(collection_name)
+            if lexical is None:
+                lexical = LexicalIndex(f"{self.__path(collection_name)}.lexical")
+                if len(lexical) != len(index):
+                    lexical.clear()
+                    lexical.add(
+                        index.ids,
+                        [record["document"] or "" for record in index.records],
+                    )
+                    lexical.save()
+                self._lexical[collection_name] = lexical
+            return lexical
+
+    def __prefilter(
+        self, collection_name: str, queries: list[str], prefilter: int | None
+    ) -> list[str] | None:
+        # the ids a vector search is restricted to, None to search every chunk
+        index = self.__get_index(collection_name)
+        if not prefilter or index is None:
+            return None
+        lexical = self.__lexical_index(collection_name, index)
+        return lexical.candidates(queries, prefilter) or None
+
+    def __lexical_rankings(
+        self,
+        collection_name: str,
+        queries: list[str],
+        n_results: int,
+        where: dict[str, Any] | None = None,
+        where_document: dict[str, Any] | None = None,
+    ) -> list[list[RankedChunk]]:
+        """
+        Rank the chunks of a collection by BM25 for every query, applying the filters.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            return [[] for _ in queries]
+        lexical = self.__lexical_index(collection_name, index)
+        hits = [lexical.search(query, n_results) for query in queries]
+
+        rankings: list[list[RankedChunk]] = []
+        with self._lock:
+            allowed = index.filter(where, where_document)
+            allowed = None if allowed is None else set(allowed.tolist())
+            for ranking in hits:
+                positions = index.positions([chunk_id for chunk_id, _ in ranking])
+                rankings.append(
+                    [
+                        {
+                            "chunk_id": index.ids[i],
+                            "document": index.records[i]["document"],
+                        }
+                        for i in positions.tolist()
+                        if (allowed is None or i in allowed)
+                        and index.records[i]["document"] is not None
+                    ]
+                )
+        return rankings
+
+    def __search(
+        self, collection_name: str, queries: list[str], n_results: int, **kwargs
+    ) -> dict[str, Any] | None:
+        """
+        Search a collection, reusing cached query embeddings and query results.
+
+        Returns:
+            dict[str, Any] | None: A ChromaDB-style QueryResult holding the fields listed
+                                   in ``include`` plus the IDs, or None (after printing
+                                   an error) if the collection does not exist or stores
+                                   embeddings of another dimensionality.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return None
+        if not check_dimensions(collection_name, index.metadata, self.dimensions):
+            return None
+        embeddings = self.query_cache.embed(queries, self.ef)
+        key = self.query_cache.result_key(
+            collection_name, embeddings, n_results, **kwargs
+        )
+
+        results = self.query_cache.get_result(key)
+        if results is not None:
+            return results
+
+        include = kwargs.get("include") or ["documents"]
+        with (
+            tracer.span(
+                "db.search",
+                backend="numpy",
+                collection=collection_name,
+                queries=len(queries),
+                n_results=n_results,
+            ),
+            self._lock,
+        ):
+            candidates = index.filter(kwargs.get("where"), kwargs.get("where_document"))
+            if kwargs.get("ids") is not None:
+                restricted = index.positions(kwargs["ids"])
+                candidates = (
+                    restricted
+                    if candidates is None
+                    else np.intersect1d(candidates, restricted)
+                )
+            positions, similarities = index.search(embeddings, n_results, candidates)
+            records = [[index.records[i] for i in row] for row in positions]
+            results = {
+                "ids": [[index.ids[i] for i in row] for row in positions],
+                "documents": None,
+                "metadatas": None,
+                "distances": None,
+                "embeddings": None,
+                "included": include,
+            }
+            if "documents" in include:
+                results["documents"] = [
+                    [record["document"] for record in row] for row in records
+                ]
+            if "metadatas" in include:
+                results["metadatas"] = [
+                    [record["metadata"] for record in row] for row in records
+                ]
+            if "distances" in include:
+                results["distances"] = (2 - 2 * similarities).clip(min=0).tolist()
+            if "embeddings" in include:
+                results["embeddings"] = [index.embeddings(row) for row in positions]
+
+        self.query_cache.put_result(key, results)
+        return results
@@ -1,6 +1,97 @@
 from pypdf import PdfReader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from concurrent.futures import ProcessPoolExecutor
+from extraction_cache import ExtractionCache
+from token_chunker import TokenChunk, TokenWindowChunker
+from rag_common.tracing import tracer
+import argparse
+import hashlib
 import os
+import pypdf
+
+
+# bump the suffix whenever the extraction, chunking or cache entry format changes
+EXTRACTOR_VERSION = f"pypdf-{pypdf.__version__}/3"
+
+# splitter settings, part of the extraction cache key
+CHUNK_SIZE = 256
+SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+ENCODING_NAME = "gpt2"
+
+
+def document_fingerprint(pdf_path: str) -> str:
+    """
+    Fingerprint a PDF together with the way it is extracted and chunked.
+
+    Two fingerprints match exactly when processing the files would produce the same
+    chunks, which makes it usable both as the extraction cache key and to detect
+    whether a stored copy of the document is still current.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+
+    Returns:
+        str: A hex sha256 digest of the file content, extractor version and splitter settings.
+    """
+    return ExtractionCache.key(
+        pdf_path,
+        EXTRACTOR_VERSION,
+        {
+            "splitter": "token-window",
+            "chunk_size": CHUNK_SIZE,
+            "separators": SEPARATORS,
+            "encoding": ENCODING_NAME,
+        },
+    )
+
+
+def make_chunk_id(doc_id: str, chunk: str, occurrence: int) -> str:
+    """
+    Derive a stable chunk id from the document identity and the chunk content.
+
+    The id does not depend on the chunk's position, so editing one part of a document
+    leaves the ids of all unchanged chunks intact.
+
+    Args:
+        doc_id (str): Identity of the document the chunk belongs to.
+        chunk (str): The chunk text.
+        occurrence (int): How many identical chunks precede this one in the document,
+                          which keeps repeated text (e.g. page headers) apart.
+
+    Returns:
+        str: An id of the form "<doc_id>:<content hash>:<occurrence>".
+    """
+    digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+    return f"{doc_id}:{digest}:{occurrence}"
+
+
+def extract_page_range(
+    pdf_path: str, start: int, stop: int
+) -> list[tuple[int, str | None, str | None]]:
+    """
+    Extract the text of a contiguous range of PDF pages.
+
+    Runs in a worker process, so it opens its own PdfReader. A page that fails to
+    extract is reported instead of aborting the whole range.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        start (int): Index of the first page to extract.
+        stop (int): Index one past the last page to extract.
+
+    Returns:
+        list[tuple[int, str | None, str | None]]: For every page in the range, its index,
+            its stripped text (None on failure) and the error message (None on success).
+    """
+    reader = PdfReader(pdf_path, strict=True)
+    results: list[tuple[int, str | None, str | None]] = []
+    for page_number in range(start, stop):
+        try:
+            results.append(
+                (page_number, reader.pages[page_number].extract_text().strip(), None)
+            )
+        except Exception as e:
+            results.append((page_number, None, str(e)))
+    return results
 
 
 class PDFChunkGenerator:
@@ -11,39 +102,120 @@ class PDFChunkGenerator:
     suitable for embedding and retrieval. The PDF is processed once during initialization
     and results are stored as instance attributes for efficient access.
 
+    Extracted texts and chunks are persisted in an ExtractionCache keyed by the PDF's
+    content hash, the extractor version and the splitter settings, so processing the
+    same document again skips both PDF parsing and tokenization.
+
     Attributes:
         pdf_path (str): The file path to the PDF document to be processed.
+        workers (int): Number of processes used to extract page text.
+        page_errors (dict[int, str]): Error message for every page (by zero-based index)
+            whose text could not be extracted.
         texts (list[str] | None): Extracted text content from PDF pages.
         chunks (list[str]): Text chunks optimized for embedding and retrieval.
-        chunk_ids (list[str]): Sequential IDs corresponding to each chunk.
+        doc_id (str): Identity of the document, used as the prefix of every chunk id.
+        fingerprint (str): Fingerprint of the document version and processing settings,
+            see ``document_fingerprint``.
+        chunk_ids (list[str]): Content-derived IDs corresponding to each chunk.
+        chunk_offsets (list[tuple[int, ...]]): For each chunk, its (char_start, char_end,
+            token_start, token_end) offsets in the page texts joined by "\\n\\n".
+        cache (ExtractionCache | None): Cache the results are loaded from and stored in,
+            None if caching is disabled.
+        from_cache (bool): Whether the results were loaded from the cache.
 
     Raises:
-        ValueError: If the provided PDF path does not exist.
+        ValueError: If the provided PDF path does not exist or workers is less than 1.
 
     Example:
-        >>> generator = PDFChunkGenerator("data/document.pdf")
+        >>> generator = PDFChunkGenerator("data/document.pdf", workers=8)
         >>> print(f"Generated {len(generator.chunks)} text chunks")
         >>> for chunk_id, chunk in zip(generator.chunk_ids, generator.chunks):
         ...     print(f"Chunk {chunk_id}: {chunk[:50]}...")
     """
 
-    def __init__(self, pdf_path: str) -> None:
+    def __init__(
+        self,
+        pdf_path: str,
+        workers: int = 1,
+        doc_id: str | None = None,
+        cache: ExtractionCache | None = None,
+        use_cache: bool = True,
+    ) -> None:
         """
         Initialize the PDF chunk generator and process the document.
 
         Args:
             pdf_path (str): Path to the PDF file to process.
+            workers (int, optional): Number of processes that extract page text in
+                                     parallel, each handling a contiguous range of
+                                     pages. Defaults to 1 (extract in this process).
+            doc_id (str | None, optional): Identity of the document. It should stay the
+                                           same across revisions of the document, so
+                                           unchanged chunks keep their ids. Defaults to
+                                           the file name without its extension.
+            cache (ExtractionCache | None, optional): Cache for extracted texts and
+                                                      chunks. Defaults to a cache in
+                                                      "./extraction_cache".
+            use_cache (bool, optional): Whether to read and write the cache at all.
+                                        Defaults to True.
 
         Raises:
-            ValueError: If the PDF path does not exist.
+            ValueError: If the PDF path does not exist or workers is less than 1.
         """
         self.pdf_path = pdf_path
+        self.workers = workers
+        self.doc_id = doc_id or os.path.splitext(os.path.basename(pdf_path))[0]
+        self.page_errors: dict[int, str] = {}
 
         if not os.path.exists(self.pdf_path):
             raise ValueError("PDF path does not exist")
-
-        self.texts: list[str] | None = self.__pdf_to_texts()
-        self.chunk_ids, self.chunks = self.__texts_to_chunks()
+        if self.workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.cache = (cache or ExtractionCache()) if use_cache else None
+        self.from_cache = False
+
+        self.fingerprint = document_fingerprint(self.pdf_path)
+
+        if self.cache is not None:
+            cached = self.cache.load(self.fingerprint)
+            if cached is not None:
+                self.texts: list[str] | None = cached["texts"]
+                self.chunks: list[str] = cached["chunks"]
+                self.chunk_offsets = [tuple(offsets) for offsets in cached["offsets"]]
+                self.chunk_ids = self.__chunk_ids()
+                self.from_cache = True
+                return
+
+        with tracer.span("pdf.load", path=self.pdf_path, workers=self.workers) as span:
+            self.texts = self.__pdf_to_texts()
+            span.set(pages=len(self.texts or []), page_errors=len(self.page_errors))
+        with tracer.span("pdf.chunk") as span:
+            token_chunks = self.__texts_to_chunks()
+            span.set(chunks=len(token_chunks))
+        self.chunks = [chunk["text"] for chunk in token_chunks]
+        self.chunk_offsets: list[tuple[int, ...]] = [
+            (
+                chunk["char_start"],
+                chunk["char_end"],
+                chunk["token_start"],
+                chunk["token_end"],
+            )
+            for chunk in token_chunks
+        ]
+        self.chunk_ids = self.__chunk_ids()
+
+        # only cache complete extractions, failed pages may succeed on a later run
+        if self.cache is not None:
+            if self.texts is not None and not self.page_errors:
+                self.cache.save(
+                    self.fingerprint,
+                    {
+                        "texts": self.texts,
+                        "chunks": self.chunks,
+                        "offsets": [list(offsets) for offsets in self.chunk_offsets],
+                    },
+                )
 
     def get_chunks(self) -> list[str]:
         """
@@ -60,13 +232,15 @@ class PDFChunkGenerator:
 
     def get_chunk_ids(self) -> list[str]:
         """
-        Get the sequential IDs for each text chunk.
+        Get the stable IDs for each text chunk.
 
-        Returns the pre-computed chunk IDs that correspond to the chunks.
-        Each ID represents the position of its corresponding chunk in the sequence as a string.
+        Returns the pre-computed chunk IDs that correspond to the chunks. Each ID combines
+        the document identity, a hash of the chunk content and the number of identical
+        chunks before it, so IDs survive edits elsewhere in the document and never collide
+        between documents.
 
         Returns:
-            list[str]: A list of sequential string IDs starting from "0", one for each chunk.
+            list[str]: A list of string IDs of the form "<doc_id>:<hash>:<n>", one for each chunk.
         """
         return self.chunk_ids
 
@@ -88,7 +262,9 @@ class PDFChunkGenerator:
         Extract and return all text content from the PDF pages.
 
         Reads the PDF file and extracts text from each page, removing any
-        empty or whitespace-only pages. This method is called once during
+        empty or whitespace-only pages. With more than one worker, the pages are
+        split into contiguous ranges that are extracted by a process pool, and the
+        results are reassembled in page order. This method is called once during
         initialization.
 
         Returns:
@@ -97,49 +273,106 @@ class PDFChunkGenerator:
 
         Raises:
             Prints error message if PDF reading fails, but doesn't raise exceptions
-            to allow graceful degradation.
+            to allow graceful degradation. Pages that fail individually are skipped,
+            reported and recorded in ``page_errors``.
         """
         # read the pdf contents
         try:
-            reader = PdfReader(self.pdf_path, strict=True)
-            texts = [page.extract_text().strip() for page in reader.pages]
-            # remove whitespace lines
-            return [text for text in texts if text]
+            n_pages = len(PdfReader(self.pdf_path, strict=True).pages)
         except Exception as e:
             print(f"Error while parsing pdf: {e}")
-
-    def __texts_to_chunks(self) -> tuple[list[str], list[str]]:
+            return None
+
+        if self.workers == 1 or n_pages < 2:
+            results = extract_page_range(self.pdf_path, 0, n_pages)
+        else:
+            # give every worker one contiguous range of roughly equal size
+            n_ranges = min(self.workers, n_pages)
+            bounds = [n_pages * i // n_ranges for i in range(n_ranges + 1)]
+            ranges = list(zip(bounds, bounds[1:]))
+
+            results = []
+            with ProcessPoolExecutor(max_workers=n_ranges) as pool:
+                futures = [
+                    pool.submit(extract_page_range, self.pdf_path, start, stop)
+                    for start, stop in ranges
+                ]
+                # collect in submission order, which is page order
+                for (start, stop), future in zip(ranges, futures):
+                    try:
+                        results.extend(future.result())
+                    except Exception as e:
+                        results.extend(
+                            (page_number, None, str(e))
+                            for page_number in range(start, stop)
+                        )
+
+        self.page_errors = {
+            page_number: error for page_number, _, error in results if error is not None
+        }
+        for page_number, error in self.page_errors.items():
+            print(f"Error while extracting page {page_number + 1}: {error}")
+
+        # remove whitespace lines
+        return [text for _, text, _ in results if text]
+
+    def __texts_to_chunks(self) -> list[TokenChunk]:
         """
-        Generate text chunks with IDs suitable for embedding and retrieval.
+        Split the extracted text into chunks suitable for embedding and retrieval.
 
-        Takes the extracted PDF text and splits it into smaller chunks using
-        RecursiveCharacterTextSplitter with tiktoken encoding. The chunks are
-        optimized for RAG applications with a size of 256 tokens and no overlap.
-        This method is called once during initialization.
+        Takes the extracted PDF text, joined by paragraph breaks, and splits it into
+        smaller chunks using TokenWindowChunker, which tokenizes every page only once.
+        The chunks are optimized for RAG applications with a size of 256 tokens and no
+        overlap. This method is called once during initialization.
 
         Returns:
-            tuple[list[str], list[str]]: A tuple containing:
-                - list[str]: Sequential chunk IDs as strings starting from "0"
-                - list[str]: Text chunks, each approximately 256 tokens in size,
-                           split at natural boundaries (paragraphs, sentences, etc.).
-                           Returns empty lists if no texts were extracted.
-
+            list[TokenChunk]: Text chunks, each at most 256 tokens in size, split at
+                              natural boundaries (paragraphs, sentences, etc.), with
+                              their character and token offsets. Returns an empty list
+                              if no texts were extracted.
         """
-        token_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            separators=["\n\n", "\n", ". ", " ", ""], chunk_size=256, chunk_overlap=0
+        token_chunker = TokenWindowChunker(
+            chunk_size=CHUNK_SIZE, separators=SEPARATORS, encoding_name=ENCODING_NAME
         )
 
-        chunks: list[str] = (
-            token_splitter.split_text("\n\n".join(self.texts)) if self.texts else []
-        )
+        return token_chunker.split_pages(self.texts) if self.texts else []
 
-        chunk_ids = [str(id) for id in range(len(chunks))]
+    def __chunk_ids(self) -> list[str]:
+        """
+        Derive a stable, content-based id for every chunk.
 
-        return chunk_ids, chunks
+        Returns:
+            list[str]: One id per chunk, see ``make_chunk_id``.
+        """
+        occurrences: dict[str, int] = {}
+        chunk_ids: list[str] = []
+        for chunk in self.chunks:
+            occurrence = occurrences.get(chunk, 0)
+            occurrences[chunk] = occurrence + 1
+            chunk_ids.append(make_chunk_id(self.doc_id, chunk, occurrence))
+        return chunk_ids
 
 
 if __name__ == "__main__":
-    token_factory = PDFChunkGenerator(pdf_path="data/microsoft-annual-report.pdf")
+    parser = argparse.ArgumentParser(description="Extract and chunk a PDF document")
+    parser.add_argument("--pdf", default="data/microsoft-annual-report.pdf")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes extracting page text (default: all cores)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="ignore the extraction cache and always parse the pdf",
+    )
+    args = parser.parse_args()
+
+    token_factory = PDFChunkGenerator(
+        pdf_path=args.pdf, workers=args.workers, use_cache=not args.no_cache
+    )
+    print(f"Loaded from cache: {token_factory.from_cache}")
     token_chunks: list[str] = token_factory.chunks
 
     print(len(token_chunks))
@@ -1,5 +1,8 @@
 from util import load_and_get_key
-from openai import OpenAI
+from completion_cache import CompletionCache
+from rag_common.streaming import CompletionStream
+from rag_common.tracing import tracer
+from openai import AsyncOpenAI, OpenAI
 from openai.types.chat import (
     ChatCompletionSystemMessageParam,
     ChatCompletionUserMessageParam,
@@ -8,9 +11,15 @@ from openai.types.chat import (
 
 api_key = load_and_get_key()
 client = OpenAI(api_key=api_key)
+async_client = AsyncOpenAI(api_key=api_key)
+# repeated requests (e.g. the expansions of a question asked before) are answered from disk
+completion_cache = CompletionCache()
 
 
-def generate_single_query_response(query: str, model: str = "gpt-4.1-nano") -> str:
+@tracer.traced("response.hypothetical_answer")
+def generate_single_query_response(
+    query: str, model: str = "gpt-4.1-nano", use_cache: bool = True
+) -> str:
     """
     Generate a hypothetical answer for query expansion in RAG systems.
 
@@ -30,6 +39,8 @@ def generate_single_query_response(query: str, model: str = "gpt-4.1-nano") -> s
     Args:
         query (str): The original user question to generate a hypothetical answer for
         model (str, optional): The OpenAI model to use for generation. Defaults to 'gpt-4.1-nano'
+        use_cache (bool, optional): Whether to answer from, and store the response in, the
+                                    completion cache. Defaults to True
 
     Returns:
         str: A hypothetical answer that can be combined with the original query
@@ -61,7 +72,9 @@ def generate_single_query_response(query: str, model: str = "gpt-4.1-nano") -> s
         {"role": "user", "content": query},
     ]
 
-    response = client.chat.completions.create(model=model, messages=messages)
+    response = completion_cache.create(
+        client, use_cache=use_cache, model=model, messages=messages
+    )
 
     content = response.choices[0].message.content
     if content is None:
@@ -70,7 +83,10 @@ def generate_single_query_response(query: str, model: str = "gpt-4.1-nano") -> s
     return content
 
 
-def generate_multi_query_response(query: str, model: str = "gpt-4.1-nano") -> list[str]:
+@tracer.traced("response.expand_queries")
+def generate_multi_query_response(
+    query: str, model: str = "gpt-4.1-nano", use_cache: bool = True
+) -> list[str]:
     """
     Generate multiple related subqueries for comprehensive RAG retrieval.
 
@@ -92,6 +108,8 @@ def generate_multi_query_response(query: str, model: str = "gpt-4.1-nano") -> li
     Args:
         query (str): The original user question to expand into multiple subqueries
         model (str, optional): The OpenAI model to use for generation. Defaults to 'gpt-4.1-nano'
+        use_cache (bool, optional): Whether to answer from, and store the response in, the
+                                    completion cache. Defaults to True
 
     Returns:
         list[str]: A cleaned list of related questions that are processed together
@@ -151,7 +169,9 @@ def generate_multi_query_response(query: str, model: str = "gpt-4.1-nano") -> li
         {"role": "user", "content": query},
     ]
 
-    response = client.chat.completions.create(model=model, messages=messages)
+    response = completion_cache.create(
+        client, use_cache=use_cache, model=model, messages=messages
+    )
 
     content = response.choices[0].message.content
     if content is None:
@@ -167,8 +187,45 @@ def generate_multi_query_response(query: str, model: str = "gpt-4.1-nano") -> li
     return cleaned_queries
 
 
+def _context_messages(
+    query: str, context_chunks: list[str]
+) -> list[ChatCompletionSystemMessageParam | ChatCompletionUserMessageParam]:
+    # the prompt shared by the blocking and streaming context responses
+
+    # Handle case where no context is provided
+    if not context_chunks:
+        context_text = "No relevant context found."
+    else:
+        # Combine all context chunks into a single text block
+        context_text = "\n\n".join(
+            [f"Context {i + 1}: {chunk}" for i, chunk in enumerate(context_chunks)]
+        )
+
+    system_prompt = """You are a helpful financial research assistant. 
+    Answer the user's question based solely on the provided context from financial documents. 
+    Be factual, comprehensive, and cite specific information from the context when possible. 
+    If the context doesn't contain enough information to fully answer the question, 
+    clearly state what information is missing. Do not make up information not present in the context."""
+
+    user_prompt = f"""Question: {query}
+
+Context from retrieved documents:
+{context_text}
+
+Please provide a comprehensive answer based on the context above."""
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+@tracer.traced("response.answer")
 def generate_response_with_context(
-    query: str, context_chunks: list[str], model: str = "gpt-4.1-nano"
+    query: str,
+    context_chunks: list[str],
+    model: str = "gpt-4.1-nano",
+    use_cache: bool = True,
 ) -> str:
     """
     Generate a comprehensive response using the original query and retrieved document context.
@@ -190,6 +247,8 @@ def generate_response_with_context(
         query (str): The original user question that needs to be answered
         context_chunks (list[str]): List of relevant document chunks retrieved from vector database
         model (str, optional): The OpenAI model to use for generation. Defaults to 'gpt-4.1-nano'
+        use_cache (bool, optional): Whether to answer from, and store the response in, the
+                                    completion cache. Defaults to True
 
     Returns:
         str: A comprehensive response that answers the query using the provided context
@@ -222,39 +281,88 @@ def generate_response_with_context(
         - Model is instructed to be factual and cite information from context
     """
 
-    # Handle case where no context is provided
-    if not context_chunks:
-        context_text = "No relevant context found."
-    else:
-        # Combine all context chunks into a single text block
-        context_text = "\n\n".join(
-            [f"Context {i + 1}: {chunk}" for i, chunk in enumerate(context_chunks)]
-        )
+    messages = _context_messages(query, context_chunks)
 
-    system_prompt = """You are a helpful financial research assistant. 
-    Answer the user's question based solely on the provided context from financial documents. 
-    Be factual, comprehensive, and cite specific information from the context when possible. 
-    If the context doesn't contain enough information to fully answer the question, 
-    clearly state what information is missing. Do not make up information not present in the context."""
+    response = completion_cache.create(
+        client, use_cache=use_cache, model=model, messages=messages
+    )
 
-    user_prompt = f"""Question: {query}
+    content = response.choices[0].message.content
+    if content is None:
+        raise ValueError("OpenAI API returned None content")
 
-Context from retrieved documents:
-{context_text}
+    return content
 
-Please provide a comprehensive answer based on the context above."""
 
-    messages: list[
-        ChatCompletionSystemMessageParam | ChatCompletionUserMessageParam
-    ] = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-    ]
+def stream_response_with_context(
+    query: str,
+    context_chunks: list[str],
+    model: str = "gpt-4.1-nano",
+    use_cache: bool = True,
+) -> CompletionStream:
+    """
+    Stream the response of ``generate_response_with_context`` token by token.
 
-    response = client.chat.completions.create(model=model, messages=messages)
+    The answer is the same, but its text is yielded as the tokens arrive instead of once
+    the whole completion is done, so the first words appear after the time to first
+    token rather than after the full generation time.
 
-    content = response.choices[0].message.content
-    if content is None:
-        raise ValueError("OpenAI API returned None content")
+    Args:
+        query (str): The original user question that needs to be answered
+        context_chunks (list[str]): List of relevant document chunks retrieved from vector database
+        model (str, optional): The OpenAI model to use for generation. Defaults to 'gpt-4.1-nano'
+        use_cache (bool, optional): Whether to answer from, and store the response in, the
+                                    completion cache. Defaults to True
 
-    return content
+    Returns:
+        CompletionStream: A stream to iterate with ``for``. The request is sent when the
+                          iteration starts. Once it ended, ``stream.text`` holds the full
+                          response and ``stream.stats`` the time to first token and the
+                          token counts.
+
+    Example:
+        >>> stream = stream_response_with_context(query, chunks)
+        >>> for delta in stream:
+        ...     print(delta, end="", flush=True)
+        >>> print(f"\nfirst token after {stream.stats['ttft']:.2f}s")
+    """
+    messages = _context_messages(query, context_chunks)
+
+    return completion_cache.stream(
+        client, use_cache=use_cache, model=model, messages=messages
+    )
+
+
+def astream_response_with_context(
+    query: str,
+    context_chunks: list[str],
+    model: str = "gpt-4.1-nano",
+    use_cache: bool = True,
+) -> CompletionStream:
+    """
+    Stream the response of ``generate_response_with_context`` token by token, asynchronously.
+
+    The asynchronous counterpart of ``stream_response_with_context``, for use inside an
+    event loop without blocking it.
+
+    Args:
+        query (str): The original user question that needs to be answered
+        context_chunks (list[str]): List of relevant document chunks retrieved from vector database
+        model (str, optional): The OpenAI model to use for generation. Defaults to 'gpt-4.1-nano'
+        use_cache (bool, optional): Whether to answer from, and store the response in, the
+                                    completion cache. Defaults to True
+
+    Returns:
+        CompletionStream: A stream to iterate with ``async for``, see
+                          ``stream_response_with_context``.
+
+    Example:
+        >>> stream = astream_response_with_context(query, chunks)
+        >>> async for delta in stream:
+        ...     print(delta, end="", flush=True)
+    """
+    messages = _context_messages(query, context_chunks)
+
+    return completion_cache.astream(
+        async_client, use_cache=use_cache, model=model, messages=messages
+    )
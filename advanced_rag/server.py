@@ -0,0 +1,864 @@
+"""
+A long-running HTTP service answering questions over the ingested annual report.
+
+``main.py`` pays for its whole startup on every question: importing chromadb and
+langchain, opening the persistent client, loading the collection's HNSW index into
+memory and creating the OpenAI clients. The service does that once and keeps the vector
+store, the embedding function, the embedding engine and the LLM clients (with their
+connection pools) warm, so a question only costs its embedding, search and LLM calls.
+
+Endpoints:
+    POST /query   {"question": "...", "technique": "raw" | "hyde" | "multi",
+                   "n_results": 5, "hybrid": false, "prefilter": null, "stream": false}
+                  Answers a question. With "stream": true the response is NDJSON, one
+                  {"event": "delta", "text": ...} line per token and a final
+                  {"event": "done", ...} line with the result.
+    POST /ingest  {"pdf_path": "data/microsoft-annual-report.pdf", "pdf_workers": 1}
+                  Ingests a PDF into the collection (a no-op for unchanged documents).
+                  Only PDFs inside ``--data-dir`` are accepted.
+    GET /health   Liveness and load; 503 while shutting down.
+    GET /metrics  Stage timings, tokens and cost in the Prometheus text format.
+
+At most ``--workers`` queries and ingests run at once, up to ``--queue-size`` more wait
+in line, and requests beyond that (or waiting longer than ``--queue-timeout``) are
+rejected with 503, so an overloaded service sheds load instead of queueing without bound.
+On SIGINT or SIGTERM the service stops accepting connections, finishes the admitted
+requests within ``--grace-period`` and closes the trace file.
+
+Usage:
+    python server.py --port 8000 --backend numpy --workers 4 --queue-size 32
+
+    curl -s localhost:8000/query -d '{"question": "How did Azure grow?"}'
+    curl -sN localhost:8000/query -d '{"question": "...", "technique": "multi", "stream": true}'
+"""
+
+from chroma import ChromaDb, FusedResult
+from http import HTTPStatus
+from main import (
+    COLLECTION_NAME,
+    PDF_PATH,
+    IngestResult,
+    add_pipeline_arguments,
+    create_db,
+    create_packer,
+    ingest_document,
+)
+from numpy_db import NumpyDb
+from rag_common.context_packer import ContextPacker
+from rag_common.tracing import tracer
+from response import (
+    astream_response_with_context,
+    completion_cache,
+    generate_multi_query_response,
+    generate_single_query_response,
+)
+from typing import Any, AsyncIterator, Awaitable, Callable, TypedDict
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import signal
+import time
+
+
+TECHNIQUES = ("raw", "hyde", "multi")
+# largest accepted request body, questions and ingest requests are small
+MAX_BODY_BYTES = 64 * 1024
+# seconds an idle keep-alive connection stays open
+KEEP_ALIVE_TIMEOUT = 15.0
+# the only directory /ingest reads documents from
+DATA_DIR = "data"
+
+
+class HttpRequest(TypedDict):
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes
+
+
+class QueryResult(TypedDict):
+    question: str
+    technique: str
+    # the queries searched: the question, its HyDE expansion or question and subqueries
+    queries: list[str]
+    answer: str
+    chunks: list[FusedResult]
+    # chunks handed to the LLM after packing
+    context_chunks: int
+    retrieval_ms: float
+    ttft_ms: float | None
+    total_ms: float
+    prompt_tokens: int | None
+    completion_tokens: int
+
+
+class HttpError(Exception):
+    """
+    A request that is answered with an error status and a JSON ``{"error": ...}`` body.
+
+    Attributes:
+        status (int): The HTTP status code.
+        message (str): The error message.
+        headers (dict[str, str]): Extra response headers, e.g. ``Retry-After``.
+    """
+
+    def __init__(
+        self, status: int, message: str, headers: dict[str, str] | None = None
+    ) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class RagService:
+    """
+    The RAG pipelines behind an asyncio HTTP server, sharing one warm vector store.
+
+    Blocking work (LLM expansions, embedding calls, searches, packing, ingestion) runs in
+    worker threads, the answer is streamed with the asynchronous OpenAI client, so the
+    event loop keeps accepting and rejecting requests while others run. The admission
+    limits (``workers``, ``queue_size``) bound the threads and memory in use under load.
+
+    Attributes:
+        db (ChromaDb | NumpyDb): The vector store, opened once.
+        packer (ContextPacker | None): Packs retrieved chunks into a token budget.
+        draining (bool): Set on shutdown, new requests are rejected from then on.
+        stats (dict[str, int]): Request counters, see ``health``.
+
+    Example:
+        >>> service = RagService(db, workers=4, queue_size=32)
+        >>> asyncio.run(service.serve("127.0.0.1", 8000))
+    """
+
+    def __init__(
+        self,
+        db: ChromaDb | NumpyDb,
+        collection_name: str = COLLECTION_NAME,
+        packer: ContextPacker | None = None,
+        n_results: int = 5,
+        hybrid: bool = False,
+        prefilter: int | None = None,
+        workers: int = 4,
+        queue_size: int = 32,
+        queue_timeout: float = 30.0,
+        pdf_path: str = PDF_PATH,
+        pdf_workers: int = 1,
+        data_dir: str = DATA_DIR,
+    ) -> None:
+        """
+        Initialize the service without binding a port.
+
+        Args:
+            db (ChromaDb | NumpyDb): The vector store to answer from.
+            collection_name (str, optional): The collection holding the ingested
+                                             documents. Defaults to 'microsoft-collection'.
+            packer (ContextPacker | None, optional): Packs the retrieved chunks into a
+                                                     token budget. Defaults to None.
+            n_results (int, optional): Chunks handed to the LLM unless a request asks
+                                       for another number. Defaults to 5.
+            hybrid (bool, optional): Default of the requests' ``hybrid``. Defaults to
+                                     False.
+            prefilter (int | None, optional): Default of the requests' ``prefilter``.
+                                              Defaults to None.
+            workers (int, optional): Requests processed at once. Defaults to 4.
+            queue_size (int, optional): Requests waiting for a worker before new ones
+                                        are rejected. Defaults to 32.
+            queue_timeout (float, optional): Seconds a request may wait for a worker.
+                                             Defaults to 30.
+            pdf_path (str, optional): The document ``/ingest`` ingests by default.
+                                      Defaults to the annual report.
+            pdf_workers (int, optional): Default processes extracting PDF page text.
+                                         Defaults to 1.
+            data_dir (str, optional): The directory ``/ingest`` may read PDFs from.
+                                      Defaults to 'data'.
+        """
+        self.db = db
+        self.collection_name = collection_name
+        self.packer = packer
+        self.n_results = n_results
+        self.hybrid = hybrid
+        self.prefilter = prefilter
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.pdf_path = pdf_path
+        self.pdf_workers = pdf_workers
+        self.data_dir = os.path.realpath(data_dir)
+        self.draining = False
+        self.stats = {"requests": 0, "rejected": 0, "errors": 0}
+
+        self._started = time.monotonic()
+        # created in serve, they bind to the running loop
+        self._slots: asyncio.Semaphore | None = None
+        self._ingest_lock: asyncio.Lock | None = None
+        self._waiting = 0
+        self._running = 0
+        # open connections, and the ones in the middle of a request
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._busy: set[asyncio.StreamWriter] = set()
+
+    async def serve(
+        self, host: str = "127.0.0.1", port: int = 8000, grace_period: float = 30.0
+    ) -> None:
+        """
+        Serve until SIGINT or SIGTERM, then shut down gracefully.
+
+        Args:
+            host (str, optional): Interface to bind. Defaults to "127.0.0.1".
+            port (int, optional): Port to bind, 0 for any free port. Defaults to 8000.
+            grace_period (float, optional): Seconds admitted requests get to finish on
+                                            shutdown before they are cancelled.
+                                            Defaults to 30.
+        """
+        self._slots = asyncio.Semaphore(self.workers)
+        self._ingest_lock = asyncio.Lock()
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        server = await asyncio.start_server(
+            self.__handle_connection, host, port, limit=MAX_BODY_BYTES
+        )
+        address = server.sockets[0].getsockname()
+        print(
+            f"🚀 Serving on http://{address[0]}:{address[1]} "
+            f"(workers: {self.workers}, queue: {self.queue_size})",
+            flush=True,
+        )
+
+        await stop.wait()
+        await self.shutdown(server, grace_period)
+
+    async def shutdown(self, server: asyncio.Server, grace_period: float) -> None:
+        """
+        Stop accepting requests, let the admitted ones finish, then close everything.
+
+        Args:
+            server (asyncio.Server): The listening server.
+            grace_period (float): Seconds the admitted requests get to finish.
+        """
+        self.draining = True
+        server.close()
+        print(
+            f"🛑 Shutting down, finishing {self._running + self._waiting} request(s)...",
+            flush=True,
+        )
+
+        # idle keep-alive connections would never send another request
+        for writer in list(self._connections):
+            if writer not in self._busy:
+                writer.close()
+
+        deadline = time.monotonic() + grace_period
+        while self._busy and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._busy:
+            print(f"⚠️  Cancelling {len(self._busy)} request(s) after the grace period")
+            for writer in list(self._busy):
+                self._connections[writer].cancel()
+
+        await server.wait_closed()
+        tracer.close()
+        cache_stats = completion_cache.stats()
+        print(
+            f"✅ Stopped after {self.stats['requests']} requests "
+            f"({self.stats['rejected']} rejected, {self.stats['errors']} failed), "
+            f"completion cache {cache_stats['hits']} hits, {cache_stats['misses']} misses",
+            flush=True,
+        )
+
+    async def warm_up(self) -> None:
+        """
+        Load the collection's search index with a first query.
+
+        The backends open collections lazily, so without it the first request would pay
+        for loading the index. The query is one embedding call, a failure is printed and
+        ignored.
+        """
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(
+                self.db.query_rankings, ["warm up"], self.collection_name, 1
+            )
+        except Exception as e:
+            print(f"⚠️  Warm-up query failed: {e}")
+            return
+        print(f"🔥 Search index warmed up in {time.perf_counter() - started:.2f}s")
+
+    async def answer(
+        self,
+        question: str,
+        technique: str = "hyde",
+        n_results: int | None = None,
+        hybrid: bool | None = None,
+        prefilter: int | None = None,
+        on_delta: Callable[[str], Awaitable[None]] | None = None,
+    ) -> QueryResult:
+        """
+        Answer a question with one of the retrieval techniques.
+
+        Args:
+            question (str): The user's question.
+            technique (str, optional): "raw" searches the question itself, "hyde" the
+                                       question with a hypothetical answer, "multi" the
+                                       question and LLM-generated subqueries fused with
+                                       reciprocal rank fusion. Defaults to "hyde".
+            n_results (int | None, optional): Chunks handed to the LLM. Defaults to None
+                                              (the service's setting).
+            hybrid (bool | None, optional): Fuse a BM25 ranking of every query as well.
+                                            Defaults to None (the service's setting).
+            prefilter (int | None, optional): Restrict the vector search to this many
+                                              BM25 matches per query. Defaults to None
+                                              (the service's setting).
+            on_delta (Callable[[str], Awaitable[None]] | None, optional): Awaited with
+                the text of every answer token as it arrives. Defaults to None.
+
+        Returns:
+            QueryResult: The answer, the chunks it was generated from and its timings.
+
+        Raises:
+            HttpError: 404 if the collection does not exist.
+        """
+        started = time.perf_counter()
+        n_results = n_results or self.n_results
+        hybrid = self.hybrid if hybrid is None else hybrid
+        prefilter = prefilter or self.prefilter
+
+        queries = [question]
+        if technique == "hyde":
+            hypothetical_answer = await asyncio.to_thread(
+                generate_single_query_response, question
+            )
+            queries = [f"{question}\n{hypothetical_answer}"]
+        elif technique == "multi":
+            queries += await asyncio.to_thread(generate_multi_query_response, question)
+
+        fused = await asyncio.to_thread(
+            self.db.query_fused,
+            queries,
+            self.collection_name,
+            n_results,
+            hybrid=hybrid,
+            prefilter=prefilter,
+        )
+        if fused is None:
+            raise HttpError(
+                404,
+                f'Collection "{self.collection_name}" not found, ingest a document first',
+            )
+        retrieval_ms = (time.perf_counter() - started) * 1000
+
+        context = [result["document"] for result in fused]
+        if self.packer is not None and context:
+            # packing embeds the chunks, served from the embedding cache but blocking
+            packed = await asyncio.to_thread(self.packer.pack, question, context)
+            context = packed["chunks"]
+
+        stream = astream_response_with_context(question, context)
+        async for delta in stream:
+            if on_delta is not None:
+                await on_delta(delta)
+
+        stats = stream.stats
+        ttft = stats["ttft"] if stats else None
+        return {
+            "question": question,
+            "technique": technique,
+            "queries": queries,
+            "answer": stream.text,
+            "chunks": fused,
+            "context_chunks": len(context),
+            "retrieval_ms": round(retrieval_ms, 1),
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "prompt_tokens": stats["prompt_tokens"] if stats else None,
+            "completion_tokens": stats["completion_tokens"] if stats else 0,
+        }
+
+    async def ingest(self, pdf_path: str, pdf_workers: int) -> IngestResult:
+        """
+        Ingest a PDF into the collection, one ingest at a time.
+
+        Queries keep being answered meanwhile, from the chunks stored so far.
+
+        Args:
+            pdf_path (str): The PDF on the server's filesystem, inside ``data_dir``.
+            pdf_workers (int): Processes extracting PDF page text.
+
+        Returns:
+            IngestResult: See ``ingest_document``.
+
+        Raises:
+            HttpError: 403 if the path is outside ``data_dir``, 404 if the file does not
+                       exist, 422 if its text could not be extracted completely.
+        """
+        # symlinks and ".." are resolved first, and the path is checked before its
+        # existence so requests cannot probe the rest of the filesystem
+        resolved = os.path.realpath(pdf_path)
+        if os.path.commonpath([resolved, self.data_dir]) != self.data_dir:
+            raise HttpError(403, "pdf_path must be inside the data directory")
+        if not os.path.isfile(resolved):
+            raise HttpError(404, f"No such file: {pdf_path}")
+        assert self._ingest_lock is not None
+        async with self._ingest_lock:
+            result = await asyncio.to_thread(
+                ingest_document, self.db, resolved, self.collection_name, pdf_workers
+            )
+        if result["error"] is not None:
+            raise HttpError(422, result["error"])
+        return result
+
+    def health(self) -> dict[str, Any]:
+        """
+        Describe the state and load of the service.
+
+        Returns:
+            dict[str, Any]: The status ("ok" or "draining"), uptime, running and waiting
+                            requests, request counters and completion cache counters.
+        """
+        return {
+            "status": "draining" if self.draining else "ok",
+            "backend": type(self.db).__name__,
+            "collection": self.collection_name,
+            "uptime_seconds": round(time.monotonic() - self._started, 1),
+            "running": self._running,
+            "waiting": self._waiting,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            **self.stats,
+            "completion_cache": completion_cache.stats(),
+        }
+
+    def metrics(self) -> str:
+        """
+        Render the traced stage metrics and the service's load in the Prometheus format.
+
+        Returns:
+            str: The metrics text.
+        """
+        lines = [
+            "# HELP rag_server_running Requests being processed.",
+            "# TYPE rag_server_running gauge",
+            f"rag_server_running {self._running}",
+            "# HELP rag_server_waiting Requests waiting for a worker.",
+            "# TYPE rag_server_waiting gauge",
+            f"rag_server_waiting {self._waiting}",
+            "# HELP rag_server_rejected_total Requests rejected by the admission limits.",
+            "# TYPE rag_server_rejected_total counter",
+            f"rag_server_rejected_total {self.stats['rejected']}",
+        ]
+        spans = tracer.metrics.render() if tracer.metrics is not None else ""
+        return spans + "\n".join(lines) + "\n"
+
+    @contextlib.asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """
+        Hold a worker slot for the duration of the block, waiting in the bounded queue.
+
+        Raises:
+            HttpError: 503 when shutting down, the queue is full or the wait timed out.
+        """
+        assert self._slots is not None
+        if self.draining:
+            raise HttpError(503, "Shutting down")
+        if self._slots.locked() and self._waiting >= self.queue_size:
+            self.stats["rejected"] += 1
+            raise HttpError(503, "Too many requests", {"Retry-After": "1"})
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except TimeoutError:
+            self.stats["rejected"] += 1
+            raise HttpError(
+                503, "Timed out waiting for a worker", {"Retry-After": "1"}
+            ) from None
+        finally:
+            self._waiting -= 1
+
+        self._running += 1
+        try:
+            yield
+        finally:
+            self._running -= 1
+            self._slots.release()
+
+    async def __handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # serve the requests of one (keep-alive) connection in order
+        task = asyncio.current_task()
+        assert task is not None
+        self._connections[writer] = task
+        try:
+            while not self.draining:
+                try:
+                    request = await asyncio.wait_for(
+                        self.__read_request(reader), KEEP_ALIVE_TIMEOUT
+                    )
+                except HttpError as e:
+                    await self.__send_json(
+                        writer, e.status, {"error": e.message}, keep_alive=False
+                    )
+                    break
+                if request is None:
+                    break
+
+                keep_alive = request["headers"].get("connection", "").lower() != "close"
+                self._busy.add(writer)
+                try:
+                    await self.__dispatch(request, writer, keep_alive)
+                finally:
+                    self._busy.discard(writer)
+                if not keep_alive:
+                    break
+        except (TimeoutError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # idle timeouts, disconnects, truncated requests and oversized header lines
+            pass
+        finally:
+            del self._connections[writer]
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def __read_request(self, reader: asyncio.StreamReader) -> HttpRequest | None:
+        # parse a request line, headers and a content-length body; None at the end
+        try:
+            line = await reader.readline()
+        except ValueError:
+            raise HttpError(414, "Request line too long") from None
+        if not line.strip():
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split()
+        except ValueError:
+            raise HttpError(400, "Malformed request line") from None
+
+        headers: dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", ""):
+            raise HttpError(411, "Chunked request bodies are not supported")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length") from None
+        if length > MAX_BODY_BYTES:
+            raise HttpError(
+                413, f"Request bodies are limited to {MAX_BODY_BYTES} bytes"
+            )
+        body = await reader.readexactly(length) if length else b""
+        return {
+            "method": method.upper(),
+            "path": target.split("?")[0].rstrip("/") or "/",
+            "headers": headers,
+            "body": body,
+        }
+
+    async def __dispatch(
+        self, request: HttpRequest, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> None:
+        # route a request and answer it, errors included
+        routes = {
+            "/query": ("POST", self.__query),
+            "/ingest": ("POST", self.__ingest),
+            "/health": ("GET", self.__health),
+            "/metrics": ("GET", self.__metrics),
+        }
+        started = time.perf_counter()
+        status = 500
+        try:
+            if request["path"] not in routes:
+                raise HttpError(404, f"Unknown path {request['path']}")
+            method, handler = routes[request["path"]]
+            if request["method"] != method:
+                raise HttpError(405, f"{request['path']} only accepts {method}")
+            status = await handler(request, writer, keep_alive)
+        except HttpError as e:
+            status = e.status
+            await self.__send_json(
+                writer, e.status, {"error": e.message}, e.headers, keep_alive
+            )
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"❌ {request['method']} {request['path']} failed: {e}")
+            await self.__send_json(writer, 500, {"error": str(e)}, {}, keep_alive)
+        finally:
+            if request["path"] in ("/query", "/ingest"):
+                self.stats["requests"] += 1
+                print(
+                    f"{request['method']} {request['path']} {status} "
+                    f"{(time.perf_counter() - started) * 1000:.0f}ms",
+                    flush=True,
+                )
+
+    async def __query(
+        self, request: HttpRequest, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> int:
+        body = _parse_json(request["body"])
+        question = body.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise HttpError(400, 'A non-empty "question" string is required')
+        technique = body.get("technique", "hyde")
+        if technique not in TECHNIQUES:
+            raise HttpError(400, f'"technique" must be one of {", ".join(TECHNIQUES)}')
+        options = {
+            "n_results": _optional_int(body, "n_results", 1),
+            "prefilter": _optional_int(body, "prefilter", 1),
+            "hybrid": body.get("hybrid"),
+        }
+        if options["hybrid"] is not None and not isinstance(options["hybrid"], bool):
+            raise HttpError(400, '"hybrid" must be a boolean')
+
+        async with self.admit():
+            with tracer.span("http.query", technique=technique) as span:
+                if not body.get("stream"):
+                    result = await self.answer(question, technique, **options)
+                    span.set(status=200)
+                    await self.__send_json(writer, 200, result, {}, keep_alive)
+                    return 200
+
+                # the status is sent before the answer exists, errors become an event
+                await self.__send_head(
+                    writer,
+                    200,
+                    {
+                        "Content-Type": "application/x-ndjson",
+                        "Transfer-Encoding": "chunked",
+                    },
+                    keep_alive,
+                )
+
+                async def send_delta(text: str) -> None:
+                    await _send_chunk(writer, {"event": "delta", "text": text})
+
+                try:
+                    result = await self.answer(
+                        question, technique, on_delta=send_delta, **options
+                    )
+                    await _send_chunk(writer, {"event": "done", **result})
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    message = e.message if isinstance(e, HttpError) else str(e)
+                    print(f"❌ Streamed query failed: {message}")
+                    await _send_chunk(writer, {"event": "error", "error": message})
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+                span.set(status=200)
+                return 200
+
+    async def __ingest(
+        self, request: HttpRequest, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> int:
+        body = _parse_json(request["body"])
+        pdf_path = body.get("pdf_path", self.pdf_path)
+        if not isinstance(pdf_path, str):
+            raise HttpError(400, '"pdf_path" must be a string')
+        pdf_workers = _optional_int(body, "pdf_workers", 1) or self.pdf_workers
+
+        async with self.admit():
+            started = time.perf_counter()
+            result = await self.ingest(pdf_path, pdf_workers)
+        await self.__send_json(
+            writer,
+            200,
+            {
+                "pdf_path": pdf_path,
+                **result,
+                "seconds": round(time.perf_counter() - started, 2),
+            },
+            {},
+            keep_alive,
+        )
+        return 200
+
+    async def __health(
+        self, request: HttpRequest, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> int:
+        status = 503 if self.draining else 200
+        await self.__send_json(writer, status, self.health(), {}, keep_alive)
+        return status
+
+    async def __metrics(
+        self, request: HttpRequest, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> int:
+        body = self.metrics().encode("utf-8")
+        await self.__send_head(
+            writer,
+            200,
+            {
+                "Content-Type": "text/plain; version=0.0.4",
+                "Content-Length": str(len(body)),
+            },
+            keep_alive,
+        )
+        writer.write(body)
+        await writer.drain()
+        return 200
+
+    async def __send_json(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: Any,
+        headers: dict[str, str] | None = None,
+        keep_alive: bool = True,
+    ) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        await self.__send_head(
+            writer,
+            status,
+            {
+                "Content-Type": "application/json",
+                "Content-Length": str(len(body)),
+                **(headers or {}),
+            },
+            keep_alive,
+        )
+        writer.write(body)
+        await writer.drain()
+
+    async def __send_head(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        headers: dict[str, str],
+        keep_alive: bool,
+    ) -> None:
+        # connections are closed after the response once shutting down
+        keep_alive = keep_alive and not self.draining
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+
+def _parse_json(body: bytes) -> dict[str, Any]:
+    # the JSON object of a request body, an empty body counts as {}
+    if not body:
+        return {}
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise HttpError(400, f"Invalid JSON: {e}") from None
+    if not isinstance(payload, dict):
+        raise HttpError(400, "The request body must be a JSON object")
+    return payload
+
+
+def _optional_int(body: dict[str, Any], name: str, minimum: int) -> int | None:
+    # an optional integer field of a request body, validated against a minimum
+    value = body.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+        raise HttpError(400, f'"{name}" must be an integer of at least {minimum}')
+    return value
+
+
+async def _send_chunk(writer: asyncio.StreamWriter, event: dict[str, Any]) -> None:
+    # write one NDJSON line as a chunk of a chunked response
+    data = (json.dumps(event) + "\n").encode("utf-8")
+    writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+    await writer.drain()
+
+
+async def run(args: argparse.Namespace) -> None:
+    """
+    Open the vector store, ingest the report unless disabled, and serve.
+
+    Args:
+        args (argparse.Namespace): The command line settings.
+    """
+    db = create_db(args)
+    service = RagService(
+        db,
+        packer=create_packer(args, db),
+        n_results=args.n_results,
+        hybrid=args.hybrid,
+        prefilter=args.prefilter,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        queue_timeout=args.queue_timeout,
+        pdf_workers=args.pdf_workers,
+        data_dir=args.data_dir,
+    )
+    if not args.no_ingest:
+        await asyncio.to_thread(
+            ingest_document, db, PDF_PATH, COLLECTION_NAME, args.pdf_workers
+        )
+    await service.warm_up()
+    await service.serve(args.host, args.port, args.grace_period)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Advanced RAG query service")
+    parser.add_argument("--host", default=os.getenv("RAG_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("RAG_PORT", 8000)))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="queries and ingests processed at once (default: 4)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=32,
+        help="requests waiting for a worker before new ones get 503 (default: 32)",
+    )
+    parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        default=30.0,
+        help="seconds a request waits for a worker before it gets 503 (default: 30)",
+    )
+    parser.add_argument(
+        "--grace-period",
+        type=float,
+        default=30.0,
+        help="seconds running requests get to finish on shutdown (default: 30)",
+    )
+    parser.add_argument(
+        "--pdf-workers",
+        type=int,
+        default=1,
+        help="number of processes extracting PDF page text (default: 1)",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=DATA_DIR,
+        help="the only directory /ingest reads PDFs from (default: data)",
+    )
+    parser.add_argument(
+        "--no-ingest",
+        action="store_true",
+        help="serve the collection as stored instead of ingesting the report at startup",
+    )
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+    # /metrics is served by the service itself, a --metrics-port adds a second endpoint
+    tracer.configure_from_env(
+        trace_file=args.trace_file, metrics_port=args.metrics_port, collect_metrics=True
+    )
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
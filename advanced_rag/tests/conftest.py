@@ -0,0 +1,8 @@
+import os
+
+
+# the tokenizer files vendored for the benchmarks, so the tests run without network
+os.environ.setdefault(
+    "TIKTOKEN_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "..", "tools", "tiktoken_cache"),
+)
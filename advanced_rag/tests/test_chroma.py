@@ -0,0 +1,64 @@
+from chroma import RRF_K, ChromaDb, RankedChunk, fuse_rankings
+import pytest
+
+
+def ranking(*chunk_ids: str) -> list[RankedChunk]:
+    return [
+        {"chunk_id": chunk_id, "document": f"text of {chunk_id}"}
+        for chunk_id in chunk_ids
+    ]
+
+
+def test_fuse_rankings_sums_reciprocal_ranks():
+    fused = fuse_rankings([ranking("a", "b", "c"), ranking("c", "b", "d")], n_results=4)
+
+    # b and c are found by both rankings, c once at the very top
+    assert [result["chunk_id"] for result in fused] == ["c", "b", "a", "d"]
+    scores = {result["chunk_id"]: result["score"] for result in fused}
+    assert scores["c"] == pytest.approx(1 / (RRF_K + 3) + 1 / (RRF_K + 1))
+    assert scores["b"] == pytest.approx(2 / (RRF_K + 2))
+    assert scores["a"] == pytest.approx(1 / (RRF_K + 1))
+    assert scores["d"] == pytest.approx(1 / (RRF_K + 3))
+    assert fused[0]["document"] == "text of c"
+
+
+def test_fuse_rankings_keeps_first_seen_order_on_ties():
+    fused = fuse_rankings([ranking("a", "b"), ranking("c", "d")], n_results=4)
+    assert [result["chunk_id"] for result in fused] == ["a", "c", "b", "d"]
+
+
+def test_fuse_rankings_returns_the_top_n():
+    fused = fuse_rankings([ranking("a", "b", "c"), ranking("b")], n_results=2)
+    assert [result["chunk_id"] for result in fused] == ["b", "a"]
+    assert fuse_rankings([], n_results=3) == []
+
+
+@pytest.fixture
+def fresh_singleton(tmp_path, monkeypatch):
+    # every test starts without an instance, and the previous one is restored after
+    monkeypatch.setattr(ChromaDb, "_instance", None)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite"))
+
+
+@pytest.fixture
+def chroma_db(fresh_singleton, tmp_path) -> ChromaDb:
+    return ChromaDb(storage_path=str(tmp_path / "chroma"), dimensions=256)
+
+
+def test_singleton_returns_the_instance_for_the_same_settings(chroma_db, tmp_path):
+    assert ChromaDb(storage_path=str(tmp_path / "chroma"), dimensions=256) is chroma_db
+
+
+def test_singleton_rejects_other_settings(chroma_db, tmp_path):
+    with pytest.raises(ValueError, match="dimensions"):
+        ChromaDb(storage_path=str(tmp_path / "chroma"))
+    with pytest.raises(ValueError, match="storage_path"):
+        ChromaDb(storage_path=str(tmp_path / "other"), dimensions=256)
+    assert chroma_db.dimensions == 256
+
+
+def test_singleton_treats_the_default_dimensions_as_1536(fresh_singleton, tmp_path):
+    db = ChromaDb(storage_path=str(tmp_path / "chroma"))
+
+    assert ChromaDb(storage_path=str(tmp_path / "chroma"), dimensions=1536) is db
@@ -0,0 +1,218 @@
+from completion_cache import CompletionCache
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice as CompletionChoice
+from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+from openai.types.completion_usage import CompletionUsage
+from types import SimpleNamespace
+import completion_cache
+import pytest
+
+
+PARAMS = {
+    "model": "gpt-4.1-nano",
+    "messages": [{"role": "user", "content": "Summarize the report"}],
+}
+
+
+def make_chunk(content: str | None, finish_reason: str | None) -> ChatCompletionChunk:
+    return ChatCompletionChunk(
+        id="chunk",
+        created=0,
+        model=PARAMS["model"],
+        object="chat.completion.chunk",
+        choices=[
+            Choice(
+                index=0,
+                delta=ChoiceDelta(content=content),
+                finish_reason=finish_reason,
+            )
+        ],
+    )
+
+
+def make_completion(content: str) -> ChatCompletion:
+    return ChatCompletion(
+        id="completion",
+        created=0,
+        model=PARAMS["model"],
+        object="chat.completion",
+        choices=[
+            CompletionChoice(
+                index=0,
+                finish_reason="stop",
+                message=ChatCompletionMessage(role="assistant", content=content),
+            )
+        ],
+        usage=CompletionUsage(prompt_tokens=5, completion_tokens=2, total_tokens=7),
+    )
+
+
+def make_client(chunks: list[ChatCompletionChunk]) -> SimpleNamespace:
+    # just enough of an OpenAI client to stream the given chunks, or to return a
+    # completion when the request does not stream
+    def create(**params):
+        client.calls.append(params)
+        if params.get("stream"):
+            return iter(chunks)
+        return make_completion(
+            "".join(
+                chunk.choices[0].delta.content or ""
+                for chunk in chunks
+                if chunk.choices
+            )
+        )
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create)), calls=[]
+    )
+    return client
+
+
+@pytest.fixture
+def clock(monkeypatch) -> SimpleNamespace:
+    # a controllable time.time, so expiry and recency do not depend on the wall clock
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(completion_cache.time, "time", lambda: clock.now)
+    return clock
+
+
+def test_stream_stores_the_reported_finish_reason(tmp_path):
+    cache = CompletionCache(path=str(tmp_path / "completions.sqlite"))
+    usage_chunk = make_chunk(None, None).model_copy(
+        update={
+            "choices": [],
+            "usage": CompletionUsage(
+                prompt_tokens=5, completion_tokens=2, total_tokens=7
+            ),
+        }
+    )
+    client = make_client(
+        [make_chunk("Revenue ", None), make_chunk("grew", "length"), usage_chunk]
+    )
+
+    stream = cache.stream(client, **PARAMS)
+    assert "".join(stream) == "Revenue grew"
+    assert stream.finish_reason == "length"
+
+    cached = cache.get(PARAMS)
+    assert cached is not None
+    assert cached.choices[0].finish_reason == "length"
+    assert cached.choices[0].message.content == "Revenue grew"
+
+    # the replayed stream reports the stored reason as well
+    replayed = cache.stream(client, **PARAMS)
+    assert "".join(replayed) == "Revenue grew"
+    assert replayed.attributes.get("cached")
+    assert replayed.finish_reason == "length"
+
+
+def test_hits_and_misses_are_counted_with_the_saved_tokens(tmp_path):
+    cache = CompletionCache(path=str(tmp_path / "completions.sqlite"))
+    client = make_client([make_chunk("Revenue grew", "stop")])
+
+    first = cache.create(client, **PARAMS)
+    second = cache.create(client, **PARAMS)
+
+    assert len(client.calls) == 1
+    assert second.choices[0].message.content == first.choices[0].message.content
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["saved_prompt_tokens"] == 5
+    assert stats["saved_completion_tokens"] == 2
+    assert stats["entries"] == 1
+    assert stats["bytes"] > 0
+
+
+def test_key_is_canonical_and_ignores_transport_params():
+    reordered = {"messages": PARAMS["messages"], "model": PARAMS["model"]}
+    assert CompletionCache.key(reordered) == CompletionCache.key(PARAMS)
+    assert CompletionCache.key(
+        {**PARAMS, "stream": True, "stream_options": {"include_usage": True}}
+    ) == CompletionCache.key(PARAMS)
+    assert CompletionCache.key({**PARAMS, "timeout": 30}) == CompletionCache.key(PARAMS)
+    # unset parameters count the same as missing ones
+    assert CompletionCache.key({**PARAMS, "temperature": None}) == CompletionCache.key(
+        PARAMS
+    )
+
+    # anything that changes the response changes the key
+    assert CompletionCache.key({**PARAMS, "temperature": 0}) != CompletionCache.key(
+        PARAMS
+    )
+    assert CompletionCache.key(
+        {**PARAMS, "model": "gpt-4.1-mini"}
+    ) != CompletionCache.key(PARAMS)
+
+
+def test_streamed_and_blocking_requests_share_an_entry(tmp_path):
+    cache = CompletionCache(path=str(tmp_path / "completions.sqlite"))
+    client = make_client([make_chunk("Revenue grew", "stop")])
+
+    assert "".join(cache.stream(client, **PARAMS)) == "Revenue grew"
+    completion = cache.create(client, **PARAMS)
+
+    assert len(client.calls) == 1
+    assert completion.choices[0].message.content == "Revenue grew"
+    assert cache.stats()["hits"] == 1
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = CompletionCache(path=str(tmp_path / "completions.sqlite"), ttl=60)
+    client = make_client([make_chunk("Revenue grew", "stop")])
+
+    cache.create(client, **PARAMS)
+    clock.now += 59
+    cache.create(client, **PARAMS)
+    assert len(client.calls) == 1
+
+    clock.now += 2
+    assert cache.get(PARAMS) is None
+    assert cache.stats()["entries"] == 0
+    cache.create(client, **PARAMS)
+    assert len(client.calls) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    questions = ["first", "second", "third"]
+    requests = [
+        {**PARAMS, "messages": [{"role": "user", "content": question}]}
+        for question in questions
+    ]
+    completion = make_completion("Revenue grew")
+    size = len(completion.model_dump_json(exclude_unset=True))
+    # room for two responses, not three
+    cache = CompletionCache(
+        path=str(tmp_path / "completions.sqlite"), max_bytes=2 * size
+    )
+
+    for params in requests[:2]:
+        cache.put(params, completion)
+        clock.now += 1
+    # reading the first entry makes the second the least recently used one
+    assert cache.get(requests[0]) is not None
+    clock.now += 1
+    cache.put(requests[2], completion)
+
+    assert cache.get(requests[1]) is None
+    assert cache.get(requests[0]) is not None
+    assert cache.get(requests[2]) is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] <= 2 * size
+
+
+def test_use_cache_false_neither_reads_nor_writes(tmp_path):
+    cache = CompletionCache(path=str(tmp_path / "completions.sqlite"))
+    client = make_client([make_chunk("Revenue grew", "stop")])
+
+    cache.create(client, **PARAMS)
+    cache.create(client, use_cache=False, **PARAMS)
+    assert len(client.calls) == 2
+
+    uncached = {**PARAMS, "temperature": 0}
+    cache.create(client, use_cache=False, **uncached)
+    assert "".join(cache.stream(client, use_cache=False, **uncached)) == "Revenue grew"
+    assert len(client.calls) == 4
+    assert cache.get(uncached) is None
+    assert cache.stats()["entries"] == 1
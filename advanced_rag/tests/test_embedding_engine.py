@@ -0,0 +1,111 @@
+from openai import RateLimitError
+from rag_common.embedding_engine import EmbeddingEngine, TokenBucket
+import asyncio
+import importlib.util
+import os
+import pytest
+import random
+import threading
+import time
+
+
+STUB_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "tools", "openai_stub.py"
+)
+DIMENSIONS = 64
+
+
+def load_stub():
+    spec = importlib.util.spec_from_file_location("openai_stub", STUB_PATH)
+    assert spec is not None and spec.loader is not None
+    stub = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(stub)
+    return stub
+
+
+stub = load_stub()
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    servers = []
+
+    def start(**options):
+        server = stub.make_server(port=0, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        host, port = server.server_address[:2]
+        monkeypatch.setenv("OPENAI_BASE_URL", f"http://{host}:{port}/v1")
+        return server.RequestHandlerClass.state
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_engine(**options) -> EmbeddingEngine:
+    # the stub asks for 0.1s in Retry-After, capped here to keep the tests fast
+    return EmbeddingEngine(
+        dimensions=DIMENSIONS,
+        api_key="test",
+        base_delay=0.01,
+        max_delay=0.02,
+        **options,
+    )
+
+
+def test_rate_limited_requests_are_retried(serve):
+    random.seed(0)
+    state = serve(rate_limit_ratio=0.4)
+    engine = make_engine(max_retries=20)
+    batches = [[f"chunk {b}.{i}" for i in range(5)] for b in range(16)]
+
+    results = engine.embed_many(batches)
+
+    assert [len(batch) for batch in results] == [5] * 16
+    for batch, embeddings in zip(batches, results):
+        assert embeddings == [stub.stub_embedding(text, DIMENSIONS) for text in batch]
+    stats = engine.stats()
+    assert stats["rate_limited"] == state.counters["rate_limited"] > 0
+    # every 429 was retried, and every batch fit in one successful request
+    assert stats["retries"] == stats["rate_limited"]
+    assert stats["requests"] == state.counters["requests"] == 16 + stats["retries"]
+
+
+def test_gives_up_after_max_retries(serve):
+    state = serve(rate_limit_ratio=1.0)
+    engine = make_engine(max_retries=2)
+
+    with pytest.raises(RateLimitError):
+        engine.embed(["never embedded"])
+
+    assert engine.stats() == {"requests": 3, "retries": 2, "rate_limited": 3}
+    assert state.counters["requests"] == 3
+
+
+def test_token_bucket_waits_for_the_refill():
+    async def drain_and_acquire() -> float:
+        # a full bucket of 6000 per minute refills 100 per second
+        bucket = TokenBucket(6000)
+        await bucket.acquire(6000)
+        started = time.monotonic()
+        await bucket.acquire(30)
+        return time.monotonic() - started
+
+    assert 0.25 <= asyncio.run(drain_and_acquire()) < 1.0
+
+
+def test_oversized_request_waits_for_a_full_bucket_and_leaves_a_debt():
+    async def acquire_twice() -> tuple[float, float]:
+        bucket = TokenBucket(60_000)
+        started = time.monotonic()
+        await bucket.acquire(60_500)
+        first = time.monotonic() - started
+        await bucket.acquire(10)
+        return first, time.monotonic() - started - first
+
+    first, second = asyncio.run(acquire_twice())
+    assert first < 0.1
+    # the 500 over capacity are paid back at 1000 per second
+    assert second >= 0.45
@@ -0,0 +1,58 @@
+from numpy_db import NumpyDb
+import os
+import pytest
+import shutil
+
+
+PDF_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "data", "microsoft-annual-report.pdf"
+)
+COLLECTION = "test-collection"
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    # the caches default to the working directory, and response.py opens the completion
+    # cache when it is imported
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite"))
+    monkeypatch.setenv("COMPLETION_CACHE_PATH", str(tmp_path / "completions.sqlite"))
+    import main
+
+    return main
+
+
+def make_db(storage_path: str) -> NumpyDb:
+    db = NumpyDb(storage_path=storage_path, dimensions=8)
+    # the chunk counts are checked, not the search, so every chunk gets one vector
+    db.ef = lambda input: [[1.0] + [0.0] * 7 for _ in input]
+    return db
+
+
+def test_failed_extraction_keeps_the_stored_version(main, tmp_path):
+    pdf_path = str(tmp_path / "report.pdf")
+    shutil.copy(PDF_PATH, pdf_path)
+    db = make_db(str(tmp_path / "numpy_db"))
+
+    result = main.ingest_document(db, pdf_path, COLLECTION)
+    assert result["error"] is None
+    assert result["added"] == result["chunks"] > 0
+    metadata = db.get_collection_metadata(COLLECTION)
+
+    # a truncated copy cannot be parsed
+    with open(PDF_PATH, "rb") as f:
+        data = f.read()
+    with open(pdf_path, "wb") as f:
+        f.write(data[: len(data) // 2])
+
+    result = main.ingest_document(db, pdf_path, COLLECTION)
+    assert result["error"] is not None
+    assert result["deleted"] == 0
+    assert db.get_collection_metadata(COLLECTION) == metadata
+    assert len(db.query_documents("revenue", COLLECTION, n_results=1000)) > 0
+
+    # the next run tries again instead of finding the version unchanged
+    result = main.ingest_document(db, pdf_path, COLLECTION)
+    assert not result["unchanged"]
+    assert result["error"] is not None
@@ -0,0 +1,152 @@
+from rag_common.lexical_index import LexicalIndex, tokenize
+import json
+import math
+import pytest
+
+
+CHUNKS = {
+    "revenue": "Microsoft Cloud revenue grew to 111.6 billion, revenue up 22 percent",
+    "azure": "Azure and other cloud services revenue grew 29 percent",
+    "gaming": "Gaming revenue increased with Xbox content and services",
+    "search": "Search and news advertising revenue grew 3 percent",
+    "linkedin": "LinkedIn revenue increased 10 percent",
+    "dividend": "The board declared a quarterly dividend and share buyback",
+}
+QUESTIONS = [
+    "How did cloud revenue grow?",
+    "Xbox gaming services",
+    "dividend and buyback",
+    "revenue percent",
+]
+
+
+def bm25_scores(
+    chunks: dict[str, str], query: str, k1: float = 1.2, b: float = 0.75
+) -> dict[str, float]:
+    # the textbook formula, term by term, to check the vectorized one against
+    terms = {chunk_id: tokenize(text) for chunk_id, text in chunks.items()}
+    average = sum(len(t) for t in terms.values()) / len(terms)
+    scores = {}
+    for chunk_id, chunk_terms in terms.items():
+        score = 0.0
+        for term in dict.fromkeys(tokenize(query)):
+            df = sum(term in t for t in terms.values())
+            tf = chunk_terms.count(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(terms) - df + 0.5) / (df + 0.5))
+            norm = k1 * (1 - b + b * len(chunk_terms) / average)
+            score += idf * tf * (k1 + 1) / (tf + norm)
+        if score:
+            scores[chunk_id] = score
+    return scores
+
+
+def make_index(chunks: dict[str, str], path: str | None = None) -> LexicalIndex:
+    index = LexicalIndex(path)
+    index.add(list(chunks), list(chunks.values()))
+    return index
+
+
+def assert_ranks_like_bm25(index: LexicalIndex, chunks: dict[str, str], query: str):
+    results = index.search(query, k=len(chunks))
+    assert dict(results) == pytest.approx(bm25_scores(chunks, query), rel=1e-5)
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_tokenize_drops_stopwords_and_keeps_figures():
+    assert tokenize("What was the FY23 revenue of Slack?") == [
+        "fy23",
+        "revenue",
+        "slack",
+    ]
+
+
+@pytest.mark.parametrize("query", QUESTIONS)
+def test_search_matches_bm25(query):
+    assert_ranks_like_bm25(make_index(CHUNKS), CHUNKS, query)
+
+
+def test_search_returns_the_top_k_and_skips_unmatched_chunks():
+    index = make_index(CHUNKS)
+
+    assert [chunk_id for chunk_id, _ in index.search("dividend", k=5)] == ["dividend"]
+    assert len(index.search("revenue percent", k=2)) == 2
+    assert index.search("unknown words only", k=5) == []
+    assert index.search("revenue", k=0) == []
+
+
+def test_deleted_and_replaced_chunks_are_scored_as_if_never_added():
+    index = make_index(CHUNKS)
+
+    assert index.delete(["gaming", "missing"]) == 1
+    assert index.delete(["gaming"]) == 0
+    index.add(["azure"], ["Azure consumption revenue grew"])
+    assert len(index) == len(CHUNKS) - 1
+
+    remaining = {
+        **{k: v for k, v in CHUNKS.items() if k != "gaming"},
+        "azure": "Azure consumption revenue grew",
+    }
+    for query in QUESTIONS:
+        assert_ranks_like_bm25(index, remaining, query)
+    assert "gaming" not in dict(index.search("Xbox gaming", k=10))
+
+
+def test_compaction_drops_deleted_chunks_and_unused_terms():
+    index = make_index(CHUNKS)
+    index.delete(["gaming", "linkedin"])
+    remaining = {k: v for k, v in CHUNKS.items() if k not in ("gaming", "linkedin")}
+    fresh = make_index(remaining)
+
+    # the rebuilt arrays hold exactly what an index of the remaining chunks holds
+    assert index.nbytes == fresh.nbytes
+    assert set(index._terms) == set(fresh._terms)
+    assert "xbox" not in index._terms
+    assert index._ids == list(remaining)
+
+
+def test_batched_adds_match_a_single_add():
+    batched = LexicalIndex()
+    ids = list(CHUNKS)
+    batched.add(ids[:2], [CHUNKS[i] for i in ids[:2]])
+    batched.add(ids[2:], [CHUNKS[i] for i in ids[2:]])
+    single = make_index(CHUNKS)
+
+    for query in QUESTIONS:
+        assert batched.search(query, k=10) == single.search(query, k=10)
+
+
+def test_index_round_trips_through_npz_and_json(tmp_path):
+    path = str(tmp_path / "index" / "docs.lexical")
+    index = make_index(CHUNKS, path)
+    index.delete(["search"])
+    index.save()
+
+    reopened = LexicalIndex(path)
+    assert len(reopened) == len(CHUNKS) - 1
+    for query in QUESTIONS:
+        assert reopened.search(query, k=10) == index.search(query, k=10)
+
+    # a reopened index keeps taking writes
+    reopened.add(["search"], [CHUNKS["search"]])
+    assert_ranks_like_bm25(reopened, CHUNKS, "news advertising")
+
+
+def test_mismatched_files_open_empty(tmp_path):
+    path = str(tmp_path / "docs.lexical")
+    make_index(CHUNKS, path).save()
+    with open(f"{path}.json", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    # as if the process died between writing the arrays and the sidecar
+    sidecar["ids"].append("orphan")
+    with open(f"{path}.json", "w", encoding="utf-8") as f:
+        json.dump(sidecar, f)
+
+    assert len(LexicalIndex(path)) == 0
+
+
+def test_in_memory_index_cannot_be_saved():
+    with pytest.raises(ValueError):
+        make_index(CHUNKS).save()
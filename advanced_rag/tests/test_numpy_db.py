@@ -0,0 +1,123 @@
+from numpy_db import NumpyDb
+from rag_common.vector_index import VectorIndex
+import json
+import numpy as np
+import os
+import pytest
+import random
+import re
+import zlib
+
+
+DIMENSIONS = 64
+COLLECTION = "test-collection"
+WORDS = (
+    "revenue azure cloud growth cost margin office gaming search devices "
+    "security ai license server dividend share buyback research tax cash"
+).split()
+QUESTIONS = [
+    "How did Azure cloud revenue grow?",
+    "What was spent on research and security?",
+    "dividend and share buyback",
+    "gaming devices margin",
+]
+
+
+class HashingEmbeddingFunction:
+    """
+    Deterministic bag-of-words embeddings, standing in for the OpenAI embedding function.
+    """
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        embeddings = []
+        for text in input:
+            vector = np.zeros(DIMENSIONS, dtype=np.float32)
+            for word in re.findall(r"[a-z0-9]+", text.lower()):
+                vector[zlib.crc32(word.encode()) % DIMENSIONS] += 1.0
+            embeddings.append(vector.tolist())
+        return embeddings
+
+
+def make_db(storage_path: str) -> NumpyDb:
+    db = NumpyDb(storage_path=storage_path, dimensions=DIMENSIONS)
+    db.ef = HashingEmbeddingFunction()
+    return db
+
+
+def brute_force_scores(chunks: list[str], question: str) -> np.ndarray:
+    ef = HashingEmbeddingFunction()
+    matrix = VectorIndex.normalize(ef(chunks))
+    query = VectorIndex.normalize(ef([question]))[0]
+    return matrix @ query
+
+
+@pytest.fixture
+def corpus() -> tuple[list[str], list[str]]:
+    rng = random.Random(0)
+    chunks = [" ".join(rng.choices(WORDS, k=rng.randint(4, 12))) for _ in range(200)]
+    # distinct documents, so the deduplicated results line up with the chunk ids
+    chunks = list(dict.fromkeys(chunks))
+    return [f"doc:{i}" for i in range(len(chunks))], chunks
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch, corpus) -> NumpyDb:
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite"))
+    db = make_db(str(tmp_path / "numpy_db"))
+    db.create_collection(COLLECTION)
+    chunk_ids, chunks = corpus
+    assert db.add_chunks(chunk_ids, chunks, COLLECTION) == len(chunks)
+    return db
+
+
+@pytest.mark.parametrize("question", QUESTIONS)
+@pytest.mark.parametrize("n_results", [1, 5, 20])
+def test_query_documents_matches_brute_force(db, corpus, question, n_results):
+    chunk_ids, chunks = corpus
+    scores = brute_force_scores(chunks, question)
+    expected = np.sort(scores)[::-1][:n_results]
+
+    documents = db.query_documents(question, COLLECTION, n_results=n_results)
+    assert len(documents) == n_results
+    # ties may be ordered either way, so the scores are compared instead of the ids
+    got = np.array([scores[chunks.index(document)] for document in documents])
+    np.testing.assert_allclose(got, expected, atol=1e-6)
+
+    results = db.query_documents(
+        question, COLLECTION, n_results=n_results, include=["documents", "distances"]
+    )
+    assert results["documents"][0] == documents
+    assert results["ids"][0] == [chunk_ids[chunks.index(d)] for d in documents]
+    # squared euclidean distances between unit vectors, like chroma's "l2" space
+    np.testing.assert_allclose(results["distances"][0], 2 - 2 * expected, atol=1e-5)
+
+
+def test_collection_round_trips_through_memory_mapped_files(db, corpus):
+    chunk_ids, chunks = corpus
+    path = os.path.join(db.storage_path, COLLECTION)
+
+    matrix = np.load(f"{path}.npy", mmap_mode="r")
+    assert isinstance(matrix, np.memmap)
+    assert matrix.dtype == np.float32
+    np.testing.assert_allclose(
+        matrix, VectorIndex.normalize(HashingEmbeddingFunction()(chunks)), atol=1e-6
+    )
+
+    with open(f"{path}.json", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    assert sidecar["ids"] == chunk_ids
+    assert [record["document"] for record in sidecar["records"]] == chunks
+
+    reopened = make_db(db.storage_path)
+    assert reopened.get_collection_metadata(COLLECTION) == db.get_collection_metadata(
+        COLLECTION
+    )
+    for question in QUESTIONS:
+        assert reopened.query_documents(
+            question, COLLECTION, n_results=5
+        ) == db.query_documents(question, COLLECTION, n_results=5)
+
+
+def test_missing_collection_returns_none(db):
+    assert db.query_documents(QUESTIONS[0], "missing", n_results=5) is None
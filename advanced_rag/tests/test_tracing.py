@@ -0,0 +1,63 @@
+from rag_common.tracing import Tracer
+import json
+import socket
+import subprocess
+import sys
+import urllib.request
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_import_configures_no_exporter(tmp_path):
+    env = {"RAG_TRACE_FILE": str(tmp_path / "traces.jsonl"), "RAG_METRICS_PORT": "1"}
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from rag_common.tracing import tracer; print(tracer.enabled)",
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_flag_keeps_the_exporter_of_the_other_variable(tmp_path, monkeypatch):
+    trace_file = tmp_path / "traces.jsonl"
+    monkeypatch.setenv("RAG_TRACE_FILE", str(trace_file))
+    monkeypatch.delenv("RAG_METRICS_PORT", raising=False)
+    port = free_port()
+
+    tracer = Tracer()
+    tracer.configure_from_env(metrics_port=port)
+    try:
+        with tracer.span("db.query", collection="news"):
+            pass
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert 'span="db.query"' in response.read().decode()
+    finally:
+        tracer.close()
+
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [span["name"] for span in spans] == ["db.query"]
+
+
+def test_flag_overrides_its_own_variable(tmp_path, monkeypatch):
+    monkeypatch.setenv("RAG_TRACE_FILE", str(tmp_path / "ignored.jsonl"))
+    monkeypatch.delenv("RAG_METRICS_PORT", raising=False)
+
+    tracer = Tracer()
+    tracer.configure_from_env(trace_file=str(tmp_path / "flag.jsonl"))
+    with tracer.span("db.query"):
+        pass
+    tracer.close()
+
+    assert (tmp_path / "flag.jsonl").exists()
+    assert not (tmp_path / "ignored.jsonl").exists()
+    assert tracer.metrics is None
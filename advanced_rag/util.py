@@ -25,3 +25,78 @@ def word_wrap(text: str, line_width: int = 90) -> str:
             for i in range(0, len(normalized_text), line_width)
         ]
     )
+
+
+class WordWrapBuffer:
+    """
+    Incremental ``word_wrap`` for text that arrives in pieces, e.g. streamed tokens.
+
+    Pieces are normalized the way ``word_wrap`` normalizes a whole text, and every line is
+    released as soon as it is complete, so printing what ``feed`` and ``flush`` return
+    produces exactly the output of ``print(word_wrap(text, line_width))``.
+
+    Attributes:
+        line_width (int): Number of characters per line.
+
+    Example:
+        >>> buffer = WordWrapBuffer(line_width=120)
+        >>> for delta in stream:
+        ...     print(buffer.feed(delta), end="", flush=True)
+        >>> print(buffer.flush())
+    """
+
+    def __init__(self, line_width: int = 90) -> None:
+        """
+        Initialize an empty buffer.
+
+        Args:
+            line_width (int, optional): Number of characters per line. Defaults to 90.
+        """
+        self.line_width = line_width
+        self._line = ""
+        # a whitespace run seen after some text, collapsed once more text follows
+        self._pending_space = False
+
+    def feed(self, text: str) -> str:
+        """
+        Add a piece of text.
+
+        Args:
+            text (str): The next piece of the text.
+
+        Returns:
+            str: The lines completed by this piece, each followed by a newline, or an
+                 empty string.
+        """
+        # split keeps the whitespace runs at the odd positions
+        for i, piece in enumerate(re.split(r"(\s+)", text)):
+            if i % 2:
+                # leading whitespace is dropped, like word_wrap strips the text
+                self._pending_space = bool(self._line)
+                continue
+            if not piece:
+                continue
+            if self._pending_space:
+                piece = " " + piece
+                self._pending_space = False
+            self._line += piece
+
+        # a full line is only released once the next one starts, as word_wrap does not
+        # end the text with a newline
+        lines: list[str] = []
+        while len(self._line) > self.line_width:
+            lines.append(self._line[: self.line_width] + "\n")
+            self._line = self._line[self.line_width :]
+        return "".join(lines)
+
+    def flush(self) -> str:
+        """
+        Release the last, possibly partial, line and reset the buffer.
+
+        Returns:
+            str: The remaining text, without a trailing newline.
+        """
+        line = self._line
+        self._line = ""
+        self._pending_space = False
+        return line
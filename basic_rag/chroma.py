@@ -1,10 +1,93 @@
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
 import chromadb
 from chromadb.api.types import EmbeddingFunction, Embeddable
 from chromadb.api.models.Collection import Collection, QueryResult
-from typing import cast
+from chromadb.errors import NotFoundError
+from typing import Iterable, Mapping, cast
+import itertools
+import numpy as np
+import os
+import time
 from util import load_and_get_key
-from embedding import Chunk
+from corpus import CorpusStore
+from embedding import (
+    Chunk,
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_MODEL,
+    embedding_cache,
+    embedding_engine,
+)
+from rag_common.embedding_cache import CachedOpenAIEmbeddingFunction
+from rag_common.lexical_index import LexicalIndex
+from rag_common.query_cache import QueryCache
+from rag_common.tracing import tracer
+
+
+# collection metadata entry recording the dimensionality of the stored embeddings
+DIMENSIONS_KEY = "embedding_dimensions"
+
+# damping constant of reciprocal rank fusion, 60 is the value from the original paper
+RRF_K = 60
+
+
+def check_dimensions(
+    collection_name: str, metadata: dict | None, dimensions: int | None
+) -> bool:
+    """
+    Check that a collection stores embeddings of the configured dimensionality.
+
+    Collections created before the dimensionality was recorded are accepted.
+
+    Args:
+        collection_name (str): The name of the collection.
+        metadata (dict | None): The collection metadata.
+        dimensions (int | None): The dimensionality of the configured embeddings, None
+                                 if it is not known.
+
+    Returns:
+        bool: False (after printing an error) if the collection records another
+              dimensionality, True otherwise.
+    """
+    stored = (metadata or {}).get(DIMENSIONS_KEY)
+    if stored is None or dimensions is None or int(stored) == dimensions:
+        return True
+
+    print(
+        f'Error: Collection "{collection_name}" stores {stored}-dimensional embeddings, '
+        f"but {dimensions}-dimensional embeddings are configured"
+    )
+    return False
+
+
+def fuse_rankings(
+    rankings: list[list[str]], n_results: int, rrf_k: int = RRF_K
+) -> list[str]:
+    """
+    Merge several rankings of chunk IDs into one with reciprocal rank fusion.
+
+    A chunk ranked ``r`` (1-based) in a ranking gains ``1 / (rrf_k + r)``, so chunks found
+    by several rankings, or near the top of one, rise to the top. Ties keep the order in
+    which the chunks were first seen.
+
+    Args:
+        rankings (list[list[str]]): The rankings to merge, each best first.
+        n_results (int): Number of chunk IDs to return.
+        rrf_k (int, optional): Rank damping constant. Defaults to 60.
+
+    Returns:
+        list[str]: The global top ``n_results`` chunk IDs, best first.
+
+    Example:
+        >>> fuse_rankings([["a", "b"], ["b", "c"]], 2)
+        ['b', 'a']
+    """
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (rrf_k + rank)
+
+    return sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)[
+        :n_results
+    ]
 
 
 class ChromaDb:
@@ -16,8 +99,27 @@ class ChromaDb:
     for generating embeddings and supports persistent storage of vector data.
 
     Attributes:
+        storage_path: Directory where ChromaDB persists its data.
         client: ChromaDB persistent client for database operations.
-        ef: OpenAI embedding function for generating text embeddings.
+        ef: OpenAI embedding function for generating text embeddings. Embeddings are
+            served from the on-disk embedding cache whenever the text was seen before,
+            and otherwise requested through the rate limit aware embedding engine.
+        query_cache: In-process cache of query embeddings and query results. Writes
+            through ``add_chunks`` and ``delete_chunks`` invalidate the results of the
+            collection they change.
+        dimensions: Dimensionality of the embeddings (``EMBEDDING_DIMENSIONS``). It is
+            recorded in the metadata of new collections, and collections recording
+            another one are rejected, as their vectors cannot be compared with queries.
+
+    Chunk text is not stored in ChromaDB. Every collection has a corpus store next to the
+    ChromaDB data ("<collection>.corpus") holding the text of its documents, and chunks
+    are stored as (doc_name, start, end) span metadata pointing into it. The text is read
+    from the memory-mapped corpus only for the chunks a query returns.
+
+    Every collection also has a BM25 lexical index ("<collection>.lexical.npz" and
+    ".json", see ``LexicalIndex``) kept in sync by ``add_chunks`` and ``delete_chunks``.
+    Queries can fuse it with the vector search or restrict the vector search to the
+    chunks sharing terms with the question (see ``query_documents``).
     """
 
     def __init__(self, storage_path: str = "./chroma") -> None:
@@ -29,11 +131,38 @@ class ChromaDb:
                                         persistent data. Defaults to "./chroma".
         """
         # initialize the chroma client with persistent storage
+        self.storage_path = storage_path
         self.client = chromadb.PersistentClient(storage_path)
         # use openai's embedding llm instead of the default embedding llm provided by chromadb
-        self.ef = OpenAIEmbeddingFunction(
-            api_key=load_and_get_key(), model_name="text-embedding-3-small"
+        self.ef = CachedOpenAIEmbeddingFunction(
+            api_key=load_and_get_key(),
+            model_name=EMBEDDING_MODEL,
+            dimensions=EMBEDDING_DIMENSIONS,
+            cache=embedding_cache,
+            fetch=embedding_engine.embed,
         )
+        self.dimensions = embedding_engine.output_dimensions
+        self._corpora: dict[str, CorpusStore] = {}
+        self.query_cache = QueryCache()
+        # collection handles reused by queries, so hot queries skip the lookup
+        self._collections: dict[str, Collection] = {}
+        self._lexical: dict[str, LexicalIndex] = {}
+
+    def corpus(self, collection_name: str) -> CorpusStore:
+        """
+        Get the corpus store holding the document text of a collection.
+
+        Args:
+            collection_name (str): The name of the collection.
+
+        Returns:
+            CorpusStore: The collection's corpus, opened once and shared afterwards.
+        """
+        if collection_name not in self._corpora:
+            self._corpora[collection_name] = CorpusStore(
+                os.path.join(self.storage_path, f"{collection_name}.corpus")
+            )
+        return self._corpora[collection_name]
 
     def create_collection(
         self, collection_name: str, metadata: dict[str, str] | None = None
@@ -52,28 +181,59 @@ class ChromaDb:
 
         Returns:
             Collection: The ChromaDB collection object for storing and querying documents.
+
+        Raises:
+            ValueError: If an existing collection stores embeddings of another
+                        dimensionality.
         """
-        return self.client.get_or_create_collection(
+        collection = self.client.get_or_create_collection(
             name=collection_name,
             # ? the cast is to fix a type checker bug. Alternative is to comment the line with "# type: ignore"
             embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
-            metadata=metadata,
+            metadata={DIMENSIONS_KEY: self.dimensions, **(metadata or {})}
+            if self.dimensions
+            else metadata,
         )
+        if not check_dimensions(collection_name, collection.metadata, self.dimensions):
+            raise ValueError(
+                f'Collection "{collection_name}" stores embeddings of another '
+                "dimensionality, use another collection or storage path"
+            )
+        self._collections[collection_name] = collection
+        return collection
 
-    def add_chunks(self, chunks: list[Chunk], collection_name: str) -> None:
+    def add_chunks(
+        self,
+        chunks: Iterable[Chunk],
+        collection_name: str,
+        batch_size: int | None = None,
+    ) -> int:
         """
         Add document chunks with their embeddings to a ChromaDB collection.
 
-        This method takes a list of processed document chunks and stores them in the specified
-        collection. Each chunk includes its ID, content, and pre-generated embedding vector.
+        This method takes processed document chunks and stores them in the specified
+        collection. Each chunk includes its ID, its span in the collection's corpus store,
+        and pre-generated embedding vector. Only the span is stored, as chunk metadata.
+        Chunks are written in bulk: they are grouped into batches of the largest size the
+        client accepts, and every batch is upserted with a single call, with its embeddings
+        passed as one contiguous float32 matrix. Any iterable works, so chunks can be
+        streamed from a generator without materialising them all. The chunk text is also
+        added to the collection's lexical index, which is saved once, after the last batch.
 
         Args:
-            chunks (list[Chunk]): List of document chunks to store. Each chunk should contain
-                                'chunk_id', 'chunk_content', and optionally 'chunk_embedding'.
+            chunks (Iterable[Chunk]): Document chunks to store. Each chunk should contain
+                                    'chunk_id', 'doc_name', 'start', 'end', and optionally
+                                    'chunk_embedding'. The spans must point into
+                                    ``corpus(collection_name)``.
             collection_name (str): The name of the collection where chunks will be stored.
+            batch_size (int | None, optional): Number of chunks written per call, capped at
+                                             the client's maximum. Smaller batches bound
+                                             memory when streaming. Defaults to None (the
+                                             client's maximum batch size).
 
         Returns:
-            None: Stores the chunks in the database or prints an error if collection not found.
+            int: The number of chunks stored, 0 if the collection was not found or
+                 stores embeddings of another dimensionality.
 
         Raises:
             ValueError: If the specified collection does not exist in the database.
@@ -81,60 +241,319 @@ class ChromaDb:
 
         # retrieve the collection
         try:
+            collection: Collection = self.client.get_collection(
+                name=collection_name,
+                embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
+            )
+        except NotFoundError:
+            print(f'Error: Collection "{collection_name}" not found')
+            return 0
+        if not check_dimensions(collection_name, collection.metadata, self.dimensions):
+            return 0
+
+        max_batch_size = self.client.get_max_batch_size()
+        batch_size = min(batch_size or max_batch_size, max_batch_size)
+        total = 0
+        started = time.perf_counter()
+
+        corpus = self.corpus(collection_name)
+        lexical = self.__lexical_index(collection_name)
+
+        for batch in itertools.batched(chunks, batch_size):
+            chunk_ids = [chunk["chunk_id"] for chunk in batch]
+            texts = [corpus.read(chunk["start"], chunk["end"]) for chunk in batch]
+            metadatas = [
+                {
+                    "doc_name": chunk["doc_name"],
+                    "start": chunk["start"],
+                    "end": chunk["end"],
+                }
+                for chunk in batch
+            ]
+
+            with tracer.span(
+                "db.upsert",
+                backend="chroma",
+                collection=collection_name,
+                chunks=len(batch),
+            ):
+                if all("chunk_embedding" in chunk for chunk in batch):
+                    collection.upsert(
+                        ids=chunk_ids,
+                        embeddings=np.array(
+                            [chunk["chunk_embedding"] for chunk in batch],
+                            dtype=np.float32,
+                        ),
+                        metadatas=metadatas,
+                    )
+                else:
+                    # chunks without a precomputed embedding are embedded by the
+                    # collection, which needs their text for that
+                    collection.upsert(
+                        ids=chunk_ids, documents=texts, metadatas=metadatas
+                    )
+                lexical.add(chunk_ids, texts)
+            total += len(batch)
+            self.query_cache.invalidate(collection_name)
+
+        elapsed = time.perf_counter() - started
+        if total:
+            lexical.save()
+            print(
+                f"Stored {total} chunks in {elapsed:.2f}s "
+                f"({total / max(elapsed, 1e-9):,.0f} rows/s)"
+            )
+
+        return total
+
+    def count_chunks(self, collection_name: str) -> int:
+        """
+        Count the document chunks stored in a ChromaDB collection.
+
+        Args:
+            collection_name (str): The name of the collection.
+
+        Returns:
+            int: The number of chunks, or 0 if the collection is not found.
+        """
+        try:
+            return self.client.get_collection(name=collection_name).count()
+
+        except NotFoundError:
+            print(f'Error: Collection "{collection_name}" not found')
+            return 0
+
+    def delete_chunks(self, chunk_ids: list[str], collection_name: str) -> None:
+        """
+        Remove document chunks from a ChromaDB collection by their IDs.
+
+        Args:
+            chunk_ids (list[str]): IDs of the chunks to remove. IDs that are not in the
+                                   collection are ignored.
+            collection_name (str): The name of the collection to remove chunks from.
+
+        Returns:
+            None: Removes the chunks or prints an error if collection not found.
+
+        Raises:
+            ValueError: If the specified collection does not exist in the database.
+        """
+        if not chunk_ids:
+            return
+
+        try:
+            lexical = self.__lexical_index(collection_name)
             collection: Collection = self.client.get_collection(name=collection_name)
-            for chunk in chunks:
-                collection.upsert(
-                    ids=chunk["chunk_id"],
-                    documents=chunk["chunk_content"],
-                    embeddings=chunk.get("chunk_embedding", None),
-                )
+            collection.delete(ids=chunk_ids)
+            if lexical.delete(chunk_ids):
+                lexical.save()
+            self.query_cache.invalidate(collection_name)
+
+        except NotFoundError:
+            print(f'Error: Collection "{collection_name}" not found')
 
-        except ValueError as e:
+    def clear_chunks(self, collection_name: str) -> int:
+        """
+        Remove every document chunk from a ChromaDB collection, keeping the collection.
+
+        The chunks refer to the collection's corpus store by byte span, so they have to
+        be removed before the corpus is cleared.
+
+        Args:
+            collection_name (str): The name of the collection to empty.
+
+        Returns:
+            int: The number of chunks removed, 0 if the collection is not found.
+        """
+        try:
+            collection: Collection = self.client.get_collection(name=collection_name)
+        except NotFoundError:
             print(f'Error: Collection "{collection_name}" not found')
+            return 0
 
+        chunk_ids = collection.get(include=[])["ids"]
+        # deletes are capped at the same batch size as upserts
+        for batch in itertools.batched(chunk_ids, self.client.get_max_batch_size()):
+            self.delete_chunks(list(batch), collection_name)
+        self.query_cache.invalidate(collection_name)
+        return len(chunk_ids)
+
+    @tracer.traced("db.query")
     def query_documents(
-        self, question: str, collection_name: str, n_results=2
+        self,
+        question: str,
+        collection_name: str,
+        n_results=2,
+        hybrid=False,
+        prefilter: int | None = None,
     ) -> list[str] | None:
         """
         Query the ChromaDB collection for documents most relevant to a given question.
 
         This method uses semantic similarity search to find document chunks that are most
         relevant to the input question. It generates an embedding for the question using
-        the same OpenAI model used for document embeddings and returns the most similar chunks.
+        the same OpenAI model used for document embeddings and returns the most similar chunks,
+        whose text is read from the collection's corpus store. Query embeddings and results
+        are cached in process (see ``query_cache``), so a repeated question makes neither an
+        embedding call nor a vector search until the collection is written to.
+
+        With ``hybrid``, the question is also ranked by BM25 over the collection's lexical
+        index and both rankings are merged with reciprocal rank fusion, so chunks naming
+        the exact entities and figures of the question ("Slack", "FY23") are found even
+        when their embeddings are not the closest, and fewer results are needed for the
+        same answer. With ``prefilter``, the vector search only scores the top
+        ``prefilter`` BM25 matches; a question sharing no term with the collection
+        searches every chunk.
 
         Args:
             question (str): The question or query text to search for relevant documents.
             collection_name (str): The name of the collection to search within.
             n_results (int, optional): The maximum number of relevant chunks to return.
                                      Defaults to 2.
+            hybrid (bool, optional): Whether to fuse the vector search with a BM25 search.
+                                   Defaults to False.
+            prefilter (int | None, optional): Number of BM25 matches the vector search is
+                                              restricted to. Defaults to None (search
+                                              every chunk).
 
         Returns:
             list[str] | None: A list of relevant document chunks as strings, or None if
-                            the collection is not found. Returns an empty list if no
-                            relevant documents are found.
+                            the collection is not found or stores embeddings of another
+                            dimensionality. Returns an empty list if no relevant
+                            documents are found.
 
         Raises:
             ValueError: If the specified collection does not exist in the database.
         """
         try:
-            collection: Collection = self.client.get_collection(
+            collection: Collection = self.__get_collection(collection_name)
+
+        except NotFoundError:
+            print(f'Error: Collection "{collection_name}" not found')
+            return None
+        if not check_dimensions(collection_name, collection.metadata, self.dimensions):
+            return None
+
+        arguments: dict = {"include": ["documents", "metadatas"]}
+        if hybrid or prefilter:
+            lexical = self.__lexical_index(collection_name)
+            candidates = lexical.candidates([question], prefilter) if prefilter else []
+            if candidates:
+                arguments["ids"] = candidates
+
+        embeddings = self.query_cache.embed([question], self.ef)
+        key = self.query_cache.result_key(
+            collection_name, embeddings, n_results, **arguments
+        )
+        results: QueryResult | None = self.query_cache.get_result(key)
+        if results is None:
+            with tracer.span(
+                "db.search",
+                backend="chroma",
+                collection=collection_name,
+                n_results=n_results,
+            ):
+                results = collection.query(
+                    query_embeddings=embeddings, n_results=n_results, **arguments
+                )
+            self.query_cache.put_result(key, results)
+
+        # (document, metadata) of every returned chunk, best first
+        found = dict(
+            zip(
+                results["ids"][0],
+                zip(
+                    (results.get("documents") or [[]])[0],
+                    (results.get("metadatas") or [[]])[0],
+                ),
+            )
+        )
+        ranking = list(found)
+        if hybrid:
+            ranking = fuse_rankings(
+                [
+                    ranking,
+                    [chunk_id for chunk_id, _ in lexical.search(question, n_results)],
+                ],
+                n_results,
+            )
+            missing = [chunk_id for chunk_id in ranking if chunk_id not in found]
+            if missing:
+                stored = collection.get(ids=missing, include=["documents", "metadatas"])
+                found.update(
+                    zip(
+                        stored["ids"],
+                        zip(stored["documents"] or [], stored["metadatas"] or []),
+                    )
+                )
+
+        corpus = self.corpus(collection_name)
+        relevant_chunks: list[str] = []
+        for chunk_id in ranking:
+            if chunk_id not in found:
+                continue
+            document = self.__chunk_text(corpus, *found[chunk_id])
+            if document is not None:
+                relevant_chunks.append(document)
+
+        return relevant_chunks
+
+    def __get_collection(self, collection_name: str) -> Collection:
+        """
+        Get a collection handle, looking it up only the first time.
+
+        Raises:
+            NotFoundError: If the specified collection does not exist in the database.
+        """
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            collection = self.client.get_collection(
                 name=collection_name,
                 embedding_function=cast(EmbeddingFunction[Embeddable], self.ef),
             )
-            results: QueryResult = collection.query(
-                query_texts=question, n_results=n_results
-            )
+            self._collections[collection_name] = collection
+        return collection
 
-            documents = results.get("documents", [])
-            if documents:
-                relevant_chunks: list[str] = [
-                    doc for sublist in documents for doc in sublist
-                ]
-            else:
-                relevant_chunks = []
+    def __lexical_index(self, collection_name: str) -> LexicalIndex:
+        """
+        Get the lexical index of a collection, opening it only the first time.
 
-            return relevant_chunks
+        An index not covering the collection, e.g. of a collection ingested before lexical
+        indexes existed, is rebuilt from the stored chunks.
 
-        except ValueError as e:
-            print(f'Error: Collection "{collection_name}" not found')
-            return None
+        Raises:
+            NotFoundError: If the specified collection does not exist in the database.
+        """
+        lexical = self._lexical.get(collection_name)
+        if lexical is None:
+            collection = self.__get_collection(collection_name)
+            lexical = LexicalIndex(
+                os.path.join(self.storage_path, f"{collection_name}.lexical")
+            )
+            if len(lexical) != collection.count():
+                stored = collection.get(include=["documents", "metadatas"])
+                corpus = self.corpus(collection_name)
+                lexical.clear()
+                lexical.add(
+                    stored["ids"],
+                    [
+                        self.__chunk_text(corpus, document, metadata) or ""
+                        for document, metadata in zip(
+                            stored["documents"] or [], stored["metadatas"] or []
+                        )
+                    ],
+                )
+                lexical.save()
+            self._lexical[collection_name] = lexical
+        return lexical
+
+    @staticmethod
+    def __chunk_text(
+        corpus: CorpusStore, document: str | None, metadata: Mapping | None
+    ) -> str | None:
+        # chunks stored before the corpus store existed carry their text
+        if document is None and metadata and "start" in metadata:
+            document = corpus.read(
+                int(cast(int, metadata["start"])), int(cast(int, metadata["end"]))
+            )
+        return document
@@ -0,0 +1,120 @@
+import mmap
+import os
+import threading
+
+
+class CorpusStore:
+    """
+    An append-only file holding the UTF-8 text of every ingested document.
+
+    Documents are appended once, while they are chunked, and chunks refer to them as
+    (start, end) byte spans instead of holding copies of their text. Spans are read back
+    through a read-only memory map of the file, so text is only materialised when it is
+    needed (for embedding, or to answer a query) and the operating system pages the
+    corpus in and out on demand: RAM use follows the working set, not the corpus size.
+
+    The store never rewrites data. Re-ingesting a modified document appends it again and
+    leaves the old bytes unreferenced until the store is cleared.
+
+    Attributes:
+        path (str): Location of the corpus file.
+
+    Example:
+        >>> corpus = CorpusStore("./chroma/news.corpus")
+        >>> start = corpus.append("Hello world".encode("utf-8"))
+        >>> corpus.read(start, start + 5)
+        'Hello'
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open (or create) the corpus file.
+
+        Args:
+            path (str): Location of the corpus file.
+        """
+        self.path = path
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # the writer appends and the reader maps the file, possibly from other threads
+        self._lock = threading.Lock()
+        self._file = open(self.path, "ab")
+        self._map: mmap.mmap | None = None
+
+    def append(self, data: bytes) -> int:
+        """
+        Append bytes to the corpus and make them readable right away.
+
+        Args:
+            data (bytes): The bytes to append, normally a block of UTF-8 encoded text.
+
+        Returns:
+            int: The byte offset at which the data starts.
+        """
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(data)
+            self._file.flush()
+            return offset
+
+    def read(self, start: int, end: int) -> str:
+        """
+        Materialise the text of a span.
+
+        Args:
+            start (int): Byte offset of the span's start.
+            end (int): Byte offset one past the span's end.
+
+        Returns:
+            str: The decoded text of the span.
+
+        Raises:
+            ValueError: If the span reaches past the end of the corpus.
+        """
+        with self._lock:
+            # the map only covers the file as it was when mapped, remap once it grew
+            if self._map is None or end > len(self._map):
+                size = self._file.tell()
+                if end > size:
+                    raise ValueError(
+                        f"Span {start}:{end} reaches past the end of the corpus ({size} bytes)"
+                    )
+                if self._map is not None:
+                    self._map.close()
+                with open(self.path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            return self._map[start:end].decode("utf-8")
+
+    def size(self) -> int:
+        """
+        Get the size of the corpus.
+
+        Returns:
+            int: The number of bytes appended so far.
+        """
+        with self._lock:
+            return self._file.tell()
+
+    def clear(self) -> None:
+        """
+        Drop every document, invalidating all spans handed out so far.
+        """
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.truncate(0)
+            self._file.seek(0)
+
+    def close(self) -> None:
+        """
+        Close the corpus file and its memory map.
+        """
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
@@ -1,156 +1,375 @@
-from typing import TypedDict, NotRequired
-from util import load_and_get_key
-from openai import OpenAI
+from typing import Iterable, Iterator, TextIO, TypedDict, NotRequired
+from util import load_and_get_key, iter_text_files
+from corpus import CorpusStore
+from rag_common.embedding_cache import EmbeddingCache
+from rag_common.embedding_engine import EmbeddingEngine
+from pipeline import prefetch
+from rag_common.tracing import tracer
+import itertools
+import tiktoken
 import os
+import time
 
 
 class Chunk(TypedDict):
     chunk_id: str
-    chunk_content: str
+    doc_name: str
+    # byte span of the chunk's text in the corpus store
+    start: int
+    end: int
     chunk_embedding: NotRequired[list[float]]
 
 
-class Document(TypedDict):
-    doc_name: str
-    doc_content: str
-
+EMBEDDING_MODEL = "text-embedding-3-small"
+# text-embedding-3 models can shorten their embeddings, None keeps all 1536 dimensions
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None
 
 openai_key = load_and_get_key()
 
-openai_client = OpenAI(api_key=openai_key)
+# concurrent, rate limit aware client shared by document and query embedding
+embedding_engine = EmbeddingEngine(
+    model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS, api_key=openai_key
+)
+
+embedding_cache = EmbeddingCache()
+
+# per-request limits of the embeddings endpoint: at most 2048 inputs and 300k tokens
+# summed across all inputs, with every single input capped at 8191 tokens
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300_000
+MAX_INPUT_TOKENS = 8191
+
+# text-embedding-3-* models share the cl100k_base tokenizer
+encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+# number of characters read from a document at a time while chunking it
+READ_BLOCK_SIZE = 64 * 1024
 
 
 class DocumentEmbedder:
     """
     A class for loading documents, splitting them into chunks, and generating embeddings.
 
-    This class handles the complete pipeline from loading text documents from a directory,
-    splitting them into manageable chunks, and generating OpenAI embeddings for each chunk.
+    This class handles the complete pipeline from loading text documents from a directory
+    tree, splitting them into manageable chunks, and generating OpenAI embeddings for each
+    chunk. The pipeline is built from generators: files are discovered by a recursive walk,
+    read in blocks and chunked lazily, and chunks are embedded in windows, so only a bounded
+    number of chunks is ever held in memory when the stages are consumed as a stream.
+
+    Chunks do not carry their text. While a document is chunked it is appended to a
+    memory-mapped corpus store, and every chunk is a (doc_name, start, end) byte span into
+    it. Text is only read back for the window of chunks being embedded, so overlapping
+    chunks never duplicate text in memory.
     """
 
-    def __init__(self, path: str) -> None:
+    def __init__(
+        self,
+        path: str,
+        corpus: CorpusStore,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 20,
+    ) -> None:
         """
         Initialize the DocumentEmbedder with a path.
 
         Args:
             path (str): The path to the directory containing documents to process.
+            corpus (CorpusStore): The store documents are appended to while they are
+                                  chunked, normally ``ChromaDb.corpus(collection_name)``
+                                  of the collection the chunks are meant for.
+            chunk_size (int, optional): Size of each chunk in characters. Defaults to 1000.
+            chunk_overlap (int, optional): Number of characters shared by consecutive
+                                           chunks. Defaults to 20.
+
+        Raises:
+            ValueError: If chunk_size is not positive, or chunk_overlap is negative or not
+                        smaller than chunk_size (the chunker would never advance).
         """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(
+                "chunk_overlap must be at least 0 and less than chunk_size"
+            )
+
         self.path = path
+        self.corpus = corpus
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
         self.chunks: list[Chunk] = []
 
-    def get_chunks(self) -> list[Chunk]:
+    def get_chunks(self, filenames: list[str] | None = None) -> list[Chunk]:
         """
         Main method to get processed chunks with embeddings.
 
         This method orchestrates the entire pipeline: loading documents,
-        chunking them, and generating embeddings for each chunk.
+        chunking them, and generating embeddings for each chunk. All chunks are
+        collected into a list; use ``stream_chunks`` to process large corpora
+        with bounded memory instead.
+
+        Args:
+            filenames (list[str] | None, optional): Restrict processing to these files
+                                                    of the directory, e.g. only the ones
+                                                    that changed since the last ingest.
+                                                    Defaults to None (all text files).
 
         Returns:
             list[Chunk]: A list of chunks with their content and embeddings.
         """
-
-        # load documents
-        documents = self.__load_documents(self.path)
-        print(f"Loaded {len(documents)} documents")
-
-        # generate chunks from all loaded documents
-        self.chunks = self.__documents_to_chunks(documents)
-
-        # associate the corresponding embedding for each of the generated chunks
-        print(f"Generating embeddings for {len(self.chunks)} chunks...")
-        for i, chunk in enumerate(self.chunks, 1):
-            chunk["chunk_embedding"] = self.__get_openai_embedding(
-                chunk["chunk_content"]
-            )
-            if i % 5 == 0 or i == len(self.chunks):
-                print(f"  Progress: {i}/{len(self.chunks)} embeddings generated")
-
+        self.chunks = list(self.embed_chunks(self.iter_chunks(filenames)))
         return self.chunks
 
-    def __load_documents(self, directory: str) -> list[Document]:
+    def stream_chunks(
+        self, filenames: list[str] | None = None, queue_size: int = 256
+    ) -> Iterator[Chunk]:
         """
-        Load all text documents from the specified directory.
+        Stream embedded chunks through a pipeline of concurrent, bounded stages.
 
-        Args:
-            directory (str): Path to the directory containing text files.
+        Reading and chunking runs in one background thread and embedding in another;
+        they hand chunks to each other and to the caller through queues holding at most
+        ``queue_size`` chunks, so disk reads, api requests and the consumer (e.g. a
+        database upsert) overlap while peak memory stays independent of corpus size.
 
-        Returns:
-            list[Document]: A list of documents with their names and content.
+        Args:
+            filenames (list[str] | None, optional): Restrict processing to these files
+                                                    of the directory. Defaults to None
+                                                    (all text files).
+            queue_size (int, optional): Capacity of each queue between stages, also used
+                                        as the embedding window. Defaults to 256.
+
+        Yields:
+            Chunk: Chunks with their content and embeddings.
+
+        Example:
+            >>> embedder = DocumentEmbedder("./news_articles", vector_db.corpus("news"))
+            >>> vector_db.add_chunks(embedder.stream_chunks(), "news")
         """
-        documents: list[Document] = []
-
-        # loop through the files in given directory
-        for filename in os.listdir(directory):
-            if filename.endswith(".txt"):
-                # read the file contents
-                with open(
-                    os.path.join(directory, filename), "r", encoding="utf-8"
-                ) as f:
-                    documents.append({"doc_name": filename, "doc_content": f.read()})
-
-        return documents
-
-    def __chunk_generator(
-        self, text: str, chunk_size: int = 1000, chunk_overlap: int = 20
-    ) -> list[str]:
+        chunks = prefetch(self.iter_chunks(filenames), queue_size)
+        # split every window into one request per concurrent connection
+        max_inputs = -(-queue_size // embedding_engine.max_concurrency)
+        embedded = self.embed_chunks(chunks, window=queue_size, max_inputs=max_inputs)
+        yield from prefetch(embedded, queue_size)
+
+    def iter_chunks(self, filenames: list[str] | None = None) -> Iterator[Chunk]:
         """
-        Split text into overlapping chunks of specified size.
+        Lazily read and chunk the text documents below the directory.
+
+        Documents are discovered recursively and named by their path relative to the
+        directory. Each document is read in blocks and appended to the corpus store, so not
+        even a single document has to fit in memory at once.
 
         Args:
-            text (str): The text to be split into chunks.
-            chunk_size (int, optional): Maximum size of each chunk. Defaults to 1000.
-            chunk_overlap (int, optional): Number of characters to overlap between chunks. Defaults to 20.
+            filenames (list[str] | None, optional): Only process these files, given as
+                                                    paths relative to the directory.
+                                                    Defaults to None (every text file).
 
-        Returns:
-            list[str]: A list of text chunks.
+        Yields:
+            Chunk: Chunks with unique IDs and spans, without embeddings.
         """
-        chunks: list[str] = []
-        start: int = 0
-        while start < len(text):
-            end = start + chunk_size
-            chunks.append(text[start:end])
-            start = end - chunk_overlap
-
-        return chunks
-
-    def __documents_to_chunks(self, documents: list[Document]) -> list[Chunk]:
+        n_documents = 0
+        for doc_name in (
+            filenames if filenames is not None else iter_text_files(self.path)
+        ):
+            print(f"Processing {doc_name}...")
+            # the time spent reading and chunking, without the time the consumer holds
+            # the generator suspended
+            busy = 0.0
+            resumed = time.perf_counter()
+            with open(os.path.join(self.path, doc_name), "r", encoding="utf-8") as f:
+                n_chunks = 0
+                for i, (start, end) in enumerate(self.__chunk_generator(f)):
+                    n_chunks += 1
+                    busy += time.perf_counter() - resumed
+                    yield {
+                        "chunk_id": f"{doc_name}_chunk{i + 1}",
+                        "doc_name": doc_name,
+                        "start": start,
+                        "end": end,
+                    }
+                    resumed = time.perf_counter()
+            busy += time.perf_counter() - resumed
+            tracer.record("document.chunk", busy, doc_name=doc_name, chunks=n_chunks)
+            print(f"  Generated {n_chunks} chunks")
+            n_documents += 1
+
+        print(f"Loaded {n_documents} documents")
+
+    def embed_chunks(
+        self,
+        chunks: Iterable[Chunk],
+        window: int = MAX_BATCH_INPUTS * embedding_engine.max_concurrency,
+        max_inputs: int = MAX_BATCH_INPUTS,
+    ) -> Iterator[Chunk]:
         """
-        Convert a list of documents into chunks with unique identifiers.
+        Attach embeddings to a stream of chunks, a window of chunks at a time.
 
-        Args:
-            documents (list[Document]): List of documents to be chunked.
+        The text of a window's chunks is read from the corpus store and released once the
+        window is embedded. Within every window, previously computed embeddings are reused
+        from the cache and the remaining chunks are packed into as few embedding requests
+        as the api limits allow. The requests of a window are sent concurrently by the
+        embedding engine, which also enforces rate limits and retries failed requests.
 
-        Returns:
-            list[Chunk]: List of chunks with unique IDs and content.
+        Args:
+            chunks (Iterable[Chunk]): The chunks to embed.
+            window (int, optional): Number of chunks processed together. Bounds memory
+                                    use. Defaults to enough chunks to fill one maximum
+                                    size request per concurrent connection.
+            max_inputs (int, optional): Maximum number of chunks per request.
+                                        Defaults to MAX_BATCH_INPUTS.
+
+        Yields:
+            Chunk: The input chunks, in order, with 'chunk_embedding' set.
         """
-        document_chunks: list[Chunk] = []
-
-        for doc in documents:
-            print(f"Processing {doc['doc_name']}...")
-            chunks: list[str] = self.__chunk_generator(doc["doc_content"])
-            for i, chunk in enumerate(chunks):
-                document_chunks.append(
-                    {
-                        "chunk_id": f"{doc['doc_name']}_chunk{i + 1}",
-                        "chunk_content": chunk,
-                    }
+        done = 0
+        n_cached = 0
+        for batch_window in itertools.batched(chunks, window):
+            with tracer.span("document.embed", chunks=len(batch_window)) as span:
+                # materialise the window's text, only referenced until the window is done
+                window_texts = [
+                    self.corpus.read(chunk["start"], chunk["end"])
+                    for chunk in batch_window
+                ]
+
+                # reuse the embeddings of chunks whose text has not changed
+                cached = embedding_cache.get_many(
+                    EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, window_texts
                 )
-            print(f"  Generated {len(chunks)} chunks")
+                for chunk, embedding in zip(batch_window, cached):
+                    if embedding is not None:
+                        chunk["chunk_embedding"] = embedding
+                        n_cached += 1
+                pending = [
+                    (chunk, text)
+                    for chunk, text in zip(batch_window, window_texts)
+                    if "chunk_embedding" not in chunk
+                ]
+
+                # associate the corresponding embedding for each of the remaining chunks,
+                # packing as many chunks as the api limits allow into every request and
+                # sending the requests of the window concurrently
+                batches = list(self.__batch_chunks(pending, max_inputs=max_inputs))
+                texts = [[pending[i][1] for i in batch] for batch in batches]
+                for batch, batch_texts, embeddings in zip(
+                    batches, texts, embedding_engine.embed_many(texts)
+                ):
+                    embedding_cache.put_many(
+                        EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, batch_texts, embeddings
+                    )
+                    for i, embedding in zip(batch, embeddings):
+                        pending[i][0]["chunk_embedding"] = embedding
+                span.set(cached=len(batch_window) - len(pending))
+
+            done += len(batch_window)
+            print(f"  Progress: {done} embeddings ready ({n_cached} from cache)")
+            yield from batch_window
+
+    def __chunk_generator(self, file: TextIO) -> Iterator[tuple[int, int]]:
+        """
+        Append the text of a file to the corpus and split it into overlapping spans.
 
-        return document_chunks
+        The file is read in blocks; every block is appended to the corpus store and only
+        the unconsumed tail of the text is buffered. The spans cover exactly the same text
+        as slicing the whole document every ``chunk_size - chunk_overlap`` characters into
+        chunks of ``chunk_size`` characters, but as byte offsets into the corpus.
 
-    def __get_openai_embedding(self, text: str) -> list[float]:
+        Args:
+            file (TextIO): The open text file to be split into chunks.
+
+        Yields:
+            tuple[int, int]: The (start, end) byte span of every chunk, in order.
+        """
+        size = self.chunk_size
+        step = self.chunk_size - self.chunk_overlap
+
+        buffer = ""
+        # character offset of the next chunk into the buffer
+        start = 0
+        # a buffer position whose corpus byte offset is known, chunks only move forward
+        known_char = 0
+        known_byte = 0
+
+        def byte_offset(char: int) -> int:
+            nonlocal known_char, known_byte
+            # trivial for ascii text, otherwise measure the text since the known position
+            if buffer.isascii():
+                return known_byte + char - known_char
+            known_byte += len(buffer[known_char:char].encode("utf-8"))
+            known_char = char
+            return known_byte
+
+        def span(begin: int, end: int) -> tuple[int, int]:
+            end = min(end, len(buffer))
+            first = byte_offset(begin)
+            if buffer.isascii():
+                return first, first + end - begin
+            return first, first + len(buffer[begin:end].encode("utf-8"))
+
+        for block in iter(lambda: file.read(READ_BLOCK_SIZE), ""):
+            offset = self.corpus.append(block.encode("utf-8"))
+
+            # drop the consumed text before appending the next block
+            known_byte = byte_offset(start) if buffer else offset
+            known_char = 0
+            buffer = buffer[start:] + block
+            start = 0
+
+            # a chunk is final once the buffer holds chunk_size characters past its start
+            while len(buffer) - start >= size:
+                yield span(start, start + size)
+                start += step
+
+        # flush the tail, which is shorter than a full chunk
+        while start < len(buffer):
+            yield span(start, start + size)
+            start += step
+
+    def __batch_chunks(
+        self,
+        chunks: list[tuple[Chunk, str]],
+        max_inputs: int = MAX_BATCH_INPUTS,
+        max_tokens: int = MAX_BATCH_TOKENS,
+    ) -> Iterator[list[int]]:
         """
-        Generate OpenAI embedding for the given text.
+        Group chunks into request-sized batches for the embeddings endpoint.
+
+        Chunks are packed greedily in order until adding the next one would exceed
+        either the input count or the summed token limit of a single request. Token
+        counts are measured with the same tiktoken encoding the embedding model uses.
 
         Args:
-            text (str): The text to generate an embedding for.
+            chunks (list[tuple[Chunk, str]]): The chunks to be embedded, with their text.
+            max_inputs (int, optional): Maximum number of inputs per request.
+                                        Defaults to MAX_BATCH_INPUTS.
+            max_tokens (int, optional): Maximum summed token count per request.
+                                        Defaults to MAX_BATCH_TOKENS.
 
-        Returns:
-            list[float]: The embedding vector as a list of floats.
+        Yields:
+            list[int]: Indices into ``chunks`` that make up one request.
+
+        Raises:
+            ValueError: If a single chunk is longer than the model's input limit.
         """
-        response = openai_client.embeddings.create(
-            input=text, model="text-embedding-3-small"
-        )
-        embedding: list[float] = response.data[0].embedding
-        return embedding
+        token_counts = [
+            len(tokens)
+            for tokens in encoding.encode_ordinary_batch([text for _, text in chunks])
+        ]
+
+        batch: list[int] = []
+        batch_tokens = 0
+        for i, n_tokens in enumerate(token_counts):
+            if n_tokens > MAX_INPUT_TOKENS:
+                raise ValueError(
+                    f'Chunk "{chunks[i][0]["chunk_id"]}" has {n_tokens} tokens, '
+                    f"the embedding model accepts at most {MAX_INPUT_TOKENS}"
+                )
+            # flush the current batch if this chunk would push it over a limit
+            if batch and (
+                len(batch) == max_inputs or batch_tokens + n_tokens > max_tokens
+            ):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += n_tokens
+
+        if batch:
+            yield batch
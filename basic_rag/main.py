@@ -1,16 +1,111 @@
-from embedding import DocumentEmbedder
+from embedding import Chunk, DocumentEmbedder
 from chroma import ChromaDb
+from rag_common.context_packer import ContextPacker
+from numpy_db import NumpyDb
+from manifest import FileManifest
+from rag_common.streaming import CompletionStream
+from rag_common.tracing import tracer
 from util import load_and_get_key
-from openai import OpenAI
-from openai.types.chat import ChatCompletion
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import (
+    ChatCompletionSystemMessageParam,
+    ChatCompletionUserMessageParam,
+)
+from typing import Iterator
+import argparse
+import os
 
 
+# number of chunks buffered between, and processed at once by, the ingest stages
+INGEST_QUEUE_SIZE = 256
+
+
+def _rag_messages(
+    question: str, relevant_chunks: list[str]
+) -> list[ChatCompletionSystemMessageParam | ChatCompletionUserMessageParam]:
+    # the prompt shared by the synchronous and asynchronous response streams
+    context: str = "\n\n".join(relevant_chunks)
+    system_prompt = (
+        "You are an assistant for question-answering tasks. Use the following pieces of "
+        "retrieved context to answer the question. If you don't know the answer, say that you "
+        "don't know. Use three sentences maximum and keep the answer concise."
+        "\n\nContext:\n" + context + "\n\nQuestion:\n" + question
+    )
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": question},
+    ]
+
+
+def stream_rag_response(
+    question: str, relevant_chunks: list[str], client: OpenAI
+) -> CompletionStream:
+    """
+    Stream the answer to a question, token by token, using the retrieved chunks as context.
+
+    Args:
+        question (str): The user's question to be answered.
+        relevant_chunks (list[str]): List of relevant text chunks retrieved from the vector database
+                                   that provide context for answering the question.
+        client (OpenAI): The client sending the request.
+
+    Returns:
+        CompletionStream: A stream to iterate with ``for``, yielding the answer's text as
+                          the tokens arrive. The request is sent when the iteration starts.
+                          Once it ended, ``stream.text`` holds the full answer and
+                          ``stream.stats`` the time to first token and the token counts.
+    """
+    messages = _rag_messages(question, relevant_chunks)
+
+    return CompletionStream(
+        lambda: client.chat.completions.create(
+            model="gpt-4.1-nano",
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+    )
+
+
+def astream_rag_response(
+    question: str, relevant_chunks: list[str], client: AsyncOpenAI
+) -> CompletionStream:
+    """
+    Stream the answer to a question, token by token, asynchronously.
+
+    The asynchronous counterpart of ``stream_rag_response``.
+
+    Args:
+        question (str): The user's question to be answered.
+        relevant_chunks (list[str]): List of relevant text chunks retrieved from the vector database
+                                   that provide context for answering the question.
+        client (AsyncOpenAI): The client sending the request.
+
+    Returns:
+        CompletionStream: A stream to iterate with ``async for``, see ``stream_rag_response``.
+    """
+    messages = _rag_messages(question, relevant_chunks)
+
+    return CompletionStream(
+        lambda: client.chat.completions.create(
+            model="gpt-4.1-nano",
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+    )
+
+
+@tracer.traced("rag.answer")
 def generate_rag_response(question: str, relevant_chunks: list[str]) -> None:
     """
     Generate a response to a question using RAG (Retrieval-Augmented Generation).
 
     This function takes a user question and relevant document chunks, then uses OpenAI's
     GPT model to generate a contextually informed answer based on the provided content.
+    The answer is streamed: it is printed as its tokens arrive, followed by the time to
+    first token and the number of tokens generated.
 
     Args:
         question (str): The user's question to be answered.
@@ -29,25 +124,98 @@ def generate_rag_response(question: str, relevant_chunks: list[str]) -> None:
 
     client = OpenAI(api_key=api_key)
 
-    context: str = "\n\n".join(relevant_chunks)
-    system_prompt = (
-        "You are an assistant for question-answering tasks. Use the following pieces of "
-        "retrieved context to answer the question. If you don't know the answer, say that you "
-        "don't know. Use three sentences maximum and keep the answer concise."
-        "\n\nContext:\n" + context + "\n\nQuestion:\n" + question
-    )
+    stream = stream_rag_response(question, relevant_chunks, client)
+    for delta in stream:
+        print(delta, end="", flush=True)
+
+    if not stream.text:
+        print("Failed to generate an answer")
+        return
+
+    print()
+    if stream.stats is not None and stream.stats["ttft"] is not None:
+        print(
+            f"(first token after {stream.stats['ttft']:.2f}s, "
+            f"{stream.stats['completion_tokens']} tokens in "
+            f"{stream.stats['total_time']:.2f}s)"
+        )
+
+
+@tracer.traced("rag.ingest")
+def ingest_documents(
+    vector_db: ChromaDb | NumpyDb,
+    directory: str,
+    collection_name: str,
+    full: bool = False,
+) -> None:
+    """
+    Bring a collection in sync with the text files of a directory.
+
+    A manifest stored next to the ChromaDB data records the size, modification time,
+    content hash and chunk ids of every ingested file. Only new or modified files are
+    chunked and embedded, and the chunks of removed files, as well as trailing chunks
+    of files that shrank, are deleted from the collection. Chunks are streamed from
+    the files through embedding into the database with bounded memory, and the text
+    of the ingested files is appended to the collection's corpus store.
 
-    llm_response: ChatCompletion = client.chat.completions.create(
-        model="gpt-4.1-nano",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": question},
-        ],
+    Args:
+        vector_db (ChromaDb | NumpyDb): The vector database to ingest into.
+        directory (str): Path to the directory containing the text files.
+        collection_name (str): The collection to keep in sync. It must already exist.
+        full (bool, optional): Remove every stored chunk, ignore the manifest and
+                               re-ingest every file. Defaults to False.
+
+    Returns:
+        None: Updates the collection and manifest, and prints a summary of the changes.
+    """
+    manifest = FileManifest(
+        os.path.join(vector_db.storage_path, f"{collection_name}.manifest.json")
     )
 
-    answer = llm_response.choices[0].message.content
+    corpus = vector_db.corpus(collection_name)
+
+    # a manifest without the data it describes (e.g. a wiped collection) is worthless,
+    # and so is the text of documents no chunk refers to anymore
+    if full or vector_db.count_chunks(collection_name) == 0:
+        # the stored chunks are spans into the corpus, they go before it is truncated
+        vector_db.clear_chunks(collection_name)
+        manifest.clear()
+        corpus.clear()
+
+    changes = manifest.diff(directory)
+    changed_files = changes["added"] + changes["updated"]
+
+    stale_ids: list[str] = []
+    if changed_files:
+        chunk_ids: dict[str, list[str]] = {filename: [] for filename in changed_files}
+
+        def track_ids(chunks: Iterator[Chunk]) -> Iterator[Chunk]:
+            # only the ids are kept, the chunks themselves are released once stored
+            for chunk in chunks:
+                chunk_ids[chunk["doc_name"]].append(chunk["chunk_id"])
+                yield chunk
+
+        chunks = DocumentEmbedder(directory, corpus).stream_chunks(
+            changed_files, queue_size=INGEST_QUEUE_SIZE
+        )
+        vector_db.add_chunks(
+            track_ids(chunks), collection_name, batch_size=INGEST_QUEUE_SIZE
+        )
+
+        for filename, ids in chunk_ids.items():
+            stale_ids.extend(manifest.record(directory, filename, ids))
 
-    print(answer) if answer else print("Failed to generate an answer")
+    for filename in changes["deleted"]:
+        stale_ids.extend(manifest.remove(filename))
+    vector_db.delete_chunks(stale_ids, collection_name)
+
+    manifest.save()
+
+    print(
+        f"Ingest summary: {len(changes['added'])} added, "
+        f"{len(changes['updated'])} updated, {len(changes['deleted'])} deleted, "
+        f"{len(changes['skipped'])} skipped"
+    )
 
 
 def main() -> None:
@@ -55,11 +223,28 @@ def main() -> None:
     Main function that orchestrates the complete RAG (Retrieval-Augmented Generation) pipeline.
 
     This function performs the following steps:
-    1. Loads and processes documents from the news_articles directory
-    2. Creates chunks and generates embeddings for each chunk
-    3. Sets up a ChromaDB vector database and stores the embedded chunks
-    4. Queries the database with a predefined question
-    5. Generates and displays an AI-powered response using the retrieved context
+    1. Sets up a ChromaDB vector database
+    2. Loads the new or modified documents from the news_articles directory
+    3. Creates chunks and generates embeddings for each of their chunks
+    4. Stores the embedded chunks and removes chunks of deleted documents
+    5. Queries the database with a predefined question
+    6. Generates and displays an AI-powered response using the retrieved context
+
+    Pass ``--full`` on the command line to re-ingest every document regardless of
+    the ingest manifest, and ``--backend numpy`` (or set ``VECTOR_BACKEND=numpy``) to
+    store the vectors in the exact NumPy index instead of ChromaDB. ``--quantization
+    int8`` (or ``float16``) searches that index on compact codes, and
+    ``--prefix-dimensions 256`` searches it in two stages, coarse on the leading 256
+    dimensions and then reranked with the full vectors. The embedding dimensionality is
+    set with the ``EMBEDDING_DIMENSIONS`` environment variable. ``--hybrid`` fuses the
+    vector search with a BM25 search of the collection's lexical index, and
+    ``--prefilter 50`` restricts the vector search to the 50 best BM25 matches.
+    ``--context-budget 1500`` retrieves ``--n-results`` chunks and packs the most relevant
+    and least redundant of them into 1500 tokens of context, optionally dropping the
+    sentences unrelated to the question (``--sentence-threshold 0.5``).
+    ``--trace-file traces.jsonl`` records the duration of every stage (chunking,
+    embedding, upserts, queries, LLM calls with their tokens and estimated cost) as JSON
+    lines, and ``--metrics-port 9464`` serves them in the Prometheus text format.
 
     The function demonstrates a complete end-to-end RAG workflow for question-answering
     over a collection of news articles about AI developments.
@@ -68,29 +253,122 @@ def main() -> None:
         None: Executes the RAG pipeline and prints results to console.
     """
 
+    parser = argparse.ArgumentParser(description="RAG over a folder of news articles")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="re-ingest every article instead of only new or modified ones",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["chroma", "numpy"],
+        default=os.getenv("VECTOR_BACKEND", "chroma"),
+        help="vector store backend (default: $VECTOR_BACKEND or chroma)",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=["float32", "float16", "int8"],
+        default=os.getenv("VECTOR_QUANTIZATION", "float32"),
+        help="precision the numpy backend searches at; quantized searches rescore "
+        "their candidates at full precision (default: $VECTOR_QUANTIZATION or float32)",
+    )
+    parser.add_argument(
+        "--prefix-dimensions",
+        type=int,
+        default=int(os.getenv("VECTOR_PREFIX_DIMENSIONS", 0)) or None,
+        help="numpy backend: scan this many leading dimensions first and rerank the best "
+        "candidates with the full vectors (default: $VECTOR_PREFIX_DIMENSIONS or off)",
+    )
+    parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        help="fuse the vector search with a BM25 search of the collection's lexical index",
+    )
+    parser.add_argument(
+        "--prefilter",
+        type=int,
+        help="restrict the vector search to this many BM25 matches of the question",
+    )
+    parser.add_argument(
+        "--n-results",
+        type=int,
+        default=2,
+        help="number of chunks retrieved for the question (default: 2)",
+    )
+    parser.add_argument(
+        "--context-budget",
+        type=int,
+        default=int(os.getenv("CONTEXT_TOKEN_BUDGET", 0)) or None,
+        help="pack the retrieved chunks into this many tokens, picking relevant and "
+        "diverse chunks first (default: $CONTEXT_TOKEN_BUDGET or no limit)",
+    )
+    parser.add_argument(
+        "--sentence-threshold",
+        type=float,
+        help="with --context-budget, drop the sentences of a chunk sharing fewer "
+        "question terms than this fraction of its best sentence, e.g. 0.5",
+    )
+    parser.add_argument(
+        "--trace-file",
+        help="append a JSON line per traced stage to this file "
+        "(default: $RAG_TRACE_FILE or off)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve stage timings, tokens and cost in the Prometheus text format on "
+        "this port while running (default: $RAG_METRICS_PORT or off)",
+    )
+    args = parser.parse_args()
+    tracer.configure_from_env(
+        trace_file=args.trace_file, metrics_port=args.metrics_port
+    )
+
     print("Starting RAG system...")
     question = "Has Slack started priotizing ai features in the app?"
     collection_name = "news"
 
-    chunk_factory = DocumentEmbedder("./news_articles")
-    chunks = chunk_factory.get_chunks()
-
     print("Setting up vector database...")
-    vector_db = ChromaDb()
+    vector_db = (
+        NumpyDb(
+            quantization=args.quantization, prefix_dimensions=args.prefix_dimensions
+        )
+        if args.backend == "numpy"
+        else ChromaDb()
+    )
     vector_db.create_collection(
         collection_name=collection_name,
         metadata={"description": "a collection of news articles"},
     )
-    vector_db.add_chunks(chunks, collection_name)
+    ingest_documents(vector_db, "./news_articles", collection_name, full=args.full)
     print("Database setup complete")
 
     print(f"\nQuerying: {question}")
-    relevant_chunks = vector_db.query_documents(question, collection_name)
+    relevant_chunks = vector_db.query_documents(
+        question,
+        collection_name,
+        n_results=args.n_results,
+        hybrid=args.hybrid,
+        prefilter=args.prefilter,
+    )
 
     if not relevant_chunks:
         print(f'Vector db returned no results for the question "{question}".')
         return
 
+    if args.context_budget:
+        packer = ContextPacker(
+            vector_db.ef,
+            budget=args.context_budget,
+            sentence_threshold=args.sentence_threshold,
+        )
+        packed = packer.pack(question, relevant_chunks)
+        print(
+            f"Packed {len(packed['chunks'])} of {packed['candidates']} chunks, "
+            f"{packed['tokens']} of {packed['candidate_tokens']} tokens"
+        )
+        relevant_chunks = packed["chunks"]
+
     generate_rag_response(question, relevant_chunks)
 
 
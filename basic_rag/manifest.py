@@ -0,0 +1,177 @@
+from typing import TypedDict
+from util import iter_text_files
+import hashlib
+import json
+import os
+
+
+class ManifestEntry(TypedDict):
+    size: int
+    mtime: float
+    sha256: str
+    chunk_ids: list[str]
+
+
+class ManifestChanges(TypedDict):
+    added: list[str]
+    updated: list[str]
+    deleted: list[str]
+    skipped: list[str]
+
+
+class FileManifest:
+    """
+    A record of which files have been ingested into a collection and in what state.
+
+    For every ingested file the manifest keeps its size, modification time, content hash
+    and the ids of the chunks it produced. Comparing the manifest against a directory
+    tells which files are new, modified or removed since the last ingest, and which
+    chunk ids have to be deleted from the vector database as a result.
+
+    Attributes:
+        path (str): Location of the JSON file the manifest is persisted to.
+        entries (dict[str, ManifestEntry]): Ingested files keyed by their path relative
+            to the ingested directory.
+
+    Example:
+        >>> manifest = FileManifest("./chroma/news.manifest.json")
+        >>> changes = manifest.diff("./news_articles")
+        >>> print(changes["added"], changes["deleted"])
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Load the manifest from disk, or start an empty one if it does not exist yet.
+
+        Args:
+            path (str): Location of the JSON manifest file.
+        """
+        self.path = path
+        self.entries: dict[str, ManifestEntry] = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def diff(self, directory: str) -> ManifestChanges:
+        """
+        Compare the manifest with the text files currently below a directory.
+
+        Files whose size and modification time match the manifest are skipped without
+        being read. Otherwise the content hash decides: a touched but unchanged file is
+        skipped too, and its new modification time is recorded.
+
+        Args:
+            directory (str): Path to the directory containing the text files.
+
+        Returns:
+            ManifestChanges: File names grouped into added, updated, deleted and skipped.
+        """
+        changes: ManifestChanges = {
+            "added": [],
+            "updated": [],
+            "deleted": [],
+            "skipped": [],
+        }
+
+        present: set[str] = set()
+        for filename in iter_text_files(directory):
+            present.add(filename)
+
+            file_path = os.path.join(directory, filename)
+            stat = os.stat(file_path)
+            entry = self.entries.get(filename)
+
+            if entry is None:
+                changes["added"].append(filename)
+            elif entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                changes["skipped"].append(filename)
+            elif entry["sha256"] == self.hash_file(file_path):
+                entry["mtime"] = stat.st_mtime
+                changes["skipped"].append(filename)
+            else:
+                changes["updated"].append(filename)
+
+        changes["deleted"] = sorted(set(self.entries) - present)
+        return changes
+
+    def record(self, directory: str, filename: str, chunk_ids: list[str]) -> list[str]:
+        """
+        Record the current state of an ingested file.
+
+        Args:
+            directory (str): Path to the directory containing the file.
+            filename (str): Name of the ingested file.
+            chunk_ids (list[str]): Ids of the chunks the file was split into.
+
+        Returns:
+            list[str]: Chunk ids from the previous ingest of this file that are no
+                       longer produced, e.g. because the file shrank.
+        """
+        file_path = os.path.join(directory, filename)
+        stat = os.stat(file_path)
+        previous = self.entries.get(filename)
+
+        self.entries[filename] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": self.hash_file(file_path),
+            "chunk_ids": chunk_ids,
+        }
+
+        if previous is None:
+            return []
+        current = set(chunk_ids)
+        return [
+            chunk_id for chunk_id in previous["chunk_ids"] if chunk_id not in current
+        ]
+
+    def remove(self, filename: str) -> list[str]:
+        """
+        Forget a file that no longer exists.
+
+        Args:
+            filename (str): Name of the removed file.
+
+        Returns:
+            list[str]: Ids of the chunks the file had produced.
+        """
+        entry = self.entries.pop(filename, None)
+        return entry["chunk_ids"] if entry else []
+
+    def clear(self) -> None:
+        """
+        Forget every file, so the next diff reports all files as added.
+        """
+        self.entries = {}
+
+    def save(self) -> None:
+        """
+        Write the manifest to disk atomically.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # write to a temporary file first so a crash never leaves a truncated manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """
+        Compute the sha256 digest of a file's content.
+
+        Args:
+            file_path (str): Path to the file.
+
+        Returns:
+            str: The hex digest of the file content.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
@@ -0,0 +1,416 @@
+from typing import Iterable
+import itertools
+import os
+import time
+from util import load_and_get_key
+from corpus import CorpusStore
+from chroma import DIMENSIONS_KEY, check_dimensions, fuse_rankings
+from embedding import (
+    Chunk,
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_MODEL,
+    embedding_cache,
+    embedding_engine,
+)
+from rag_common.embedding_cache import CachedOpenAIEmbeddingFunction
+from rag_common.lexical_index import LexicalIndex
+from rag_common.query_cache import QueryCache
+from rag_common.tracing import tracer
+from rag_common.vector_index import IndexRecord, Quantization, VectorIndex
+
+
+class NumpyDb:
+    """
+    An exact, NumPy-backed vector store exposing the same interface as ``ChromaDb``.
+
+    Every collection is a ``VectorIndex``: the normalized embeddings of its chunks are the
+    rows of one contiguous float32 matrix, and a query is answered with a single matrix
+    product plus ``np.argpartition``. The search is exact and needs no database client,
+    so the pipeline also runs where ChromaDB is not available as a database, e.g. in tests.
+
+    Attributes:
+        storage_path: Directory holding the collection files. A collection is stored as
+            "<collection>.npy" (the embedding matrix, memory-mapped when opened) and
+            "<collection>.json" (chunk IDs and span metadata).
+        quantization: Precision the collections are searched at. With "float16" or
+            "int8" the search scans compact codes in memory and rescores its best
+            candidates from the memory-mapped float32 matrix.
+        prefix_dimensions: Number of leading dimensions the coarse search stage scans
+            before the best candidates are reranked with the full vectors, None for a
+            single-stage search.
+        dimensions: Dimensionality of the embeddings (``EMBEDDING_DIMENSIONS``),
+            recorded in the metadata of new collections. Collections recording another
+            one are rejected.
+        ef: OpenAI embedding function for generating text embeddings, backed by the
+            on-disk embedding cache and the rate limit aware embedding engine.
+        query_cache: In-process cache of query embeddings and query results. Writes
+            through ``add_chunks`` and ``delete_chunks`` invalidate the results of the
+            collection they change.
+
+    As with ``ChromaDb``, chunk text is kept in the collection's corpus store
+    ("<collection>.corpus") and read only for the chunks a query returns, and a BM25
+    lexical index ("<collection>.lexical.npz" and ".json") serves hybrid and prefiltered
+    queries.
+    """
+
+    def __init__(
+        self,
+        storage_path: str = "./numpy_db",
+        quantization: Quantization = "float32",
+        prefix_dimensions: int | None = None,
+    ) -> None:
+        """
+        Initialize the store and the OpenAI embedding function.
+
+        Args:
+            storage_path (str, optional): Path to the directory where the collections are
+                                        stored. Defaults to "./numpy_db".
+            quantization (Quantization, optional): Precision the collections are searched
+                                                   at, "float32", "float16" or "int8" (see
+                                                   ``VectorIndex``). Defaults to "float32".
+            prefix_dimensions (int | None, optional): Number of leading dimensions the
+                                                    coarse search stage scans, e.g. 256.
+                                                    Defaults to None (no coarse stage).
+        """
+        self.storage_path = storage_path
+        self.quantization: Quantization = quantization
+        self.prefix_dimensions = prefix_dimensions
+        self.dimensions = embedding_engine.output_dimensions
+        self.ef = CachedOpenAIEmbeddingFunction(
+            api_key=load_and_get_key(),
+            model_name=EMBEDDING_MODEL,
+            dimensions=EMBEDDING_DIMENSIONS,
+            cache=embedding_cache,
+            fetch=embedding_engine.embed,
+        )
+        self._corpora: dict[str, CorpusStore] = {}
+        self.query_cache = QueryCache()
+        self._indexes: dict[str, VectorIndex] = {}
+        self._lexical: dict[str, LexicalIndex] = {}
+
+    def corpus(self, collection_name: str) -> CorpusStore:
+        """
+        Get the corpus store holding the document text of a collection.
+
+        Args:
+            collection_name (str): The name of the collection.
+
+        Returns:
+            CorpusStore: The collection's corpus, opened once and shared afterwards.
+        """
+        if collection_name not in self._corpora:
+            self._corpora[collection_name] = CorpusStore(
+                os.path.join(self.storage_path, f"{collection_name}.corpus")
+            )
+        return self._corpora[collection_name]
+
+    def create_collection(
+        self, collection_name: str, metadata: dict[str, str] | None = None
+    ) -> VectorIndex:
+        """
+        Create or retrieve a collection.
+
+        Args:
+            collection_name (str): The name of the collection to create or retrieve.
+            metadata (dict[str, str] | None, optional): Optional metadata to associate
+                                                       with a new collection. Defaults to None.
+
+        Returns:
+            VectorIndex: The index holding the collection.
+
+        Raises:
+            ValueError: If an existing collection stores embeddings of another
+                        dimensionality.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            index = self.__open(collection_name)
+            index.metadata = dict(metadata or {})
+            if self.dimensions:
+                index.metadata[DIMENSIONS_KEY] = self.dimensions
+            index.save()
+            self._indexes[collection_name] = index
+
+        if not check_dimensions(collection_name, index.metadata, self.dimensions):
+            raise ValueError(
+                f'Collection "{collection_name}" stores embeddings of another '
+                "dimensionality, use another collection or storage path"
+            )
+        return index
+
+    def add_chunks(
+        self,
+        chunks: Iterable[Chunk],
+        collection_name: str,
+        batch_size: int | None = None,
+    ) -> int:
+        """
+        Add document chunks with their embeddings to a collection.
+
+        Chunks without a precomputed 'chunk_embedding' are embedded from their text in the
+        collection's corpus store, and the text of every chunk is added to the lexical
+        index. Both indexes are saved once, after the last batch.
+
+        Args:
+            chunks (Iterable[Chunk]): Document chunks to store. Each chunk should contain
+                                    'chunk_id', 'doc_name', 'start', 'end', and optionally
+                                    'chunk_embedding'. The spans must point into
+                                    ``corpus(collection_name)``.
+            collection_name (str): The name of the collection where chunks will be stored.
+            batch_size (int | None, optional): Number of chunks inserted at a time.
+                                             Defaults to None (1000).
+
+        Returns:
+            int: The number of chunks stored, 0 if the collection was not found or
+                 stores embeddings of another dimensionality.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return 0
+        if not check_dimensions(collection_name, index.metadata, self.dimensions):
+            return 0
+
+        total = 0
+        started = time.perf_counter()
+        corpus = self.corpus(collection_name)
+        lexical = self.__lexical_index(collection_name, index)
+
+        for batch in itertools.batched(chunks, batch_size or 1000):
+            chunk_ids = [chunk["chunk_id"] for chunk in batch]
+            texts = [corpus.read(chunk["start"], chunk["end"]) for chunk in batch]
+            records: list[IndexRecord] = [
+                {
+                    "document": None,
+                    "metadata": {
+                        "doc_name": chunk["doc_name"],
+                        "start": chunk["start"],
+                        "end": chunk["end"],
+                    },
+                }
+                for chunk in batch
+            ]
+
+            with tracer.span(
+                "db.upsert",
+                backend="numpy",
+                collection=collection_name,
+                chunks=len(batch),
+            ):
+                if all("chunk_embedding" in chunk for chunk in batch):
+                    embeddings = [chunk["chunk_embedding"] for chunk in batch]
+                else:
+                    embeddings = self.ef(texts)
+                index.upsert(chunk_ids, embeddings, records)
+                lexical.add(chunk_ids, texts)
+            total += len(batch)
+
+        if total:
+            index.save()
+            lexical.save()
+            self.query_cache.invalidate(collection_name)
+            elapsed = time.perf_counter() - started
+            print(
+                f"Stored {total} chunks in {elapsed:.2f}s "
+                f"({total / max(elapsed, 1e-9):,.0f} rows/s)"
+            )
+
+        return total
+
+    def count_chunks(self, collection_name: str) -> int:
+        """
+        Count the document chunks stored in a collection.
+
+        Args:
+            collection_name (str): The name of the collection.
+
+        Returns:
+            int: The number of chunks, or 0 if the collection is not found.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return 0
+
+        return len(index)
+
+    def delete_chunks(self, chunk_ids: list[str], collection_name: str) -> None:
+        """
+        Remove document chunks from a collection by their IDs.
+
+        Args:
+            chunk_ids (list[str]): IDs of the chunks to remove. IDs that are not in the
+                                   collection are ignored.
+            collection_name (str): The name of the collection to remove chunks from.
+        """
+        if not chunk_ids:
+            return
+
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return
+
+        lexical = self.__lexical_index(collection_name, index)
+        if index.delete(chunk_ids):
+            index.save()
+            lexical.delete(chunk_ids)
+            lexical.save()
+            self.query_cache.invalidate(collection_name)
+
+    def clear_chunks(self, collection_name: str) -> int:
+        """
+        Remove every document chunk from a collection, see ``ChromaDb.clear_chunks``.
+
+        Args:
+            collection_name (str): The name of the collection to empty.
+
+        Returns:
+            int: The number of chunks removed, 0 if the collection is not found.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return 0
+
+        chunk_ids = list(index.ids)
+        self.delete_chunks(chunk_ids, collection_name)
+        self.query_cache.invalidate(collection_name)
+        return len(chunk_ids)
+
+    @tracer.traced("db.query")
+    def query_documents(
+        self,
+        question: str,
+        collection_name: str,
+        n_results=2,
+        hybrid=False,
+        prefilter: int | None = None,
+    ) -> list[str] | None:
+        """
+        Query a collection for the documents most relevant to a given question.
+
+        Behaves like ``ChromaDb.query_documents``, with an exact search.
+
+        Args:
+            question (str): The question or query text to search for relevant documents.
+            collection_name (str): The name of the collection to search within.
+            n_results (int, optional): The maximum number of relevant chunks to return.
+                                     Defaults to 2.
+            hybrid (bool, optional): Whether to fuse the vector search with a BM25 search.
+                                   Defaults to False.
+            prefilter (int | None, optional): Number of BM25 matches the vector search is
+                                              restricted to. Defaults to None (search
+                                              every chunk).
+
+        Returns:
+            list[str] | None: A list of relevant document chunks as strings, or None if
+                            the collection is not found or stores embeddings of another
+                            dimensionality.
+        """
+        index = self.__get_index(collection_name)
+        if index is None:
+            print(f'Error: Collection "{collection_name}" not found')
+            return None
+        if not check_dimensions(collection_name, index.metadata, self.dimensions):
+            return None
+
+        arguments: dict = {}
+        if hybrid or prefilter:
+            lexical = self.__lexical_index(collection_name, index)
+            candidates = lexical.candidates([question], prefilter) if prefilter else []
+            if candidates:
+                arguments["ids"] = candidates
+
+        embeddings = self.query_cache.embed([question], self.ef)
+        key = self.query_cache.result_key(
+            collection_name, embeddings, n_results, **arguments
+        )
+        ranking: list[str] | None = self.query_cache.get_result(key)
+        if ranking is None:
+            restricted = index.positions(arguments["ids"]) if arguments else None
+            with tracer.span(
+                "db.search",
+                backend="numpy",
+                collection=collection_name,
+                n_results=n_results,
+            ):
+                positions, _ = index.search(embeddings, n_results, restricted)
+            ranking = [index.ids[i] for i in positions[0]]
+            self.query_cache.put_result(key, ranking)
+        if hybrid:
+            ranking = fuse_rankings(
+                [
+                    ranking,
+                    [chunk_id for chunk_id, _ in lexical.search(question, n_results)],
+                ],
+                n_results,
+            )
+        records: list[IndexRecord] = [
+            index.records[i] for i in index.positions(ranking).tolist()
+        ]
+
+        corpus = self.corpus(collection_name)
+        relevant_chunks: list[str] = []
+        for record in records:
+            metadata = record["metadata"] or {}
+            document = record["document"]
+            if document is None and "start" in metadata:
+                document = corpus.read(int(metadata["start"]), int(metadata["end"]))
+            if document is not None:
+                relevant_chunks.append(document)
+
+        return relevant_chunks
+
+    def __get_index(self, collection_name: str) -> VectorIndex | None:
+        """
+        Get the index of a collection, opening it only the first time.
+
+        Returns:
+            VectorIndex | None: The index, or None if the collection does not exist.
+        """
+        index = self._indexes.get(collection_name)
+        if index is None:
+            path = os.path.join(self.storage_path, collection_name)
+            if not os.path.exists(f"{path}.json"):
+                return None
+            index = self.__open(collection_name)
+            self._indexes[collection_name] = index
+        return index
+
+    def __lexical_index(self, collection_name: str, index: VectorIndex) -> LexicalIndex:
+        """
+        Get the lexical index of a collection, opening it only the first time.
+
+        An index not covering the collection, e.g. of a collection ingested before lexical
+        indexes existed, is rebuilt from the chunk spans.
+        """
+        lexical = self._lexical.get(collection_name)
+        if lexical is None:
+            lexical = LexicalIndex(
+                os.path.join(self.storage_path, f"{collection_name}.lexical")
+            )
+            if len(lexical) != len(index):
+                corpus = self.corpus(collection_name)
+                lexical.clear()
+                lexical.add(
+                    index.ids,
+                    [
+                        record["document"]
+                        or corpus.read(
+                            int(record["metadata"]["start"]),
+                            int(record["metadata"]["end"]),
+                        )
+                        for record in index.records
+                    ],
+                )
+                lexical.save()
+            self._lexical[collection_name] = lexical
+        return lexical
+
+    def __open(self, collection_name: str) -> VectorIndex:
+        return VectorIndex(
+            os.path.join(self.storage_path, collection_name),
+            quantization=self.quantization,
+            prefix=self.prefix_dimensions,
+        )
@@ -0,0 +1,75 @@
+from typing import Iterable, Iterator, TypeVar
+import queue
+import threading
+
+
+T = TypeVar("T")
+
+# marks the end of a prefetched stream
+_DONE = object()
+
+
+def prefetch(iterable: Iterable[T], maxsize: int) -> Iterator[T]:
+    """
+    Consume an iterable in a background thread, handing items over through a bounded queue.
+
+    This turns a chain of generators into a pipeline of concurrent stages: the producer
+    runs ahead of the consumer by at most ``maxsize`` items and then blocks, so slow I/O
+    on either side overlaps without letting memory use grow. An exception raised by the
+    producer is re-raised in the consumer once the items before it have been consumed.
+    When the consumer stops early, the producer thread stops as well instead of blocking
+    on the full queue.
+
+    Args:
+        iterable (Iterable[T]): The producing stage, e.g. a generator.
+        maxsize (int): Maximum number of items buffered between the two stages.
+
+    Yields:
+        T: The items of ``iterable``, in order.
+
+    Example:
+        >>> lines = prefetch(read_lines(path), maxsize=128)
+        >>> for line in lines:
+        ...     process(line)
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def send(item: object) -> bool:
+        # give up if the consumer went away instead of blocking forever on a full queue
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not send(item):
+                    break
+            else:
+                send(_DONE)
+        except BaseException as e:
+            send(e)
+        finally:
+            # an abandoned generator stage is closed, which stops the stages it reads from
+            close = getattr(iterable, "close", None)
+            if stop.is_set() and close is not None:
+                close()
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+from typing import Iterator
 import os
 from enum import Enum
 
@@ -10,3 +11,21 @@ class Key(Enum):
 def load_and_get_key() -> str | None:
     load_dotenv()
     return os.getenv(Key.OPENAI.value)
+
+
+def iter_text_files(directory: str) -> Iterator[str]:
+    """
+    Recursively find the text documents below a directory.
+
+    Args:
+        directory (str): Path to the root directory.
+
+    Yields:
+        str: Path of every ``.txt`` file relative to ``directory``, in sorted order.
+    """
+    for root, dirs, files in os.walk(directory):
+        # walk subdirectories in a stable order so document ids are reproducible
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(".txt"):
+                yield os.path.relpath(os.path.join(root, filename), directory)
@@ -0,0 +1,6 @@
+"""
+Modules shared by ``basic_rag`` and ``advanced_rag``.
+
+Both projects depend on this package by path (editable), so a change here applies to
+both without copying files between them.
+"""
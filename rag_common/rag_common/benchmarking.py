@@ -0,0 +1,268 @@
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterator, TypedDict
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+
+# the stub server shared by both projects, started in its own process so its memory
+# and cpu time do not count towards the benchmarked process
+STUB_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "tools", "openai_stub.py"
+)
+
+# the tokenizer files tiktoken would otherwise download on first use (gpt2, cl100k_base
+# and o200k_base), vendored under their cache names so benchmarks run without network.
+# set before any encoding is loaded, an existing TIKTOKEN_CACHE_DIR is kept
+TIKTOKEN_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "tools", "tiktoken_cache"
+)
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", TIKTOKEN_CACHE_PATH)
+
+# suffixes of the compared metrics, and of those where a higher value is better (every
+# other metric regresses when it grows)
+METRIC_SUFFIXES = ("_ms", "_seconds", "_per_second", "_mb")
+HIGHER_IS_BETTER = ("_per_second",)
+
+
+class LatencyStats(TypedDict):
+    count: int
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+def latency_stats(seconds: list[float]) -> LatencyStats:
+    """
+    Summarize the latencies of repeated operations.
+
+    Args:
+        seconds (list[float]): The duration of every operation, in seconds.
+
+    Returns:
+        LatencyStats: The number of operations and their mean, median, 95th and 99th
+                      percentile and maximum latency, in milliseconds.
+    """
+    if not seconds:
+        return {
+            "count": 0,
+            "mean_ms": 0.0,
+            "p50_ms": 0.0,
+            "p95_ms": 0.0,
+            "p99_ms": 0.0,
+            "max_ms": 0.0,
+        }
+
+    ms = np.array(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    """
+    Get the peak resident set size of this process so far.
+
+    Returns:
+        float: The peak RSS in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kibibytes, macos bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def time_calls(
+    call: Callable[[Any], Any], inputs: list[Any], quiet: bool = True
+) -> list[float]:
+    """
+    Time a function over a list of inputs, one call per input.
+
+    Args:
+        call (Callable[[Any], Any]): The function to time.
+        inputs (list[Any]): The argument of every call.
+        quiet (bool, optional): Discard what the function prints. Defaults to True.
+
+    Returns:
+        list[float]: The duration of every call, in seconds.
+    """
+    timings: list[float] = []
+    for value in inputs:
+        with quiet_stdout(quiet):
+            started = time.perf_counter()
+            call(value)
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+@contextlib.contextmanager
+def quiet_stdout(quiet: bool = True) -> Iterator[None]:
+    """
+    Discard everything printed inside the block, e.g. progress output of timed code.
+
+    Args:
+        quiet (bool, optional): Whether to discard the output. Defaults to True.
+    """
+    if not quiet:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def stub_server(latency_ms: float = 0, token_latency_ms: float = 0) -> Iterator[str]:
+    """
+    Run the OpenAI-compatible stub server and point the OpenAI clients at it.
+
+    The server listens on a free local port, and ``OPENAI_BASE_URL`` and
+    ``OPENAI_API_KEY`` are set for the duration of the block. Clients read them when
+    they are created, so modules creating clients at import time must be imported
+    inside the block.
+
+    Args:
+        latency_ms (float, optional): Delay added to every request. Defaults to 0.
+        token_latency_ms (float, optional): Delay per streamed chat token. Defaults
+                                            to 0.
+
+    Yields:
+        str: The base url of the server.
+
+    Raises:
+        RuntimeError: If the server does not start.
+    """
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            STUB_PATH,
+            "--port",
+            "0",
+            "--latency-ms",
+            str(latency_ms),
+            "--token-latency-ms",
+            str(token_latency_ms),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    previous = {
+        name: os.environ.get(name) for name in ("OPENAI_BASE_URL", "OPENAI_API_KEY")
+    }
+    try:
+        # the server announces its address once it is bound
+        line = process.stdout.readline() if process.stdout else ""
+        if "http://" not in line:
+            raise RuntimeError(f"The stub server did not start: {line!r}")
+        base_url = line[line.index("http://") :].strip()
+        os.environ["OPENAI_BASE_URL"] = base_url
+        os.environ["OPENAI_API_KEY"] = "stub"
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def make_report(name: str, config: dict[str, Any], stages: dict[str, Any]) -> dict:
+    """
+    Assemble the results of a benchmark run into a JSON serializable report.
+
+    Args:
+        name (str): The benchmark name.
+        config (dict[str, Any]): The settings of the run.
+        stages (dict[str, Any]): The metrics of every benchmarked stage.
+
+    Returns:
+        dict: The report, with the run time, python and platform versions, and the
+              peak RSS of the whole run.
+    """
+    return {
+        "benchmark": name,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def save_report(report: dict, path: str) -> None:
+    """
+    Write a benchmark report as JSON.
+
+    Args:
+        report (dict): The report, see ``make_report``.
+        path (str): The output file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+def compare_reports(report: dict, baseline: dict, tolerance: float = 0.2) -> list[str]:
+    """
+    Find the metrics of a report that regressed against a baseline report.
+
+    Metrics are the numbers whose name ends in one of ``METRIC_SUFFIXES``. Throughput
+    metrics (``HIGHER_IS_BETTER``) regress when they drop, every other metric
+    (latencies, durations, memory) when it grows, by more than the tolerance.
+
+    Args:
+        report (dict): The current report.
+        baseline (dict): A report of an earlier run with the same configuration.
+        tolerance (float, optional): Allowed relative change. Defaults to 0.2 (20%).
+
+    Returns:
+        list[str]: A description of every regressed metric, empty if none regressed.
+
+    Example:
+        >>> compare_reports(report, baseline)
+        ['query.latency.p95_ms: 12.1 -> 19.8 (+63.6%)']
+    """
+
+    def flatten(values: dict, prefix: str = "") -> dict[str, float]:
+        metrics: dict[str, float] = {}
+        for key, value in values.items():
+            if isinstance(value, dict):
+                metrics.update(flatten(value, f"{prefix}{key}."))
+            elif isinstance(value, (int, float)) and key.endswith(METRIC_SUFFIXES):
+                metrics[f"{prefix}{key}"] = value
+        return metrics
+
+    current = flatten(report["stages"]) | {"peak_rss_mb": report["peak_rss_mb"]}
+    previous = flatten(baseline["stages"]) | {"peak_rss_mb": baseline["peak_rss_mb"]}
+
+    regressions: list[str] = []
+    for metric, value in current.items():
+        before = previous.get(metric)
+        if not before:
+            continue
+        change = (value - before) / before
+        if metric.endswith(HIGHER_IS_BETTER):
+            change = -change
+        if change > tolerance:
+            regressions.append(
+                f"{metric}: {before} -> {value} ({(value - before) / before:+.1%})"
+            )
+    return regressions
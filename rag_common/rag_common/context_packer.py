@@ -0,0 +1,233 @@
+from functools import lru_cache
+from rag_common.lexical_index import tokenize
+from typing import Callable, Sequence, TypedDict
+import numpy as np
+import re
+import tiktoken
+
+
+# encoding of the gpt-4o and gpt-4.1 models, which older tiktoken releases cannot map
+DEFAULT_ENCODING = "o200k_base"
+# relevance weight of maximal marginal relevance, the rest penalizes redundancy
+DEFAULT_MMR_LAMBDA = 0.7
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+class PackedContext(TypedDict):
+    chunks: list[str]
+    tokens: int
+    candidates: int
+    candidate_tokens: int
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Get the tokenizer of a chat model, loading it only once per process.
+
+    Args:
+        model (str): The model name, e.g. "gpt-4.1-nano".
+
+    Returns:
+        tiktoken.Encoding: The model's encoding, or ``DEFAULT_ENCODING`` for models
+                           tiktoken does not know.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str, model: str = "gpt-4.1-nano") -> int:
+    """
+    Count the tokens of a text, remembering the counts of recent texts.
+
+    Retrieved chunks repeat across questions, so most counts are served from the cache.
+
+    Args:
+        text (str): The text to measure.
+        model (str, optional): The model whose tokenizer is used. Defaults to
+                               "gpt-4.1-nano".
+
+    Returns:
+        int: The number of tokens.
+    """
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def drop_sentences(text: str, query: str, threshold: float) -> str:
+    """
+    Remove the sentences of a chunk that share few terms with the query.
+
+    Every sentence is scored by the number of distinct query terms it contains, and the
+    sentences scoring below ``threshold`` times the best sentence of the chunk are
+    dropped. The score is lexical, so trimming costs no embedding calls.
+
+    Args:
+        text (str): The chunk text.
+        query (str): The question the context is packed for.
+        threshold (float): Fraction of the best sentence score a sentence needs to be
+                           kept, between 0 (keep all) and 1 (keep the best ones only).
+
+    Returns:
+        str: The kept sentences in their original order, or the text unchanged if no
+             sentence shares a term with the query.
+
+    Example:
+        >>> drop_sentences("Revenue grew 7%. The office moved. Azure revenue grew 27%.",
+        ...                "How did revenue grow?", 0.5)
+        'Revenue grew 7%. Azure revenue grew 27%.'
+    """
+    terms = set(tokenize(query))
+    sentences = SENTENCE_BOUNDARY.split(text.strip())
+    scores = [len(terms.intersection(tokenize(sentence))) for sentence in sentences]
+    best = max(scores, default=0)
+    if best == 0:
+        return text
+
+    return " ".join(
+        sentence
+        for sentence, score in zip(sentences, scores)
+        if score >= threshold * best
+    )
+
+
+class ContextPacker:
+    """
+    Select the retrieved chunks that go into a prompt, within a token budget.
+
+    Multi-query and hybrid retrieval hand over many chunks, often near duplicates of each
+    other, and joining all of them inflates the prompt: more input tokens, higher cost
+    and a longer time to first token, with little new information per chunk. The packer
+    keeps the prompt small with maximal marginal relevance (MMR): it repeatedly picks the
+    chunk maximizing
+
+        mmr_lambda * sim(query, chunk) - (1 - mmr_lambda) * max sim(chunk, picked chunk)
+
+    so every pick is relevant to the question and unlike the chunks already picked, and
+    it stops adding chunks once the budget is spent (chunks that do not fit are skipped
+    in favour of smaller ones). Optionally, the sentences of a chunk sharing few terms
+    with the question are dropped first (see ``drop_sentences``).
+
+    Similarities are cosine similarities between embeddings. The chunks were embedded at
+    ingestion, so with the cached embedding function of the vector store they are
+    served from the embedding cache and packing makes no embedding calls for them.
+
+    Attributes:
+        embed (Callable[[list[str]], Sequence[Sequence[float]]]): Function embedding a
+            list of texts in one call, e.g. the ``ef`` of the vector store.
+        budget (int): Maximum number of chunk tokens in the packed context.
+        mmr_lambda (float): Relevance weight, 1 ranks by relevance only and lower values
+            favour diversity.
+        sentence_threshold (float | None): Sentence score fraction a sentence needs to be
+            kept, None to keep chunks whole.
+        model (str): The chat model whose tokenizer measures the chunks.
+
+    Example:
+        >>> packer = ContextPacker(db.ef, budget=1500)
+        >>> packed = packer.pack(question, retrieved_chunks)
+        >>> print(f"{packed['tokens']} of {packed['candidate_tokens']} tokens")
+        >>> stream = stream_response_with_context(question, packed["chunks"])
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[list[str]], Sequence[Sequence[float]]],
+        budget: int = 2000,
+        mmr_lambda: float = DEFAULT_MMR_LAMBDA,
+        sentence_threshold: float | None = None,
+        model: str = "gpt-4.1-nano",
+    ) -> None:
+        """
+        Initialize the packer.
+
+        Args:
+            embed (Callable[[list[str]], Sequence[Sequence[float]]]): Function embedding
+                a list of texts in one call.
+            budget (int, optional): Maximum number of chunk tokens in the packed context.
+                                    Defaults to 2000.
+            mmr_lambda (float, optional): Relevance weight between 0 and 1. Defaults to
+                                          0.7.
+            sentence_threshold (float | None, optional): Drop the sentences of a chunk
+                                                         scoring below this fraction of
+                                                         its best sentence. Defaults to
+                                                         None (keep chunks whole).
+            model (str, optional): The chat model whose tokenizer measures the chunks.
+                                   Defaults to "gpt-4.1-nano".
+
+        Raises:
+            ValueError: If the budget is not positive or ``mmr_lambda`` is not between
+                        0 and 1.
+        """
+        if budget < 1:
+            raise ValueError("budget must be at least 1")
+        if not 0 <= mmr_lambda <= 1:
+            raise ValueError("mmr_lambda must be between 0 and 1")
+
+        self.embed = embed
+        self.budget = budget
+        self.mmr_lambda = mmr_lambda
+        self.sentence_threshold = sentence_threshold
+        self.model = model
+
+    def pack(self, query: str, chunks: Sequence[str]) -> PackedContext:
+        """
+        Pick the chunks to answer a question from, best first, within the budget.
+
+        Args:
+            query (str): The question the context is packed for.
+            chunks (Sequence[str]): The retrieved chunks, in any order. Repeated chunks
+                                    are considered once.
+
+        Returns:
+            PackedContext: The picked (and possibly trimmed) chunks in pick order, their
+                           token count, and the number of candidate chunks and their
+                           token count, to report the savings.
+        """
+        candidates = list(dict.fromkeys(chunk for chunk in chunks if chunk.strip()))
+        if not candidates:
+            return {"chunks": [], "tokens": 0, "candidates": 0, "candidate_tokens": 0}
+
+        texts = candidates
+        if self.sentence_threshold is not None:
+            texts = [
+                drop_sentences(chunk, query, self.sentence_threshold)
+                for chunk in candidates
+            ]
+        costs = np.array([count_tokens(text, self.model) for text in texts])
+
+        # the untrimmed chunks are embedded, their embeddings are in the cache
+        matrix = np.array(self.embed([query] + candidates), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        matrix /= norms
+        relevance = matrix[1:] @ matrix[0]
+        similarity = matrix[1:] @ matrix[1:].T
+
+        picked: list[int] = []
+        tokens = 0
+        # similarity of every chunk to its closest picked chunk, -1 before the first pick
+        redundancy = np.full(len(candidates), -1.0, dtype=np.float32)
+        available = np.ones(len(candidates), dtype=bool)
+        while available.any():
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            available[best] = False
+            if tokens + costs[best] > self.budget:
+                continue
+
+            picked.append(best)
+            tokens += int(costs[best])
+            redundancy = np.maximum(redundancy, similarity[best])
+
+        return {
+            "chunks": [texts[i] for i in picked],
+            "tokens": tokens,
+            "candidates": len(candidates),
+            "candidate_tokens": sum(
+                count_tokens(chunk, self.model) for chunk in candidates
+            ),
+        }
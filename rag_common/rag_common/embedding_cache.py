@@ -0,0 +1,300 @@
+from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+from chromadb.api.types import Documents, Embeddings
+from array import array
+from typing import Callable, Sequence, cast
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_CACHE_PATH = "./embedding_cache.sqlite"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class EmbeddingCache:
+    """
+    A persistent, content-addressed cache of embedding vectors backed by SQLite.
+
+    Every vector is keyed by a hash of the embedding model, the requested dimensionality
+    and the exact input text, so identical text is only ever embedded once per model,
+    no matter which document, run or package it comes from. Vectors are stored as
+    packed float32 blobs. When the summed size of the stored vectors exceeds the
+    configured limit, the least recently used entries are evicted.
+
+    The cache file location can be shared between projects through the
+    ``EMBEDDING_CACHE_PATH`` environment variable.
+
+    Attributes:
+        path (str): Location of the SQLite database file.
+        max_bytes (int): Upper bound on the summed size of stored vectors.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that had to be embedded.
+
+    Example:
+        >>> cache = EmbeddingCache()
+        >>> vectors = cache.embed("text-embedding-3-small", None, ["hello"], fetch)
+        >>> print(cache.stats())  # {"hits": 0, "misses": 1, ...}
+    """
+
+    def __init__(
+        self, path: str | None = None, max_bytes: int = DEFAULT_MAX_BYTES
+    ) -> None:
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path (str | None, optional): Path to the SQLite file. Defaults to the
+                                         ``EMBEDDING_CACHE_PATH`` environment variable
+                                         or "./embedding_cache.sqlite".
+            max_bytes (int, optional): Maximum summed vector size before LRU eviction
+                                       kicks in. Defaults to 1 GiB.
+        """
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH") or DEFAULT_CACHE_PATH
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        # the connection is shared between threads, so serialize access to it
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(model: str, dimensions: int | None, text: str) -> str:
+        """
+        Compute the content address of a text for a given model configuration.
+
+        Args:
+            model (str): The embedding model name.
+            dimensions (int | None): The requested output dimensionality, or None
+                                     for the model's default.
+            text (str): The exact text that is embedded.
+
+        Returns:
+            str: A hex sha256 digest identifying the (model, dimensions, text) triple.
+        """
+        return hashlib.sha256(
+            f"{model}\0{dimensions or ''}\0{text}".encode("utf-8")
+        ).hexdigest()
+
+    def get_many(
+        self, model: str, dimensions: int | None, texts: Sequence[str]
+    ) -> list[list[float] | None]:
+        """
+        Look up cached vectors for a batch of texts.
+
+        Args:
+            model (str): The embedding model name.
+            dimensions (int | None): The requested output dimensionality.
+            texts (Sequence[str]): The texts to look up.
+
+        Returns:
+            list[list[float] | None]: One entry per text, None where the text is not cached.
+        """
+        keys = [self.key(model, dimensions, text) for text in texts]
+        found: dict[str, list[float]] = {}
+
+        with self._lock:
+            # sqlite caps the number of bound parameters, so look keys up in slices
+            for start in range(0, len(keys), 500):
+                window = keys[start : start + 500]
+                placeholders = ",".join("?" * len(window))
+                for key, blob in self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    window,
+                ):
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            # refresh the recency of every hit so eviction keeps hot vectors around
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+            self._conn.commit()
+
+        results = [found.get(key) for key in keys]
+        n_hits = sum(result is not None for result in results)
+        self.hits += n_hits
+        self.misses += len(results) - n_hits
+        return results
+
+    def put_many(
+        self,
+        model: str,
+        dimensions: int | None,
+        texts: Sequence[str],
+        vectors: Sequence[Sequence[float]],
+    ) -> None:
+        """
+        Store vectors for a batch of texts, evicting old entries if over the size limit.
+
+        Args:
+            model (str): The embedding model name.
+            dimensions (int | None): The requested output dimensionality.
+            texts (Sequence[str]): The texts that were embedded.
+            vectors (Sequence[Sequence[float]]): The embedding of each text, in order.
+        """
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = array("f", vector).tobytes()
+            rows.append((self.key(model, dimensions, text), blob, len(blob), now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, nbytes, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.__evict()
+            self._conn.commit()
+
+    def embed(
+        self,
+        model: str,
+        dimensions: int | None,
+        texts: Sequence[str],
+        fetch: Callable[[list[str]], Sequence[Sequence[float]]],
+    ) -> list[list[float]]:
+        """
+        Return embeddings for all texts, calling ``fetch`` only for the uncached ones.
+
+        Args:
+            model (str): The embedding model name.
+            dimensions (int | None): The requested output dimensionality.
+            texts (Sequence[str]): The texts to embed.
+            fetch (Callable[[list[str]], Sequence[Sequence[float]]]): Function that
+                embeds a list of texts, e.g. a single embeddings api request. It is
+                not called at all when every text is cached.
+
+        Returns:
+            list[list[float]]: One embedding vector per input text, in input order.
+        """
+        vectors = self.get_many(model, dimensions, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            fetched = fetch(missing_texts)
+            self.put_many(model, dimensions, missing_texts, fetched)
+            for i, vector in zip(missing, fetched):
+                # fetched vectors may hold numpy scalars, store them as plain floats
+                vectors[i] = [float(value) for value in vector]
+
+        return cast(list[list[float]], vectors)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Report cache effectiveness and size.
+
+        Returns:
+            dict[str, int]: Hit and miss counters plus the number of stored entries
+                            and their summed size in bytes.
+        """
+        with self._lock:
+            entries, nbytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM embeddings"
+            ).fetchone()
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": nbytes,
+        }
+
+    def __evict(self) -> None:
+        """
+        Delete least recently used entries until the cache fits within max_bytes.
+
+        Must be called with the lock held.
+        """
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(nbytes), 0) FROM embeddings"
+        ).fetchone()
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+
+        stale: list[tuple[str]] = []
+        for key, nbytes in self._conn.execute(
+            "SELECT key, nbytes FROM embeddings ORDER BY last_used ASC"
+        ):
+            stale.append((key,))
+            excess -= nbytes
+            if excess <= 0:
+                break
+
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", stale)
+
+
+class CachedOpenAIEmbeddingFunction(OpenAIEmbeddingFunction):
+    """
+    Drop-in replacement for Chroma's OpenAIEmbeddingFunction that consults an EmbeddingCache.
+
+    Only texts missing from the cache are sent to the OpenAI api, either through the
+    parent's client or through a custom ``fetch`` function such as
+    ``EmbeddingEngine.embed``. The class keeps the parent's name and config, so
+    collections created with it remain compatible with the plain OpenAIEmbeddingFunction.
+    """
+
+    def __init__(
+        self,
+        *args,
+        cache: EmbeddingCache | None = None,
+        fetch: Callable[[list[str]], Sequence[Sequence[float]]] | None = None,
+        **kwargs,
+    ) -> None:
+        """
+        Initialize the embedding function.
+
+        Args:
+            *args: Positional arguments forwarded to OpenAIEmbeddingFunction.
+            cache (EmbeddingCache | None, optional): The cache to use. Defaults to a
+                                                     new EmbeddingCache at the default path.
+            fetch (Callable[[list[str]], Sequence[Sequence[float]]] | None, optional):
+                Function embedding the uncached texts. It must use the same model and
+                dimensions. Defaults to None (a direct request with the parent's client).
+            **kwargs: Keyword arguments forwarded to OpenAIEmbeddingFunction.
+        """
+        super().__init__(*args, **kwargs)
+        self.cache = cache or EmbeddingCache()
+        self.fetch = fetch
+
+    def __call__(self, input: Documents) -> Embeddings:
+        """
+        Generate embeddings for the given documents, reusing cached vectors.
+
+        Args:
+            input (Documents): Documents to generate embeddings for.
+
+        Returns:
+            Embeddings: One vector per document, in input order. Chroma converts them
+                        to float32 arrays when validating the result.
+        """
+        vectors = self.cache.embed(
+            self.model_name,
+            self.dimensions,
+            list(input),
+            self.fetch or super().__call__,
+        )
+        return cast(Embeddings, vectors)
@@ -0,0 +1,391 @@
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    RateLimitError,
+)
+from rag_common.tracing import estimate_cost, tracer
+from typing import Coroutine, TypeVar
+import asyncio
+import random
+import threading
+import time
+import tiktoken
+
+
+T = TypeVar("T")
+
+# per-request limits of the embeddings endpoint
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300_000
+
+# native output dimensionality of the embedding models; the text-embedding-3 models are
+# trained so that a renormalized prefix of a vector is a usable embedding on its own,
+# and return such a prefix when asked for fewer ``dimensions``
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+class TokenBucket:
+    """
+    An asyncio token bucket enforcing a per-minute budget.
+
+    The bucket holds up to one minute's worth of budget and refills continuously. A
+    caller asking for more than is currently available waits until enough has been
+    refilled. Requests larger than the whole capacity are let through once the bucket
+    is full, driving it negative so the following callers wait for the debt to clear.
+
+    Attributes:
+        rate_per_minute (float): Budget refilled per minute, e.g. requests or tokens.
+        capacity (float): Maximum amount the bucket can hold.
+    """
+
+    def __init__(self, rate_per_minute: float) -> None:
+        """
+        Initialize a full bucket.
+
+        Args:
+            rate_per_minute (float): Budget refilled per minute.
+        """
+        self.rate_per_minute = rate_per_minute
+        self.capacity = rate_per_minute
+        self._level = rate_per_minute
+        self._updated = time.monotonic()
+        self._lock: asyncio.Lock | None = None
+
+    async def acquire(self, amount: float = 1) -> None:
+        """
+        Wait until ``amount`` can be taken from the bucket, then take it.
+
+        Args:
+            amount (float, optional): The budget to consume. Defaults to 1.
+        """
+        # the lock is created lazily so it binds to the loop the bucket is used on
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # callers are served one at a time, in arrival order
+        async with self._lock:
+            needed = min(amount, self.capacity)
+            while True:
+                now = time.monotonic()
+                self._level = min(
+                    self.capacity,
+                    self._level + (now - self._updated) * self.rate_per_minute / 60,
+                )
+                self._updated = now
+                if self._level >= needed:
+                    self._level -= amount
+                    return
+                await asyncio.sleep((needed - self._level) * 60 / self.rate_per_minute)
+
+
+class EmbeddingEngine:
+    """
+    A concurrent, rate-limit-aware client for the OpenAI embeddings endpoint.
+
+    Requests are issued with AsyncOpenAI, at most ``max_concurrency`` at a time, and pass
+    through two token buckets enforcing the requests-per-minute and tokens-per-minute
+    limits of the account. Rate limit (429), server (5xx), timeout and connection errors
+    are retried with jittered exponential backoff, honouring the server's Retry-After
+    header when present.
+
+    The engine owns an event loop running in a background thread, so synchronous code
+    (including several threads at once) can use it through ``embed`` and ``embed_many``.
+    Async code can await ``aembed`` and ``aembed_many`` directly, as long as a given
+    engine is only ever used from one event loop.
+
+    Attributes:
+        model (str): The embedding model name.
+        dimensions (int | None): Requested output dimensionality, None for the default.
+        max_concurrency (int): Maximum number of requests in flight.
+        max_retries (int): Maximum number of retries per request.
+        requests (int): Number of requests sent, including retries.
+        retries (int): Number of retried requests.
+        rate_limited (int): Number of 429 responses received.
+
+    Example:
+        >>> engine = EmbeddingEngine(max_concurrency=4, requests_per_minute=500)
+        >>> vectors = engine.embed(["first text", "second text"])
+        >>> batches = engine.embed_many([["a", "b"], ["c"]])  # sent concurrently
+    """
+
+    def __init__(
+        self,
+        model: str = "text-embedding-3-small",
+        dimensions: int | None = None,
+        api_key: str | None = None,
+        max_concurrency: int = 8,
+        requests_per_minute: float = 3_000,
+        tokens_per_minute: float = 1_000_000,
+        max_retries: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ) -> None:
+        """
+        Initialize the engine.
+
+        Args:
+            model (str, optional): The embedding model name. Defaults to "text-embedding-3-small".
+            dimensions (int | None, optional): Requested output dimensionality. Defaults to None.
+            api_key (str | None, optional): OpenAI api key. Defaults to None, in which case
+                                            the client reads OPENAI_API_KEY. The endpoint
+                                            can be redirected with OPENAI_BASE_URL.
+            max_concurrency (int, optional): Maximum number of requests in flight. Defaults to 8.
+            requests_per_minute (float, optional): Request rate limit. Defaults to 3000.
+            tokens_per_minute (float, optional): Token rate limit. Defaults to 1,000,000.
+            max_retries (int, optional): Retries per request before giving up. Defaults to 6.
+            base_delay (float, optional): Backoff delay before the first retry, in seconds.
+                                          Defaults to 0.5.
+            max_delay (float, optional): Upper bound on any backoff delay, in seconds.
+                                         Defaults to 30.
+        """
+        self.model = model
+        self.dimensions = dimensions
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+        # retries are handled here, with rate limit awareness, not by the client
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.encoding = tiktoken.encoding_for_model(model)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_lock = threading.Lock()
+        self._semaphore: asyncio.Semaphore | None = None
+
+    @property
+    def output_dimensions(self) -> int | None:
+        """
+        The length of the returned vectors, None if the model is not known.
+        """
+        return self.dimensions or MODEL_DIMENSIONS.get(self.model)
+
+    async def aembed(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed texts, splitting them into as few requests as the endpoint limits allow.
+
+        The requests are sent concurrently, each one rate limited and retried.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: One embedding vector per input text, in input order.
+
+        Raises:
+            openai.APIError: If a request still fails after all retries, or fails with
+                             an error that is not worth retrying.
+        """
+        token_counts = [
+            len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts)
+        ]
+
+        # pack consecutive texts greedily within the per-request limits
+        requests: list[tuple[int, int, int]] = []
+        start = 0
+        batch_tokens = 0
+        for i, n_tokens in enumerate(token_counts):
+            if i > start and (
+                i - start == MAX_BATCH_INPUTS
+                or batch_tokens + n_tokens > MAX_BATCH_TOKENS
+            ):
+                requests.append((start, i, batch_tokens))
+                start, batch_tokens = i, 0
+            batch_tokens += n_tokens
+        if start < len(texts):
+            requests.append((start, len(texts), batch_tokens))
+
+        with tracer.span(
+            "embed",
+            model=self.model,
+            inputs=len(texts),
+            requests=len(requests),
+            prompt_tokens=sum(token_counts),
+            cost_usd=estimate_cost(self.model, sum(token_counts)),
+        ):
+            results = await asyncio.gather(
+                *(
+                    self.__request(texts[lo:hi], n_tokens)
+                    for lo, hi, n_tokens in requests
+                )
+            )
+        return [embedding for result in results for embedding in result]
+
+    async def __request(self, texts: list[str], n_tokens: int) -> list[list[float]]:
+        """
+        Embed a batch of texts with a single, rate-limited and retried request.
+
+        Args:
+            texts (list[str]): The texts to embed, within the endpoint's request limits.
+            n_tokens (int): Summed token count of the texts, charged to the token bucket.
+
+        Returns:
+            list[list[float]]: One embedding vector per input text, in input order.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        for attempt in range(self.max_retries + 1):
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(n_tokens)
+
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    if self.dimensions is None:
+                        response = await self.client.embeddings.create(
+                            input=texts, model=self.model
+                        )
+                    else:
+                        response = await self.client.embeddings.create(
+                            input=texts, model=self.model, dimensions=self.dimensions
+                        )
+            except (APIStatusError, APIConnectionError) as e:
+                if isinstance(e, RateLimitError):
+                    self.rate_limited += 1
+                if attempt == self.max_retries or not self.__is_retryable(e):
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.__backoff_delay(attempt, e))
+                continue
+
+            # map results back by the index the api tags every embedding with
+            embeddings: list[list[float]] = [[] for _ in texts]
+            for data in response.data:
+                embeddings[data.index] = data.embedding
+            return embeddings
+
+        raise AssertionError("unreachable")
+
+    async def aembed_many(self, batches: list[list[str]]) -> list[list[list[float]]]:
+        """
+        Embed several batches concurrently, within the concurrency and rate limits.
+
+        Args:
+            batches (list[list[str]]): The batches to embed, one request each unless a
+                                       batch exceeds the endpoint's request limits.
+
+        Returns:
+            list[list[list[float]]]: The embeddings of every batch, in batch order.
+        """
+        return list(await asyncio.gather(*(self.aembed(batch) for batch in batches)))
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """
+        Synchronous facade for ``aembed``.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: One embedding vector per input text, in input order.
+        """
+        return self.__run(self.aembed(texts))
+
+    def embed_many(self, batches: list[list[str]]) -> list[list[list[float]]]:
+        """
+        Synchronous facade for ``aembed_many``.
+
+        Args:
+            batches (list[list[str]]): The batches to embed, one request each unless a
+                                       batch exceeds the endpoint's request limits.
+
+        Returns:
+            list[list[list[float]]]: The embeddings of every batch, in batch order.
+        """
+        return self.__run(self.aembed_many(batches))
+
+    def stats(self) -> dict[str, int]:
+        """
+        Report request, retry and rate limit counters.
+
+        Returns:
+            dict[str, int]: The counters collected since the engine was created.
+        """
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+        }
+
+    def __run(self, coroutine: Coroutine[None, None, T]) -> T:
+        """
+        Run a coroutine on the engine's background loop and wait for its result.
+
+        Args:
+            coroutine (Coroutine[None, None, T]): The coroutine to run.
+
+        Returns:
+            T: The coroutine's result.
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def __is_retryable(self, error: Exception) -> bool:
+        """
+        Decide whether a failed request is worth retrying.
+
+        Args:
+            error (Exception): The error raised by the client.
+
+        Returns:
+            bool: True for rate limits, server errors, timeouts and connection errors.
+        """
+        if isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError)):
+            return True
+        return isinstance(error, APIStatusError) and error.status_code >= 500
+
+    def __backoff_delay(self, attempt: int, error: Exception) -> float:
+        """
+        Compute how long to wait before the next attempt.
+
+        Uses "full jitter" exponential backoff so that concurrent requests hitting the
+        same limit do not retry in lockstep, but never waits less than the server asked
+        for in a Retry-After header.
+
+        Args:
+            attempt (int): Zero-based number of the attempt that failed.
+            error (Exception): The error raised by the client.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+        if isinstance(error, APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                delay = max(delay, min(self.max_delay, float(retry_after or 0)))
+            except ValueError:
+                pass
+
+        return delay
+
+
+if __name__ == "__main__":
+    # quick load test, e.g. against tools/openai_stub.py via OPENAI_BASE_URL
+    engine = EmbeddingEngine(max_concurrency=16)
+    texts = [f"sample text number {i}" for i in range(2_000)]
+    batches = [texts[i : i + 100] for i in range(0, len(texts), 100)]
+
+    started = time.perf_counter()
+    results = engine.embed_many(batches)
+    elapsed = time.perf_counter() - started
+
+    print(f"Embedded {sum(len(batch) for batch in results)} texts in {elapsed:.2f}s")
+    print(engine.stats())
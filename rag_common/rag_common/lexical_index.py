@@ -0,0 +1,351 @@
+from typing import Iterable, Sequence
+import json
+import numpy as np
+import os
+import re
+import threading
+
+
+# bm25 term frequency saturation and document length normalization, the usual defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# words too common to tell chunks apart, left out of the postings
+STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have how in is it its "
+    "of on or that the their there these this to was were what when where which who "
+    "why will with".split()
+)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split text into the lowercase terms the lexical index is built from.
+
+    Words and numbers are kept whole ("FY23" becomes "fy23"), so entity names and
+    figures can be matched exactly; stopwords are dropped.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list[str]: The terms, in text order.
+
+    Example:
+        >>> tokenize("What was the FY23 revenue of Slack?")
+        ['fy23', 'revenue', 'slack']
+    """
+    return [
+        term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS
+    ]
+
+
+class LexicalIndex:
+    """
+    An inverted index ranking chunks by BM25.
+
+    Every term of the vocabulary owns a postings list: the positions of the chunks that
+    contain it and how often they do. The lists are stored back to back in two flat
+    arrays (int32 positions, uint16 term frequencies) sliced by a per-term offsets array,
+    so the index takes a few bytes per distinct term of every chunk and a query only
+    touches the postings of its own terms.
+
+    Writes are buffered: added chunks are appended as pending postings and replaced or
+    deleted chunks are only marked, and the arrays are rebuilt once, by the next search
+    or save. Ingesting in batches therefore costs one rebuild, not one per batch.
+
+    The index persists to ``<path>.npz`` (the arrays) and ``<path>.json`` (chunk IDs and
+    vocabulary). All methods are thread-safe.
+
+    Attributes:
+        path (str | None): Path prefix of the index files, None for an in-memory index.
+        k1 (float): BM25 term frequency saturation.
+        b (float): BM25 document length normalization.
+
+    Example:
+        >>> index = LexicalIndex("./chroma/docs.lexical")
+        >>> index.add(["a", "b"], ["Slack revenue grew", "Teams usage grew"])
+        >>> index.save()
+        >>> index.search("slack revenue", k=5)
+        [('a', 0.98...)]
+    """
+
+    def __init__(
+        self, path: str | None = None, k1: float = BM25_K1, b: float = BM25_B
+    ) -> None:
+        """
+        Open the index stored at ``path``, or create an empty one.
+
+        An index whose files do not belong together (e.g. after a crash between their
+        writes) is opened empty, to be rebuilt by its owner.
+
+        Args:
+            path (str | None, optional): Path prefix of the index files. Defaults to None
+                                         (an in-memory index that cannot be saved).
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.2.
+            b (float, optional): BM25 document length normalization. Defaults to 0.75.
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self.__reset()
+
+        if path is not None and os.path.exists(f"{path}.json"):
+            with open(f"{path}.json", encoding="utf-8") as f:
+                sidecar = json.load(f)
+            with np.load(f"{path}.npz") as arrays:
+                offsets = arrays["offsets"]
+                lengths = arrays["lengths"]
+                matching = len(lengths) == len(sidecar["ids"])
+                if matching and len(offsets) == len(sidecar["terms"]) + 1:
+                    self._ids = sidecar["ids"]
+                    self._terms = {term: i for i, term in enumerate(sidecar["terms"])}
+                    self._offsets = offsets
+                    self._docs = arrays["docs"]
+                    self._tfs = arrays["tfs"]
+                    self._lengths = lengths
+                    self._alive = np.ones(len(lengths), dtype=bool)
+            self._positions = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory taken by the postings arrays, in bytes.
+        """
+        with self._lock:
+            self.__compact()
+            return (
+                self._offsets.nbytes
+                + self._docs.nbytes
+                + self._tfs.nbytes
+                + self._lengths.nbytes
+            )
+
+    def add(self, ids: Sequence[str], texts: Sequence[str]) -> None:
+        """
+        Index chunks, replacing the ones already stored under the same IDs.
+
+        Args:
+            ids (Sequence[str]): The chunk IDs.
+            texts (Sequence[str]): The text of every chunk.
+        """
+        # the last text of a repeated id wins, like an upsert
+        latest = dict(zip(ids, texts))
+        if not latest:
+            return
+
+        with self._lock:
+            self.__mark_deleted(latest)
+            first = len(self._ids)
+            vocabulary = self._terms
+            tokens: list[int] = []
+            lengths: list[int] = []
+            for chunk_id, text in latest.items():
+                self._positions[chunk_id] = len(self._ids)
+                self._ids.append(chunk_id)
+                terms = [
+                    vocabulary.setdefault(term, len(vocabulary))
+                    for term in tokenize(text)
+                ]
+                tokens.extend(terms)
+                lengths.append(len(terms))
+
+            # count every (chunk, term) pair at once instead of per chunk in python
+            docs = np.repeat(np.arange(first, len(self._ids), dtype=np.int64), lengths)
+            pairs, tfs = np.unique(
+                docs * len(vocabulary) + np.array(tokens, dtype=np.int64),
+                return_counts=True,
+            )
+            self._pending.append(
+                (
+                    (pairs % len(vocabulary)).astype(np.int32),
+                    (pairs // len(vocabulary)).astype(np.int32),
+                    np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16),
+                )
+            )
+            self._lengths = np.concatenate(
+                [self._lengths, np.array(lengths, dtype=np.int32)]
+            )
+            self._alive = np.concatenate([self._alive, np.ones(len(latest), bool)])
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """
+        Remove chunks from the index.
+
+        Args:
+            ids (Iterable[str]): The chunk IDs. IDs that are not indexed are ignored.
+
+        Returns:
+            int: The number of removed chunks.
+        """
+        with self._lock:
+            return self.__mark_deleted(ids)
+
+    def clear(self) -> None:
+        """
+        Remove every chunk from the index.
+        """
+        with self._lock:
+            self.__reset()
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """
+        Rank the chunks containing the terms of a query by BM25.
+
+        Args:
+            query (str): The query text.
+            k (int): Number of chunks to return.
+
+        Returns:
+            list[tuple[str, float]]: Up to k (chunk ID, score) pairs, best first. Chunks
+                                     sharing no term with the query are never returned.
+        """
+        with self._lock:
+            self.__compact()
+            n_docs = len(self._ids)
+            terms = [
+                self._terms[term]
+                for term in dict.fromkeys(tokenize(query))
+                if term in self._terms
+            ]
+            if not n_docs or not terms or k <= 0:
+                return []
+
+            scores = np.zeros(n_docs, dtype=np.float32)
+            for term in terms:
+                start, end = self._offsets[term], self._offsets[term + 1]
+                docs = self._docs[start:end]
+                tfs = self._tfs[start:end].astype(np.float32)
+                df = end - start
+                idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+                # a chunk appears once in a postings list, so the fancy += is safe
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self._norms[docs])
+
+            matched = np.flatnonzero(scores)
+            k = min(k, len(matched))
+            top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(self._ids[i], float(scores[i])) for i in top]
+
+    def candidates(self, queries: Sequence[str], k: int) -> list[str]:
+        """
+        Collect the best BM25 matches of several queries, e.g. to prefilter a vector search.
+
+        Args:
+            queries (Sequence[str]): The query texts.
+            k (int): Number of chunks taken per query.
+
+        Returns:
+            list[str]: The union of the top k chunk IDs of every query, in first-seen
+                       order. Empty if no query shares a term with the index.
+        """
+        return list(
+            dict.fromkeys(
+                chunk_id for query in queries for chunk_id, _ in self.search(query, k)
+            )
+        )
+
+    def save(self) -> None:
+        """
+        Persist the index atomically to ``<path>.npz`` and ``<path>.json``.
+
+        Raises:
+            ValueError: If the index has no path.
+        """
+        if self.path is None:
+            raise ValueError("An in-memory index cannot be saved")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            self.__compact()
+            # np.savez appends ".npz" to names without it, so the temporary name keeps it
+            with open(f"{self.path}.tmp.npz", "wb") as f:
+                np.savez(
+                    f,
+                    offsets=self._offsets,
+                    docs=self._docs,
+                    tfs=self._tfs,
+                    lengths=self._lengths,
+                )
+            with open(f"{self.path}.json.tmp", "w", encoding="utf-8") as f:
+                json.dump({"ids": self._ids, "terms": list(self._terms)}, f)
+
+            os.replace(f"{self.path}.tmp.npz", f"{self.path}.npz")
+            os.replace(f"{self.path}.json.tmp", f"{self.path}.json")
+
+    def __reset(self) -> None:
+        # the slot of every indexed chunk, including deleted ones until the next rebuild
+        self._ids: list[str] = []
+        self._positions: dict[str, int] = {}
+        self._terms: dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._docs = np.empty(0, dtype=np.int32)
+        self._tfs = np.empty(0, dtype=np.uint16)
+        self._lengths = np.empty(0, dtype=np.int32)
+        self._alive = np.empty(0, dtype=bool)
+        # postings added since the last rebuild, as (term, doc, tf) arrays
+        self._pending: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._dirty = True
+
+    def __mark_deleted(self, ids: Iterable[str]) -> int:
+        deleted = 0
+        for chunk_id in ids:
+            position = self._positions.pop(chunk_id, None)
+            if position is not None:
+                self._alive[position] = False
+                deleted += 1
+        self._dirty = self._dirty or deleted > 0
+        return deleted
+
+    def __compact(self) -> None:
+        """
+        Merge the pending postings into the arrays and drop deleted chunks and unused terms.
+        """
+        if not self._dirty and not self._pending:
+            return
+
+        counts = np.diff(self._offsets)
+        terms = np.concatenate(
+            [np.repeat(np.arange(len(counts), dtype=np.int32), counts)]
+            + [pending[0] for pending in self._pending]
+        )
+        docs = np.concatenate([self._docs] + [pending[1] for pending in self._pending])
+        tfs = np.concatenate([self._tfs] + [pending[2] for pending in self._pending])
+
+        keep = self._alive[docs]
+        terms, docs, tfs = terms[keep], docs[keep], tfs[keep]
+        # renumber the surviving chunks and terms so both stay dense
+        docs = (np.cumsum(self._alive) - 1)[docs].astype(np.int32)
+        used = np.bincount(terms, minlength=len(self._terms)) > 0
+        terms = (np.cumsum(used) - 1)[terms]
+
+        order = np.lexsort((docs, terms))
+        self._docs = docs[order]
+        self._tfs = tfs[order]
+        self._offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(terms, minlength=int(used.sum())))]
+        ).astype(np.int64)
+        vocabulary = [term for term, is_used in zip(self._terms, used) if is_used]
+        self._terms = {term: i for i, term in enumerate(vocabulary)}
+        self._ids = [
+            chunk_id for chunk_id, alive in zip(self._ids, self._alive) if alive
+        ]
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+        self._lengths = self._lengths[self._alive]
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._pending = []
+        self._dirty = False
+
+        # the length normalization of every chunk, shared by all queries until the
+        # next rebuild
+        lengths = self._lengths.astype(np.float32)
+        average = float(lengths.mean()) if len(lengths) else 1.0
+        self._norms = self.k1 * (1 - self.b + self.b * lengths / max(average, 1.0))
@@ -0,0 +1,238 @@
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Sequence, cast
+import copy
+import hashlib
+import json
+import threading
+
+
+DEFAULT_MAX_EMBEDDINGS = 4096
+DEFAULT_MAX_RESULTS = 1024
+
+
+class QueryCache:
+    """
+    An in-process cache of query embeddings and query results.
+
+    Query embeddings are keyed by the normalized query text (surrounding whitespace
+    stripped and inner whitespace runs collapsed), so a hot question is embedded once per
+    process. Results are keyed by the collection, its version, a hash of the query
+    embeddings, the number of results and every other query argument (``where``,
+    ``where_document``, ``include``), so a repeated query skips the vector search as well.
+
+    Every collection has a version counter that writers bump through ``invalidate``
+    whenever they change the collection's data. The version is part of the result key, so
+    results computed before a write can never be served after it, and the collection's
+    entries are dropped right away to free their memory. Writes made by other processes
+    are not seen, the cache is meant for a single process owning its database.
+
+    Both caches are bounded and evict their least recently used entries. The cache is
+    safe to use from several threads.
+
+    Attributes:
+        max_embeddings (int): Maximum number of cached query embeddings.
+        max_results (int): Maximum number of cached query results.
+        embedding_hits (int): Number of query embeddings served from the cache.
+        embedding_misses (int): Number of query embeddings that had to be computed.
+        result_hits (int): Number of queries answered from the cache.
+        result_misses (int): Number of queries that had to be searched.
+
+    Example:
+        >>> cache = QueryCache()
+        >>> embeddings = cache.embed(["What is revenue?"], embedding_function)
+        >>> key = cache.result_key("docs", embeddings, 5, include=["documents"])
+        >>> results = cache.get_result(key)  # None until put_result(key, ...) was called
+        >>> cache.invalidate("docs")  # after writing to the collection
+    """
+
+    def __init__(
+        self,
+        max_embeddings: int = DEFAULT_MAX_EMBEDDINGS,
+        max_results: int = DEFAULT_MAX_RESULTS,
+    ) -> None:
+        """
+        Initialize empty caches.
+
+        Args:
+            max_embeddings (int, optional): Maximum number of cached query embeddings.
+                                            Defaults to 4096.
+            max_results (int, optional): Maximum number of cached query results.
+                                         Defaults to 1024.
+        """
+        self.max_embeddings = max_embeddings
+        self.max_results = max_results
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+        self.result_hits = 0
+        self.result_misses = 0
+
+        self._lock = threading.Lock()
+        self._embeddings: OrderedDict[str, list[float]] = OrderedDict()
+        self._results: OrderedDict[tuple, Any] = OrderedDict()
+        self._versions: dict[str, int] = {}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        Normalize a query text, so trivially different spellings share their embedding.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            str: The text with surrounding whitespace stripped and inner whitespace runs
+                 collapsed into single spaces.
+        """
+        return " ".join(text.split())
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        fetch: Callable[[list[str]], Sequence[Sequence[float]]],
+    ) -> list[list[float]]:
+        """
+        Return the embeddings of query texts, calling ``fetch`` only for the uncached ones.
+
+        Args:
+            texts (Sequence[str]): The query texts.
+            fetch (Callable[[list[str]], Sequence[Sequence[float]]]): Function embedding
+                a list of (normalized) texts in one call, e.g. the collection's embedding
+                function. It is not called at all when every text is cached.
+
+        Returns:
+            list[list[float]]: One embedding per text, in input order.
+        """
+        normalized = [self.normalize(text) for text in texts]
+        vectors: list[list[float] | None] = []
+
+        with self._lock:
+            for text in normalized:
+                vector = self._embeddings.get(text)
+                if vector is not None:
+                    self._embeddings.move_to_end(text)
+                vectors.append(vector)
+
+        n_hits = sum(vector is not None for vector in vectors)
+        # a text repeated within the batch is only fetched once
+        missing = list(
+            dict.fromkeys(
+                text for text, vector in zip(normalized, vectors) if vector is None
+            )
+        )
+        if missing:
+            fetched = {
+                text: [float(value) for value in vector]
+                for text, vector in zip(missing, fetch(missing))
+            }
+            with self._lock:
+                for text, vector in fetched.items():
+                    self._embeddings[text] = vector
+                while len(self._embeddings) > self.max_embeddings:
+                    self._embeddings.popitem(last=False)
+            vectors = [
+                vector if vector is not None else fetched[text]
+                for text, vector in zip(normalized, vectors)
+            ]
+
+        with self._lock:
+            self.embedding_hits += n_hits
+            self.embedding_misses += len(texts) - n_hits
+
+        return [list(cast(list[float], vector)) for vector in vectors]
+
+    def result_key(
+        self,
+        collection_name: str,
+        embeddings: Sequence[Sequence[float]],
+        n_results: int,
+        **kwargs: Any,
+    ) -> tuple:
+        """
+        Compute the key of a query's results at the collection's current version.
+
+        Args:
+            collection_name (str): The name of the queried collection.
+            embeddings (Sequence[Sequence[float]]): The query embeddings.
+            n_results (int): The number of results per query.
+            **kwargs: The other query arguments, e.g. ``where`` or ``include``. They must
+                      be JSON serializable.
+
+        Returns:
+            tuple: (collection, version, embeddings hash, n_results, arguments) key.
+        """
+        digest = hashlib.sha256()
+        for vector in embeddings:
+            digest.update(array("f", vector).tobytes())
+        arguments = json.dumps(kwargs, sort_keys=True, separators=(",", ":"))
+
+        with self._lock:
+            version = self._versions.get(collection_name, 0)
+
+        return (collection_name, version, digest.hexdigest(), n_results, arguments)
+
+    def get_result(self, key: tuple) -> Any | None:
+        """
+        Look up cached query results.
+
+        Args:
+            key (tuple): The key computed by ``result_key``.
+
+        Returns:
+            Any | None: A copy of the cached results, or None if they are not cached.
+        """
+        with self._lock:
+            results = self._results.get(key)
+            if results is None:
+                self.result_misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.result_hits += 1
+
+        # callers may modify what they get, keep the cached results intact
+        return copy.deepcopy(results)
+
+    def put_result(self, key: tuple, results: Any) -> None:
+        """
+        Store query results, unless the collection was written to since the key was made.
+
+        Args:
+            key (tuple): The key computed by ``result_key`` before the search.
+            results (Any): The query results.
+        """
+        collection_name, version = key[0], key[1]
+        with self._lock:
+            if self._versions.get(collection_name, 0) != version:
+                return
+            self._results[key] = copy.deepcopy(results)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def invalidate(self, collection_name: str) -> None:
+        """
+        Bump a collection's version after its data changed, dropping its cached results.
+
+        Args:
+            collection_name (str): The name of the collection that was written to.
+        """
+        with self._lock:
+            self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+            for key in [key for key in self._results if key[0] == collection_name]:
+                del self._results[key]
+
+    def stats(self) -> dict[str, int]:
+        """
+        Report cache effectiveness and size.
+
+        Returns:
+            dict[str, int]: Hit and miss counters of both caches plus their sizes.
+        """
+        with self._lock:
+            return {
+                "embedding_hits": self.embedding_hits,
+                "embedding_misses": self.embedding_misses,
+                "result_hits": self.result_hits,
+                "result_misses": self.result_misses,
+                "embeddings": len(self._embeddings),
+                "results": len(self._results),
+            }
@@ -0,0 +1,217 @@
+from openai.types.chat import ChatCompletionChunk
+from openai.types import CompletionUsage
+from rag_common.tracing import estimate_cost, tracer
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    TypedDict,
+)
+import time
+
+
+class StreamStats(TypedDict):
+    # seconds from the request to the first content token, None if none arrived
+    ttft: float | None
+    # seconds from the request to the end of the stream
+    total_time: float
+    prompt_tokens: int | None
+    completion_tokens: int
+
+
+class CompletionStream:
+    """
+    A streamed chat completion, yielding the text of every token as it arrives.
+
+    The stream wraps a function that sends the request with ``stream=True``. The request
+    is only sent once iteration starts, so the recorded timings measure what the user
+    waits for. Iterate with ``for`` when the function returns a ``Stream`` (``OpenAI``),
+    or with ``async for`` when it returns an awaitable ``AsyncStream`` (``AsyncOpenAI``).
+    A stream can be consumed once.
+
+    Token counts come from the usage the API reports at the end of the stream when the
+    request passes ``stream_options={"include_usage": True}``. Without it, the number of
+    content deltas is used, the API sends one token per delta.
+
+    When tracing is enabled, every stream is recorded as an "llm.stream" span with its
+    model, time to first token, token counts and estimated cost.
+
+    Attributes:
+        text (str): The text received so far.
+        stats (StreamStats | None): Timings and token counts, set once the stream ended
+                                    (or was abandoned).
+        usage (CompletionUsage | None): The usage reported by the API, if any.
+        finish_reason (str | None): Why the model stopped, e.g. "stop" or "length", as
+                                    reported with the last content chunk.
+        attributes (dict[str, Any]): Extra attributes of the stream's span, e.g.
+                                     ``cached`` set by a cache replaying the response.
+
+    Example:
+        >>> stream = CompletionStream(
+        ...     lambda: client.chat.completions.create(
+        ...         model="gpt-4.1-nano",
+        ...         messages=messages,
+        ...         stream=True,
+        ...         stream_options={"include_usage": True},
+        ...     )
+        ... )
+        >>> for delta in stream:
+        ...     print(delta, end="", flush=True)
+        >>> print(f"first token after {stream.stats['ttft']:.2f}s")
+    """
+
+    def __init__(
+        self,
+        create: Callable[[], Iterable[ChatCompletionChunk]]
+        | Callable[[], Awaitable[AsyncIterable[ChatCompletionChunk]]],
+        on_complete: Callable[["CompletionStream"], None] | None = None,
+    ) -> None:
+        """
+        Initialize the stream without sending the request.
+
+        Args:
+            create (Callable): Sends the streaming request and returns its chunks, either
+                               as an iterable or as an awaitable async iterable.
+            on_complete (Callable[[CompletionStream], None] | None, optional): Called with
+                the stream once it was consumed to the end, e.g. to cache the response.
+                It is not called when the consumer stops early or the request fails.
+                Defaults to None.
+        """
+        self.text = ""
+        self.stats: StreamStats | None = None
+        self.usage: CompletionUsage | None = None
+        self.finish_reason: str | None = None
+        self.attributes: dict[str, Any] = {}
+
+        self._create = create
+        self._on_complete = on_complete
+        self._consumed = False
+        self._started = 0.0
+        self._ttft: float | None = None
+        self._deltas = 0
+        self._model: str | None = None
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Send the request and yield the text of every token as it arrives.
+
+        Yields:
+            str: The text of the next content delta.
+
+        Raises:
+            RuntimeError: If the stream was already consumed.
+            TypeError: If the request function is asynchronous.
+        """
+        self.__start()
+        chunks = self._create()
+        if not isinstance(chunks, Iterable):
+            raise TypeError("The request function is asynchronous, use `async for`")
+
+        try:
+            for chunk in chunks:
+                delta = self.__record(chunk)
+                if delta:
+                    yield delta
+        finally:
+            # release the connection when the consumer stops early
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            self.__finish()
+
+        if self._on_complete is not None:
+            self._on_complete(self)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        """
+        Send the request and yield the text of every token as it arrives.
+
+        Yields:
+            str: The text of the next content delta.
+
+        Raises:
+            RuntimeError: If the stream was already consumed.
+            TypeError: If the request function is synchronous.
+        """
+        self.__start()
+        request = self._create()
+        if not isinstance(request, Awaitable):
+            raise TypeError("The request function is synchronous, use `for`")
+        chunks = await request
+
+        try:
+            async for chunk in chunks:
+                delta = self.__record(chunk)
+                if delta:
+                    yield delta
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                await close()
+            self.__finish()
+
+        if self._on_complete is not None:
+            self._on_complete(self)
+
+    def __start(self) -> None:
+        if self._consumed:
+            raise RuntimeError("The stream was already consumed")
+        self._consumed = True
+        self._started = time.perf_counter()
+
+    def __record(self, chunk: ChatCompletionChunk) -> str | None:
+        # the usage arrives in a final chunk without choices
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        self._model = chunk.model
+        if not chunk.choices:
+            return None
+
+        choice = chunk.choices[0]
+        if choice.finish_reason is not None:
+            self.finish_reason = choice.finish_reason
+        delta = choice.delta.content
+        if delta:
+            if self._ttft is None:
+                self._ttft = time.perf_counter() - self._started
+            self._deltas += 1
+            self.text += delta
+        return delta
+
+    def __finish(self) -> None:
+        self.stats = {
+            "ttft": self._ttft,
+            "total_time": time.perf_counter() - self._started,
+            "prompt_tokens": self.usage.prompt_tokens if self.usage else None,
+            "completion_tokens": (
+                self.usage.completion_tokens if self.usage else self._deltas
+            ),
+        }
+        if tracer.enabled:
+            self.__trace(self.stats)
+
+    def __trace(self, stats: StreamStats) -> None:
+        # a replayed response costs nothing, its tokens were paid for when cached
+        cost = (
+            0.0
+            if self.attributes.get("cached")
+            else estimate_cost(
+                self._model, stats["prompt_tokens"], stats["completion_tokens"]
+            )
+        )
+        tracer.record(
+            "llm.stream",
+            stats["total_time"],
+            model=self._model,
+            ttft_ms=round(stats["ttft"] * 1000, 3)
+            if stats["ttft"] is not None
+            else None,
+            prompt_tokens=stats["prompt_tokens"],
+            completion_tokens=stats["completion_tokens"],
+            cost_usd=cost,
+            **self.attributes,
+        )
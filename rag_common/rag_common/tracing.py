@@ -0,0 +1,527 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, ParamSpec, TypedDict, TypeVar, cast
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# usd per million tokens as (prompt, completion); model names are matched by their
+# longest known prefix, so dated snapshots ("gpt-4.1-nano-2025-04-14") are priced too
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "text-embedding-ada-002": (0.10, 0.0),
+}
+
+# upper bounds of the span duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class SpanRecord(TypedDict):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    # wall clock start, seconds since the epoch
+    start: float
+    duration_ms: float
+    # "ok", or "error" when the span ended with an exception
+    status: str
+    attributes: dict[str, Any]
+
+
+def estimate_cost(
+    model: str | None, prompt_tokens: int | None, completion_tokens: int | None = 0
+) -> float | None:
+    """
+    Estimate the price of a request from its token counts.
+
+    Args:
+        model (str | None): The model name.
+        prompt_tokens (int | None): Input tokens of the request.
+        completion_tokens (int | None, optional): Generated tokens. Defaults to 0.
+
+    Returns:
+        float | None: The price in usd, None if the model or the token counts are
+                      not known.
+
+    Example:
+        >>> estimate_cost("gpt-4.1-nano", 1_000_000, 100_000)
+        0.14
+    """
+    if model is None or prompt_tokens is None:
+        return None
+    known = [name for name in MODEL_PRICES if model.startswith(name)]
+    if not known:
+        return None
+
+    prompt_price, completion_price = MODEL_PRICES[max(known, key=len)]
+    cost = prompt_tokens * prompt_price + (completion_tokens or 0) * completion_price
+    return round(cost / 1_000_000, 8)
+
+
+class Span:
+    """
+    A timed stage of the pipeline, exported when it ends.
+
+    Use as a context manager (see ``Tracer.span``). Spans opened inside another span's
+    block, in the same thread or asyncio task, become its children.
+    """
+
+    __slots__ = (
+        "tracer",
+        "name",
+        "attributes",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "_start",
+        "_started",
+        "_token",
+    )
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = ""
+        self.parent_id: str | None = None
+
+    def set(self, **attributes: Any) -> None:
+        """
+        Add attributes to the span, e.g. results only known at its end.
+
+        Args:
+            **attributes: JSON serializable attribute values.
+        """
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.parent_id = parent.span_id if parent else None
+        self._token = _current_span.set(self)
+        self._start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        duration = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.attributes["error"] = f"{type(exc).__name__}: {exc}"
+        self.tracer.export(
+            {
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "start": self._start,
+                "duration_ms": round(duration * 1000, 3),
+                "status": "ok" if exc is None else "error",
+                "attributes": self.attributes,
+            }
+        )
+
+
+class _NoopSpan:
+    """
+    The span handed out while tracing is disabled; it records nothing.
+    """
+
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+# the innermost open span of the running thread or asyncio task
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class JsonlExporter:
+    """
+    Append every finished span as one JSON line to a file.
+
+    Attributes:
+        path (str): The trace file.
+    """
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, record: SpanRecord) -> None:
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusMetrics:
+    """
+    Aggregate finished spans into metrics in the Prometheus text format.
+
+    Every span name gets a duration histogram and an error counter. Spans carrying
+    ``model``, ``prompt_tokens``, ``completion_tokens`` and ``cost_usd`` attributes
+    (LLM and embedding calls) also add to per-model token and cost counters.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # span name -> (bucket counts, sum of durations, count, errors)
+        self._spans: dict[str, tuple[list[int], float, int, int]] = {}
+        self._tokens: dict[tuple[str, str], int] = {}
+        self._costs: dict[str, float] = {}
+
+    def export(self, record: SpanRecord) -> None:
+        seconds = record["duration_ms"] / 1000
+        attributes = record["attributes"]
+        with self._lock:
+            buckets, total, count, errors = self._spans.get(
+                record["name"], ([0] * len(DURATION_BUCKETS), 0.0, 0, 0)
+            )
+            # buckets hold the spans ending in them, the text format adds them up
+            index = bisect.bisect_left(DURATION_BUCKETS, seconds)
+            if index < len(buckets):
+                buckets[index] += 1
+            self._spans[record["name"]] = (
+                buckets,
+                total + seconds,
+                count + 1,
+                errors + (record["status"] == "error"),
+            )
+
+            model = attributes.get("model")
+            if model is None:
+                return
+            for kind in ("prompt", "completion"):
+                tokens = attributes.get(f"{kind}_tokens")
+                if tokens:
+                    key = (str(model), kind)
+                    self._tokens[key] = self._tokens.get(key, 0) + int(tokens)
+            cost = attributes.get("cost_usd")
+            if cost:
+                self._costs[str(model)] = self._costs.get(str(model), 0.0) + cost
+
+    def render(self) -> str:
+        """
+        Render the metrics collected so far.
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP rag_span_duration_seconds Duration of the traced pipeline stages.",
+            "# TYPE rag_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name, (buckets, total, count, _) in sorted(self._spans.items()):
+                cumulative = 0
+                for bound, n in zip(DURATION_BUCKETS, buckets):
+                    cumulative += n
+                    lines.append(
+                        f'rag_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(
+                    f'rag_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {count}'
+                )
+                lines.append(f'rag_span_duration_seconds_sum{{span="{name}"}} {total}')
+                lines.append(
+                    f'rag_span_duration_seconds_count{{span="{name}"}} {count}'
+                )
+
+            lines += [
+                "# HELP rag_span_errors_total Traced stages that raised an exception.",
+                "# TYPE rag_span_errors_total counter",
+            ]
+            for name, (_, _, _, errors) in sorted(self._spans.items()):
+                lines.append(f'rag_span_errors_total{{span="{name}"}} {errors}')
+
+            lines += [
+                "# HELP rag_llm_tokens_total Tokens sent to and generated by the api.",
+                "# TYPE rag_llm_tokens_total counter",
+            ]
+            for (model, kind), tokens in sorted(self._tokens.items()):
+                lines.append(
+                    f'rag_llm_tokens_total{{model="{model}",kind="{kind}"}} {tokens}'
+                )
+
+            lines += [
+                "# HELP rag_llm_cost_usd_total Estimated api cost in usd.",
+                "# TYPE rag_llm_cost_usd_total counter",
+            ]
+            for model, cost in sorted(self._costs.items()):
+                lines.append(f'rag_llm_cost_usd_total{{model="{model}"}} {cost:.8f}')
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """
+    Record timed spans of the pipeline stages and export them.
+
+    Tracing is disabled until ``configure`` enables an exporter. While it is disabled,
+    ``span`` returns a shared no-op span and ``traced`` functions call straight through,
+    so instrumented code pays about one attribute check per span.
+
+    Importing the module configures nothing. Entry points call ``configure_from_env``
+    once they parsed their flags, which falls back to the ``RAG_TRACE_FILE`` (JSONL trace
+    file) and ``RAG_METRICS_PORT`` (Prometheus endpoint) environment variables.
+
+    Attributes:
+        enabled (bool): Whether spans are recorded.
+        metrics (PrometheusMetrics | None): The aggregated metrics, when collected.
+
+    Example:
+        >>> tracer.configure(trace_file="traces.jsonl", metrics_port=9464)
+        >>> with tracer.span("db.query", collection="news") as span:
+        ...     results = collection.query(...)
+        ...     span.set(results=len(results))
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.metrics: PrometheusMetrics | None = None
+        self._exporters: list[JsonlExporter | PrometheusMetrics] = []
+        self._server: ThreadingHTTPServer | None = None
+
+    def configure(
+        self,
+        trace_file: str | None = None,
+        metrics_port: int | None = None,
+        collect_metrics: bool = False,
+    ) -> None:
+        """
+        Enable tracing with the given exporters, replacing the configured ones.
+
+        Args:
+            trace_file (str | None, optional): Append spans to this JSONL file.
+                                               Defaults to None.
+            metrics_port (int | None, optional): Serve the aggregated metrics on
+                                                 ``http://127.0.0.1:<port>/metrics``.
+                                                 Defaults to None.
+            collect_metrics (bool, optional): Aggregate the metrics even without a
+                                              port, for a server rendering ``metrics``
+                                              itself. Defaults to False.
+        """
+        self.close()
+        if trace_file:
+            self._exporters.append(JsonlExporter(trace_file))
+        if metrics_port or collect_metrics:
+            self.metrics = PrometheusMetrics()
+            self._exporters.append(self.metrics)
+        if metrics_port and self.metrics is not None:
+            self._server = serve_metrics(self.metrics, metrics_port)
+        self.enabled = bool(self._exporters)
+
+    def configure_from_env(
+        self,
+        trace_file: str | None = None,
+        metrics_port: int | None = None,
+        collect_metrics: bool = False,
+    ) -> None:
+        """
+        Enable tracing from command line flags, falling back to the environment.
+
+        Every exporter is configured from its flag, or from ``RAG_TRACE_FILE`` and
+        ``RAG_METRICS_PORT`` when the flag is not given, so a flag overrides its own
+        variable without dropping the exporter configured by the other one.
+
+        Args:
+            trace_file (str | None, optional): The ``--trace-file`` flag. Defaults to
+                                               None.
+            metrics_port (int | None, optional): The ``--metrics-port`` flag. Defaults
+                                                 to None.
+            collect_metrics (bool, optional): See ``configure``. Defaults to False.
+        """
+        self.configure(
+            trace_file=trace_file or os.getenv("RAG_TRACE_FILE"),
+            metrics_port=metrics_port or int(os.getenv("RAG_METRICS_PORT", 0)) or None,
+            collect_metrics=collect_metrics,
+        )
+
+    def close(self) -> None:
+        """
+        Disable tracing, closing the trace file and stopping the metrics endpoint.
+        """
+        self.enabled = False
+        for exporter in self._exporters:
+            if isinstance(exporter, JsonlExporter):
+                exporter.close()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self._exporters = []
+        self._server = None
+        self.metrics = None
+
+    def span(self, name: str, **attributes: Any) -> Span | _NoopSpan:
+        """
+        Open a span, to be used as a context manager.
+
+        Args:
+            name (str): The stage name, e.g. "db.query".
+            **attributes: JSON serializable attributes, more can be added with ``set``.
+
+        Returns:
+            Span | _NoopSpan: The span, a no-op span when tracing is disabled.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def record(
+        self, name: str, duration: float, start: float | None = None, **attributes: Any
+    ) -> None:
+        """
+        Export a span measured by the caller, e.g. the active time of a generator.
+
+        The span becomes a child of the span open in the calling context, if any.
+
+        Args:
+            name (str): The stage name.
+            duration (float): The duration in seconds.
+            start (float | None, optional): Wall clock start, seconds since the epoch.
+                                            Defaults to now minus the duration.
+            **attributes: JSON serializable attributes.
+        """
+        if not self.enabled:
+            return
+        parent = _current_span.get()
+        self.export(
+            {
+                "name": name,
+                "trace_id": parent.trace_id if parent else os.urandom(16).hex(),
+                "span_id": os.urandom(8).hex(),
+                "parent_id": parent.span_id if parent else None,
+                "start": start if start is not None else time.time() - duration,
+                "duration_ms": round(duration * 1000, 3),
+                "status": "ok",
+                "attributes": attributes,
+            }
+        )
+
+    def traced(self, name: str) -> Callable[[Callable[P, T]], Callable[P, T]]:
+        """
+        Decorate a function to run every call in a span.
+
+        Args:
+            name (str): The stage name.
+
+        Returns:
+            Callable[[Callable[P, T]], Callable[P, T]]: The decorator.
+        """
+
+        def decorator(function: Callable[P, T]) -> Callable[P, T]:
+            if inspect.iscoroutinefunction(function):
+                # the span has to cover the awaited body, not the coroutine creation
+                @functools.wraps(function)
+                async def awrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+                    if not self.enabled:
+                        return await function(*args, **kwargs)
+                    with Span(self, name, {}):
+                        return await function(*args, **kwargs)
+
+                return cast(Callable[P, T], awrapper)
+
+            @functools.wraps(function)
+            def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, name, {}):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def export(self, record: SpanRecord) -> None:
+        """
+        Hand a finished span to every exporter.
+
+        Args:
+            record (SpanRecord): The span.
+        """
+        for exporter in self._exporters:
+            exporter.export(record)
+
+
+def current_span() -> Span | None:
+    """
+    Get the innermost open span of the calling thread or asyncio task.
+
+    Returns:
+        Span | None: The span, None outside of any span or while tracing is disabled.
+    """
+    return _current_span.get()
+
+
+def serve_metrics(
+    metrics: PrometheusMetrics, port: int, host: str = "127.0.0.1"
+) -> ThreadingHTTPServer:
+    """
+    Serve metrics on ``/metrics`` from a background thread.
+
+    Args:
+        metrics (PrometheusMetrics): The metrics to serve.
+        port (int): Port to bind, 0 for any free port.
+        host (str, optional): Interface to bind. Defaults to "127.0.0.1".
+
+    Returns:
+        ThreadingHTTPServer: The running server, stop it with ``shutdown``.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.split("?")[0].rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("content-type", "text/plain; version=0.0.4")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+tracer = Tracer()
@@ -0,0 +1,674 @@
+from typing import Any, Literal, Sequence, TypedDict
+import argparse
+import json
+import numpy as np
+import os
+import time
+
+
+Quantization = Literal["float32", "float16", "int8"]
+
+# rows converted to float32 at a time when scoring compact codes, bounds the temporary
+ROW_BLOCK = 16384
+# candidates rescored at full precision per requested result
+DEFAULT_RESCORE = 4
+
+
+class IndexRecord(TypedDict):
+    document: str | None
+    metadata: dict[str, Any] | None
+
+
+class VectorIndex:
+    """
+    An exact nearest neighbour index over normalized float32 embeddings.
+
+    Embeddings are L2-normalized on insertion and kept as the rows of one contiguous
+    float32 matrix, so a batch of queries is answered with a single matrix product
+    followed by ``np.argpartition`` to select the top k of every query. The search is
+    brute force and therefore exact; for collections of up to a few hundred thousand
+    chunks it is also faster than walking an HNSW graph, and the index loads instantly.
+
+    The index persists to two files next to each other: ``<path>.npy`` holding the matrix
+    and ``<path>.json`` holding the row IDs, a record (document and metadata) per row and
+    the index metadata. The matrix is loaded with ``mmap_mode="r"``, so opening an index
+    costs no reads and the operating system pages the rows in as they are scanned. The
+    first write afterwards copies the matrix into memory.
+
+    With ``quantization="float16"`` or ``"int8"`` the search runs on a compact copy of the
+    matrix held in memory: half-precision floats, or 8-bit codes scaled per dimension
+    (``code = round(value / scale)``, with ``scale`` the largest magnitude of the dimension
+    divided by 127). The float32 matrix becomes a cold store that stays memory-mapped on
+    disk; the ``rescore * k`` best candidates of every query are read from it and
+    rescored at full precision, so the returned similarities are exact and only the
+    candidate selection is approximate. The codes persist to ``<path>.codes.npy``; int8
+    codes take a quarter of the memory of the float32 matrix.
+
+    With ``prefix=n`` the search is two-stage: the coarse stage scans only the first ``n``
+    dimensions of every embedding, renormalized to unit length, and the best candidates
+    are reranked with the full vectors. Matryoshka-trained models such as the
+    text-embedding-3 family concentrate the information in the leading dimensions, so a
+    256-dimensional prefix of a 1536-dimensional embedding keeps most of the ranking
+    quality at a sixth of the size and scan cost. A prefix can be combined with
+    quantization.
+
+    Attributes:
+        path (str | None): Path prefix of the index files, None for an in-memory index.
+        quantization (Quantization): Precision of the matrix the search runs on.
+        prefix (int | None): Number of leading dimensions the coarse stage scans, None
+                             to scan all of them.
+        rescore (int): Candidates rescored at full precision per requested result, 0 to
+                       return the similarities of the compact codes as they are.
+        ids (list[str]): The ID of every row.
+        records (list[IndexRecord]): The document and metadata of every row.
+        metadata (dict[str, Any]): Metadata of the index itself.
+
+    Example:
+        >>> index = VectorIndex("./numpy_db/docs")
+        >>> index.upsert(["a", "b"], embeddings, [{"document": "A", "metadata": None}] * 2)
+        >>> index.save()
+        >>> positions, similarities = index.search(query_embeddings, k=5)
+        >>> compact = VectorIndex("./numpy_db/docs", quantization="int8")
+        >>> print(compact.recall(query_embeddings, k=5))  # fraction of the exact top 5
+        >>> two_stage = VectorIndex("./numpy_db/docs", prefix=256)
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        quantization: Quantization = "float32",
+        rescore: int = DEFAULT_RESCORE,
+        prefix: int | None = None,
+    ) -> None:
+        """
+        Open the index stored at ``path``, or create an empty one.
+
+        Args:
+            path (str | None, optional): Path prefix of the index files. Defaults to None
+                                         (an in-memory index that cannot be saved).
+            quantization (Quantization, optional): Precision of the matrix the search runs
+                                                   on, "float32", "float16" or "int8".
+                                                   Defaults to "float32". Codes stored
+                                                   with another precision are rebuilt
+                                                   from the float32 matrix.
+            rescore (int, optional): Candidates rescored at full precision per requested
+                                     result, 0 to disable rescoring. Only used by
+                                     quantized or prefix indexes. Defaults to 4.
+            prefix (int | None, optional): Number of leading dimensions the coarse stage
+                                           scans. Defaults to None (no coarse stage).
+
+        Raises:
+            ValueError: If the quantization is not supported or the prefix is not
+                        positive.
+        """
+        if quantization not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported quantization {quantization}")
+        if prefix is not None and prefix < 1:
+            raise ValueError("prefix must be at least 1")
+
+        self.path = path
+        self.quantization: Quantization = quantization
+        self.rescore = rescore
+        self.prefix = prefix
+        self.ids: list[str] = []
+        self.records: list[IndexRecord] = []
+        self.metadata: dict[str, Any] = {}
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._positions: dict[str, int] = {}
+        # the matrix the search runs on and its per-dimension scale (int8 only),
+        # None while they have to be rebuilt from the float32 matrix
+        self._codes: np.ndarray | None = None
+        self._scale: np.ndarray | None = None
+
+        if path is not None and os.path.exists(f"{path}.json"):
+            with open(f"{path}.json", encoding="utf-8") as f:
+                sidecar = json.load(f)
+            self.ids = sidecar["ids"]
+            self.records = sidecar["records"]
+            self.metadata = sidecar["metadata"]
+            if self.ids:
+                self._matrix = np.load(f"{path}.npy", mmap_mode="r")
+            self._positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+
+            # the codes of a compact index are loaded into memory, they are what the
+            # search scans
+            if (
+                self.ids
+                and self.compact
+                and sidecar.get("quantization") == quantization
+                and sidecar.get("prefix") == self.__prefix()
+                and os.path.exists(f"{path}.codes.npy")
+            ):
+                self._codes = np.load(f"{path}.codes.npy")
+                if sidecar.get("scale") is not None:
+                    self._scale = np.array(sidecar["scale"], dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimension(self) -> int | None:
+        """
+        The dimensionality of the stored embeddings, None while the index is empty.
+        """
+        return self._matrix.shape[1] if len(self.ids) else None
+
+    @property
+    def compact(self) -> bool:
+        """
+        Whether the search scans codes (quantized or truncated) instead of the matrix.
+        """
+        return self.quantization != "float32" or self.__prefix() is not None
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory taken by the matrix the search runs on, in bytes.
+        """
+        return self.__search_matrix().nbytes if len(self.ids) else 0
+
+    @staticmethod
+    def normalize(embeddings: Sequence[Sequence[float]] | np.ndarray) -> np.ndarray:
+        """
+        Convert embeddings to a contiguous float32 matrix of unit-length rows.
+
+        Args:
+            embeddings (Sequence[Sequence[float]] | np.ndarray): One embedding per row.
+
+        Returns:
+            np.ndarray: The normalized (n, dimension) matrix. All-zero rows stay zero.
+        """
+        matrix = np.array(embeddings, dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return np.ascontiguousarray(matrix / norms)
+
+    def contains(self, ids: Sequence[str]) -> list[str]:
+        """
+        Filter IDs down to the ones stored in the index.
+
+        Args:
+            ids (Sequence[str]): The IDs to look up.
+
+        Returns:
+            list[str]: The stored IDs, in input order.
+        """
+        return [chunk_id for chunk_id in ids if chunk_id in self._positions]
+
+    def positions(self, ids: Sequence[str]) -> np.ndarray:
+        """
+        Look up the row positions of IDs, e.g. to restrict a search to them.
+
+        Args:
+            ids (Sequence[str]): The IDs to look up. IDs that are not stored are skipped.
+
+        Returns:
+            np.ndarray: The row positions, in input order.
+        """
+        return np.array(
+            [
+                self._positions[chunk_id]
+                for chunk_id in ids
+                if chunk_id in self._positions
+            ],
+            dtype=np.intp,
+        )
+
+    def upsert(
+        self,
+        ids: Sequence[str],
+        embeddings: Sequence[Sequence[float]] | np.ndarray,
+        records: Sequence[IndexRecord],
+    ) -> None:
+        """
+        Insert rows, replacing the embedding and record of IDs that are already stored.
+
+        Args:
+            ids (Sequence[str]): The ID of every row.
+            embeddings (Sequence[Sequence[float]] | np.ndarray): The embedding of every row.
+            records (Sequence[IndexRecord]): The document and metadata of every row.
+
+        Raises:
+            ValueError: If the arguments differ in length, or the embeddings do not match
+                        the dimensionality of the stored ones.
+        """
+        if not ids:
+            return
+        matrix = self.normalize(embeddings)
+        if not len(ids) == len(matrix) == len(records):
+            raise ValueError("ids, embeddings and records must have the same length")
+        if self.dimension is not None and matrix.shape[1] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {matrix.shape[1]} does not match the index "
+                f"dimension {self.dimension}"
+            )
+
+        # the last occurrence of an id within the batch wins, as with an upsert per row
+        latest = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        updates = [
+            (self._positions[chunk_id], i)
+            for chunk_id, i in latest.items()
+            if chunk_id in self._positions
+        ]
+        inserts = [
+            i for chunk_id, i in latest.items() if chunk_id not in self._positions
+        ]
+
+        if updates:
+            # a memory-mapped matrix is read only, work on an in-memory copy
+            if not self._matrix.flags.writeable:
+                self._matrix = np.array(self._matrix)
+            rows, sources = zip(*updates)
+            self._matrix[list(rows)] = matrix[list(sources)]
+            for row, i in updates:
+                self.records[row] = records[i]
+
+        if inserts:
+            base = self._matrix if len(self.ids) else matrix[:0]
+            self._matrix = np.concatenate([base, matrix[inserts]])
+            for i in inserts:
+                self._positions[ids[i]] = len(self.ids)
+                self.ids.append(ids[i])
+                self.records.append(records[i])
+
+        # quantize lazily, so a bulk load of many batches quantizes once
+        self._codes = None
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """
+        Remove rows by ID. IDs that are not stored are ignored.
+
+        Args:
+            ids (Sequence[str]): The IDs to remove.
+
+        Returns:
+            int: The number of removed rows.
+        """
+        doomed = {
+            self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions
+        }
+        if not doomed:
+            return 0
+
+        keep = [i for i in range(len(self.ids)) if i not in doomed]
+        self._matrix = np.ascontiguousarray(self._matrix[keep])
+        self.ids = [self.ids[i] for i in keep]
+        self.records = [self.records[i] for i in keep]
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        self._codes = None
+        return len(doomed)
+
+    def embeddings(self, positions: Sequence[int] | np.ndarray) -> np.ndarray:
+        """
+        Get the normalized embeddings of rows.
+
+        Args:
+            positions (Sequence[int] | np.ndarray): The row positions.
+
+        Returns:
+            np.ndarray: A (len(positions), dimension) float32 matrix.
+        """
+        return np.array(self._matrix[np.asarray(positions, dtype=np.intp)])
+
+    def filter(
+        self,
+        where: dict[str, Any] | None = None,
+        where_document: dict[str, Any] | None = None,
+    ) -> np.ndarray | None:
+        """
+        Select the rows matching Chroma-style metadata and document filters.
+
+        Metadata filters support field equality (``{"field": value}``), the ``$eq``,
+        ``$ne``, ``$gt``, ``$gte``, ``$lt``, ``$lte``, ``$in`` and ``$nin`` operators,
+        and ``$and`` / ``$or`` combinations. Document filters support ``$contains`` and
+        ``$not_contains`` and their ``$and`` / ``$or`` combinations.
+
+        Args:
+            where (dict[str, Any] | None, optional): Metadata filter. Defaults to None.
+            where_document (dict[str, Any] | None, optional): Document filter.
+                                                              Defaults to None.
+
+        Returns:
+            np.ndarray | None: The positions of the matching rows, or None if there is
+                               no filter (every row matches).
+
+        Raises:
+            ValueError: If a filter uses an unsupported operator.
+        """
+        if not where and not where_document:
+            return None
+
+        return np.array(
+            [
+                i
+                for i, record in enumerate(self.records)
+                if (not where or _match_metadata(record["metadata"] or {}, where))
+                and (
+                    not where_document
+                    or _match_document(record["document"] or "", where_document)
+                )
+            ],
+            dtype=np.intp,
+        )
+
+    def search(
+        self,
+        queries: Sequence[Sequence[float]] | np.ndarray,
+        k: int,
+        candidates: np.ndarray | None = None,
+        exact: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k rows most similar to every query.
+
+        Args:
+            queries (Sequence[Sequence[float]] | np.ndarray): One embedding per query.
+            k (int): Number of rows to return per query.
+            candidates (np.ndarray | None, optional): Positions of the rows to search,
+                                                      e.g. from ``filter``. Defaults to
+                                                      None (every row).
+            exact (bool, optional): Whether to search the full float32 matrix even if the
+                                    index is quantized or has a prefix. Defaults to False.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The (n_queries, k') row positions and cosine
+                                           similarities, best first, where k' is k capped
+                                           at the number of searched rows.
+
+        Raises:
+            ValueError: If the queries do not match the dimensionality of the index.
+        """
+        query_matrix = self.normalize(queries)
+        n_queries = len(query_matrix)
+        n_rows = len(self.ids) if candidates is None else len(candidates)
+        k = min(k, n_rows)
+        if k <= 0:
+            empty = np.empty((n_queries, 0))
+            return empty.astype(np.intp), empty.astype(np.float32)
+        if query_matrix.shape[1] != self.dimension:
+            raise ValueError(
+                f"Query dimension {query_matrix.shape[1]} does not match the index "
+                f"dimension {self.dimension}"
+            )
+
+        compact = self.compact and not exact
+        n_candidates = min(k * self.rescore, n_rows) if compact and self.rescore else k
+
+        if compact:
+            prefix = self.__prefix()
+            coarse = query_matrix if prefix is None else query_matrix[:, :prefix]
+            similarities = self.__similarities(self.normalize(coarse), candidates)
+        else:
+            rows = self._matrix if candidates is None else self._matrix[candidates]
+            similarities = query_matrix @ rows.T
+        top, top_similarities = _top_k(similarities, n_candidates)
+        if candidates is not None:
+            top = candidates[top]
+
+        if compact and self.rescore:
+            # read the candidates from the float32 cold store and rank them exactly
+            rows = np.asarray(self._matrix[top.ravel()], dtype=np.float32)
+            rows = rows.reshape(n_queries, n_candidates, -1)
+            top_similarities = np.einsum("qd,qcd->qc", query_matrix, rows)
+            order = np.argsort(-top_similarities, axis=1, kind="stable")[:, :k]
+            top = np.take_along_axis(top, order, axis=1)
+            top_similarities = np.take_along_axis(top_similarities, order, axis=1)
+
+        return top, top_similarities
+
+    def recall(self, queries: Sequence[Sequence[float]] | np.ndarray, k: int) -> float:
+        """
+        Measure how much of the exact top k the (quantized) search finds.
+
+        Args:
+            queries (Sequence[Sequence[float]] | np.ndarray): One embedding per query.
+            k (int): Number of rows per query.
+
+        Returns:
+            float: The fraction of the exact top k rows of every query returned by
+                   ``search``, 1.0 for an index without quantization or prefix.
+        """
+        found, _ = self.search(queries, k)
+        expected, _ = self.search(queries, k, exact=True)
+        if not expected.size:
+            return 1.0
+
+        hits = sum(
+            len(set(row.tolist()) & set(reference.tolist()))
+            for row, reference in zip(found, expected)
+        )
+        return hits / expected.size
+
+    def save(self) -> None:
+        """
+        Persist the index atomically to ``<path>.npy`` and ``<path>.json``.
+
+        A quantized or prefix index also writes its codes to ``<path>.codes.npy`` and maps
+        the float32 matrix back from disk afterwards, so it does not stay in memory.
+
+        Raises:
+            ValueError: If the index has no path.
+        """
+        if self.path is None:
+            raise ValueError("An in-memory index cannot be saved")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        quantized = self.compact and len(self.ids) > 0
+
+        # np.save appends ".npy" to names without it, so the temporary names keep it
+        with open(f"{self.path}.tmp.npy", "wb") as f:
+            np.save(f, np.ascontiguousarray(self._matrix, dtype=np.float32))
+        if quantized:
+            with open(f"{self.path}.codes.tmp.npy", "wb") as f:
+                np.save(f, self.__search_matrix())
+        with open(f"{self.path}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "ids": self.ids,
+                    "records": self.records,
+                    "metadata": self.metadata,
+                    "quantization": self.quantization if quantized else "float32",
+                    "prefix": self.__prefix() if quantized else None,
+                    "scale": None if self._scale is None else self._scale.tolist(),
+                },
+                f,
+            )
+
+        # the matrix is replaced first, a crash in between leaves it ahead of its ids,
+        # which the next save repairs
+        if isinstance(self._matrix, np.memmap):
+            self._matrix = np.array(self._matrix)
+        os.replace(f"{self.path}.tmp.npy", f"{self.path}.npy")
+        if quantized:
+            os.replace(f"{self.path}.codes.tmp.npy", f"{self.path}.codes.npy")
+            self._matrix = np.load(f"{self.path}.npy", mmap_mode="r")
+        os.replace(f"{self.path}.json.tmp", f"{self.path}.json")
+
+    def __search_matrix(self) -> np.ndarray:
+        """
+        Get the matrix the search runs on, truncating and quantizing the float32 matrix
+        if needed.
+        """
+        if not self.compact:
+            return self._matrix
+        if self._codes is None:
+            prefix = self.__prefix()
+            matrix = (
+                self._matrix
+                if prefix is None
+                else self.normalize(self._matrix[:, :prefix])
+            )
+            self._codes, self._scale = _quantize(matrix, self.quantization)
+        return self._codes
+
+    def __prefix(self) -> int | None:
+        """
+        Get the prefix length, None if it does not truncate the stored embeddings.
+        """
+        dimension = self.dimension
+        if self.prefix is None or (dimension is not None and self.prefix >= dimension):
+            return None
+        return self.prefix
+
+    def __similarities(
+        self, query_matrix: np.ndarray, candidates: np.ndarray | None
+    ) -> np.ndarray:
+        """
+        Score normalized queries against the compact codes, block by block.
+        """
+        codes = self.__search_matrix()
+        if candidates is not None:
+            codes = codes[candidates]
+        # scaling the queries instead of the codes keeps the codes untouched,
+        # (q * scale) . code == q . (code * scale)
+        if self._scale is not None:
+            query_matrix = query_matrix * self._scale
+
+        similarities = np.empty((len(query_matrix), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), ROW_BLOCK):
+            block = codes[start : start + ROW_BLOCK].astype(np.float32, copy=False)
+            similarities[:, start : start + ROW_BLOCK] = query_matrix @ block.T
+        return similarities
+
+
+def _top_k(similarities: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    n_queries, n_rows = similarities.shape
+    if k < n_rows:
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(n_rows), (n_queries, n_rows))
+    top_similarities = np.take_along_axis(similarities, top, axis=1)
+
+    # argpartition leaves the top k unordered
+    order = np.argsort(-top_similarities, axis=1, kind="stable")
+    return (
+        np.take_along_axis(top, order, axis=1),
+        np.take_along_axis(top_similarities, order, axis=1),
+    )
+
+
+def _quantize(
+    matrix: np.ndarray, quantization: Quantization
+) -> tuple[np.ndarray, np.ndarray | None]:
+    # returns the codes and, for int8, the per-dimension scale that restores the values
+    if quantization == "float32":
+        return np.ascontiguousarray(matrix, dtype=np.float32), None
+    if quantization == "float16":
+        return np.asarray(matrix, dtype=np.float16), None
+
+    scale = np.abs(matrix).max(axis=0).astype(np.float32) / 127
+    scale[scale == 0] = 1
+    codes = np.clip(np.rint(matrix / scale), -127, 127).astype(np.int8)
+    return codes, scale
+
+
+def _match_metadata(metadata: dict[str, Any], where: dict[str, Any]) -> bool:
+    comparisons = {
+        "$eq": lambda value, target: value == target,
+        "$ne": lambda value, target: value != target,
+        "$gt": lambda value, target: value is not None and value > target,
+        "$gte": lambda value, target: value is not None and value >= target,
+        "$lt": lambda value, target: value is not None and value < target,
+        "$lte": lambda value, target: value is not None and value <= target,
+        "$in": lambda value, target: value in target,
+        "$nin": lambda value, target: value not in target,
+    }
+
+    for field, condition in where.items():
+        if field == "$and":
+            matched = all(_match_metadata(metadata, clause) for clause in condition)
+        elif field == "$or":
+            matched = any(_match_metadata(metadata, clause) for clause in condition)
+        elif isinstance(condition, dict):
+            matched = True
+            for operator, target in condition.items():
+                if operator not in comparisons:
+                    raise ValueError(f"Unsupported metadata filter operator {operator}")
+                matched = matched and comparisons[operator](metadata.get(field), target)
+        else:
+            matched = metadata.get(field) == condition
+        if not matched:
+            return False
+    return True
+
+
+def _match_document(document: str, where_document: dict[str, Any]) -> bool:
+    for operator, target in where_document.items():
+        if operator == "$contains":
+            matched = target in document
+        elif operator == "$not_contains":
+            matched = target not in document
+        elif operator == "$and":
+            matched = all(_match_document(document, clause) for clause in target)
+        elif operator == "$or":
+            matched = any(_match_document(document, clause) for clause in target)
+        else:
+            raise ValueError(f"Unsupported document filter operator {operator}")
+        if not matched:
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    # report the memory and recall@k of every search mode on one set of embeddings
+    parser = argparse.ArgumentParser(description="Benchmark compact vector search")
+    parser.add_argument(
+        "--index",
+        help="path prefix of a saved index to measure (default: synthetic embeddings)",
+    )
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--prefix", type=int, default=256)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.index:
+        stored = VectorIndex(args.index)
+        matrix = stored.embeddings(np.arange(len(stored)))
+    else:
+        # clustered unit vectors, closer to real embeddings than uniform noise; the
+        # variance decays along the dimensions like in a Matryoshka-trained embedding
+        decay = 1 / np.sqrt(1 + np.arange(args.dimension) / 64)
+        centers = rng.standard_normal((args.rows // 50 + 1, args.dimension))
+        matrix = centers[rng.integers(len(centers), size=args.rows)]
+        matrix = (matrix + 0.5 * rng.standard_normal(matrix.shape)) * decay
+    matrix = VectorIndex.normalize(matrix)
+    # queries are perturbed rows, so every query has close neighbours
+    queries = matrix[rng.integers(len(matrix), size=args.queries)]
+    queries = VectorIndex.normalize(
+        queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    )
+
+    ids = [str(i) for i in range(len(matrix))]
+    records: list[IndexRecord] = [{"document": None, "metadata": None}] * len(ids)
+    print(f"{len(matrix)} rows x {matrix.shape[1]} dimensions, {args.queries} queries")
+
+    modes: list[tuple[Quantization, int | None, int]] = [
+        ("float32", None, 0),
+        ("float16", None, 0),
+        ("float16", None, DEFAULT_RESCORE),
+        ("int8", None, 0),
+        ("int8", None, DEFAULT_RESCORE),
+        ("float32", args.prefix, 0),
+        ("float32", args.prefix, DEFAULT_RESCORE),
+        ("int8", args.prefix, DEFAULT_RESCORE),
+    ]
+    for quantization, prefix, rescore in modes:
+        index = VectorIndex(quantization=quantization, rescore=rescore, prefix=prefix)
+        index.upsert(ids, matrix, records)
+        index.search(queries[:1], args.k)  # build the codes before timing
+
+        started = time.perf_counter()
+        index.search(queries, args.k)
+        elapsed = time.perf_counter() - started
+
+        label = quantization + (f" / {prefix} dims" if prefix else "")
+        label += f" + rescore x{rescore}" if rescore else ""
+        print(
+            f"{label:<34} index {index.nbytes / 2**20:7.1f} MiB  "
+            f"recall@{args.k} {index.recall(queries, args.k):.4f}  "
+            f"{elapsed / args.queries * 1000:.2f}ms/query"
+        )
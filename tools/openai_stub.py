@@ -0,0 +1,333 @@
+"""
+A local, OpenAI-compatible stub server for exercising the RAG projects offline.
+
+The server implements the embeddings endpoint with deterministic, hash-based unit
+vectors and the chat completions endpoint (plain and streamed) with deterministic
+answers, and can inject latency, rate limit (429) and server (500) errors, which makes
+it possible to test batching, caching, concurrency, retry behaviour and end-to-end
+latency without network access or api costs. It only depends on the standard library.
+
+Usage:
+    python tools/openai_stub.py --port 8765 --latency-ms 50 --rate-limit-ratio 0.1
+    python tools/openai_stub.py --port 8765 --latency-ms 300 --token-latency-ms 10
+
+    # then, in another shell, point the OpenAI clients at it
+    export OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+
+
+DEFAULT_DIMENSIONS = 1536
+# lines of every chat answer, so multi-query expansion parses several subqueries
+ANSWER_LINES = 3
+
+
+def stub_embedding(text: str, dimensions: int = DEFAULT_DIMENSIONS) -> list[float]:
+    """
+    Derive a deterministic unit vector from a text.
+
+    Identical texts always map to the same vector, different texts to (almost)
+    orthogonal ones, so retrieval over stub embeddings is reproducible.
+
+    Args:
+        text (str): The text to embed.
+        dimensions (int, optional): Length of the vector. Defaults to 1536.
+
+    Returns:
+        list[float]: An L2-normalised vector.
+    """
+    digest = hashlib.shake_256(text.encode("utf-8")).digest(dimensions)
+    vector = [byte - 127.5 for byte in digest]
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector]
+
+
+def stub_completion(messages: list[dict]) -> str:
+    """
+    Derive a deterministic chat answer from the conversation.
+
+    The answer has ``ANSWER_LINES`` lines restating the last user message, so the same
+    prompt always gets the same answer and different prompts get different ones.
+
+    Args:
+        messages (list[dict]): The chat messages of the request.
+
+    Returns:
+        str: The answer text.
+    """
+    question = next(
+        (
+            str(message.get("content", ""))
+            for message in reversed(messages)
+            if message.get("role") == "user"
+        ),
+        "",
+    )
+    topic = " ".join(question.split()[:24])
+    return "\n".join(f"Stub answer {i + 1} about {topic}" for i in range(ANSWER_LINES))
+
+
+class StubState:
+    """
+    Configuration and counters shared by all request handlers.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float,
+        rate_limit_ratio: float,
+        server_error_ratio: float,
+        token_latency_ms: float = 0,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self.server_error_ratio = server_error_ratio
+        self.token_latency_ms = token_latency_ms
+        self.lock = threading.Lock()
+        self.counters = {
+            "requests": 0,
+            "inputs": 0,
+            "completions": 0,
+            "completion_tokens": 0,
+            "rate_limited": 0,
+            "errors": 0,
+        }
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += amount
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState
+
+    def log_message(self, format: str, *args) -> None:
+        # keep the console quiet, the counters are exposed on /stats
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.state.lock:
+                self.__send_json(200, dict(self.state.counters))
+        else:
+            self.__send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("content-length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.state.count("requests")
+
+        if self.state.latency_ms:
+            time.sleep(self.state.latency_ms / 1000)
+
+        # inject failures before doing any work, like an overloaded server would
+        roll = random.random()
+        if roll < self.state.rate_limit_ratio:
+            self.state.count("rate_limited")
+            self.__send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                headers={"retry-after": "0.1"},
+            )
+            return
+        if roll < self.state.rate_limit_ratio + self.state.server_error_ratio:
+            self.state.count("errors")
+            self.__send_json(500, {"error": {"message": "Internal server error"}})
+            return
+
+        if self.path.rstrip("/").endswith("/embeddings"):
+            self.__embeddings(body)
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self.__chat_completion(body)
+        else:
+            self.__send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def __embeddings(self, body: dict) -> None:
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = body.get("dimensions") or DEFAULT_DIMENSIONS
+        self.state.count("inputs", len(inputs))
+
+        n_tokens = sum(len(text.split()) for text in inputs)
+        self.__send_json(
+            200,
+            {
+                "object": "list",
+                "model": body.get("model", ""),
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": i,
+                        "embedding": stub_embedding(text, dimensions),
+                    }
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+            },
+        )
+
+    def __chat_completion(self, body: dict) -> None:
+        messages = body.get("messages", [])
+        # answer words, each counted as one token, the first without its leading space
+        words = stub_completion(messages).split(" ")
+        tokens = [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+        prompt_tokens = sum(
+            len(str(message.get("content", "")).split()) for message in messages
+        )
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        self.state.count("completions")
+        self.state.count("completion_tokens", len(tokens))
+
+        base = {
+            "id": "chatcmpl-stub",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+        }
+        if not body.get("stream"):
+            # a plain answer takes as long as streaming all of its tokens would
+            if self.state.token_latency_ms:
+                time.sleep(self.state.token_latency_ms * len(tokens) / 1000)
+            self.__send_json(
+                200,
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {
+                                "role": "assistant",
+                                "content": "".join(tokens),
+                            },
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.end_headers()
+        # the stream has no content length, so the connection ends with it
+        self.close_connection = True
+
+        def send_event(payload: dict | str) -> None:
+            data = payload if isinstance(payload, str) else json.dumps(payload)
+            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        base["object"] = "chat.completion.chunk"
+        for token in tokens:
+            if self.state.token_latency_ms:
+                time.sleep(self.state.token_latency_ms / 1000)
+            send_event(
+                {
+                    **base,
+                    "choices": [
+                        {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                    ],
+                }
+            )
+        send_event(
+            {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        )
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send_event({**base, "choices": [], "usage": usage})
+        send_event("[DONE]")
+
+    def __send_json(
+        self, status: int, payload: dict, headers: dict[str, str] | None = None
+    ) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_server(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    latency_ms: float = 0,
+    rate_limit_ratio: float = 0,
+    server_error_ratio: float = 0,
+    token_latency_ms: float = 0,
+) -> ThreadingHTTPServer:
+    """
+    Create a stub server; call ``serve_forever`` on the result to start it.
+
+    Args:
+        host (str, optional): Interface to bind. Defaults to "127.0.0.1".
+        port (int, optional): Port to bind, 0 for any free port. Defaults to 8765.
+        latency_ms (float, optional): Delay added to every request, i.e. the time to
+                                      first token of chat completions. Defaults to 0.
+        rate_limit_ratio (float, optional): Fraction of requests answered with 429.
+                                            Defaults to 0.
+        server_error_ratio (float, optional): Fraction of requests answered with 500.
+                                              Defaults to 0.
+        token_latency_ms (float, optional): Delay per generated chat token. Defaults
+                                            to 0.
+
+    Returns:
+        ThreadingHTTPServer: The bound, not yet serving, server.
+    """
+    handler = type(
+        "BoundStubHandler",
+        (StubHandler,),
+        {
+            "state": StubState(
+                latency_ms, rate_limit_ratio, server_error_ratio, token_latency_ms
+            )
+        },
+    )
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0)
+    parser.add_argument("--server-error-ratio", type=float, default=0)
+    parser.add_argument("--token-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host,
+        args.port,
+        args.latency_ms,
+        args.rate_limit_ratio,
+        args.server_error_ratio,
+        args.token_latency_ms,
+    )
+    print(
+        f"OpenAI stub listening on http://{args.host}:{server.server_port}/v1",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()